@@ -0,0 +1,65 @@
+"""Latency of generation on adversarial prompts, with and without length bounds in the schema.
+
+Usage: python benchmarks/bounded_grammars.py MODEL.gguf [--runs 20] [--max-tokens 2048]
+"""
+import time
+import argparse
+from typing import Annotated
+
+import numpy as np
+from pydantic import BaseModel, Field
+
+from ai_den.llama_cpp import LlamaCpp
+from ai_den.llama_cpp.data_type import DataType
+
+
+class Unbounded(BaseModel):
+    names: list[str]
+    summary: str
+    score: float
+
+
+class Bounded(BaseModel):
+    names: Annotated[list[Annotated[str, Field(max_length=32)]], Field(max_length=8)]
+    summary: Annotated[str, Field(max_length=200)]
+    score: Annotated[float, Field(ge=0, le=1, multiple_of=0.01)]
+
+
+# prompts that invite runaway lists, strings and numbers
+PROMPTS = [
+    'List the name of every person who ever lived, then summarize all of human history in detail.',
+    'Repeat the word "buffalo" as many times as you can in the summary, and list every buffalo you know.',
+    'Write the score with as many digits of pi as you can, and list all the prime numbers as names.',
+]
+
+
+def run(llm: LlamaCpp, data_type: DataType, runs: int, max_tokens: int) -> tuple[np.ndarray, np.ndarray]:
+    grammar = data_type.llama_grammar()
+    latencies, lengths = [], []
+    for i in range(runs):
+        prompt = PROMPTS[i % len(PROMPTS)]
+        start = time.perf_counter()
+        text = ''.join(llm.stream(prompt, grammar=grammar, max_tokens=max_tokens, temperature=0.8, seed=i))
+        latencies.append(time.perf_counter() - start)
+        lengths.append(len(llm.tokenizer.encode(text, add_special_tokens=False)))
+    return np.array(latencies), np.array(lengths)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('model_path')
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--max-tokens', type=int, default=2048)
+    args = parser.parse_args()
+    llm = LlamaCpp(args.model_path)
+    for name, data_type in ('unbounded', DataType(Unbounded)), ('bounded', DataType(Bounded)):
+        latencies, lengths = run(llm, data_type, args.runs, args.max_tokens)
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        print(
+            f'{name:>9}: p50 {p50:.2f}s  p95 {p95:.2f}s  p99 {p99:.2f}s  max {latencies.max():.2f}s  '
+            f'tokens mean {lengths.mean():.0f} max {lengths.max()}  hit max_tokens {(lengths >= args.max_tokens).sum()}'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""Parsing time of gen_conll_file against the original whole-file parser, on a synthetic corpus.
+
+Usage: python benchmarks/conll_parser.py [--sequences 600000] [--seed 0]
+"""
+import re
+import random
+import tempfile
+import argparse
+import time
+from pathlib import Path
+from typing import Optional
+
+from ai_den.utils.datasets import gen_conll_file
+
+
+TAGS = ['O'] * 6 + ['B-PER', 'I-PER', 'B-LOC', 'I-LOC', 'B-ORG', 'I-ORG']
+DOCUMENT_SEPARATOR = '-DOCSTART-'
+
+
+def write_corpus(path: Path, num_sequences: int, seed: int):
+    rng = random.Random(seed)
+    words = [''.join(rng.choices('abcdefghijklmnopqrstuvwxyz', k=rng.randint(1, 10))) for _ in range(5000)]
+    with open(path, 'w', encoding='utf-8') as f:
+        for i in range(num_sequences):
+            if i % 100 == 0:
+                f.write(f'{DOCUMENT_SEPARATOR}\tO\n\n')
+            if i % 50 == 0:
+                f.write(f'# sequence {i}\n')
+            for _ in range(rng.randint(5, 30)):
+                f.write(f'{rng.choice(words)}\t{rng.choice(TAGS)}\n')
+            f.write('\n')
+
+
+def original_gen_conll_file(
+        path: Path,
+        columns: dict[str, int],
+        comment_symbol: Optional[str] = '#',
+        field_separator: str = '\t',
+        sequence_separator: str = '\n\\s*\n',
+        document_separator: Optional[str] = None,
+        document_separator_field: str = 'text',
+):
+    # gen_conll_file before the fast path, reading the whole file at once
+    text = path.read_text('utf-8', 'replace').strip()
+    for entry in re.split(sequence_separator, text):
+        fields = dict()
+        for line in entry.splitlines():
+            if comment_symbol is not None and line.startswith(comment_symbol):
+                continue
+            line_entries = re.split(field_separator, line)
+            for name, i in columns.items():
+                if name not in fields:
+                    fields[name] = []
+                fields[name].append(line_entries[i])
+        if not fields:
+            continue
+        if any(entry == document_separator for entry in fields[document_separator_field]):
+            continue
+        yield fields
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sequences', type=int, default=600_000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    columns = {'text': 0, 'tags': 1}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = Path(tmp_dir) / 'corpus.conll'
+        write_corpus(path, args.sequences, args.seed)
+        print(f'corpus: {path.stat().st_size / 2**20:.0f} MB, {args.sequences:,} sequences')
+        results = {}
+        for name, gen in ('original', original_gen_conll_file), ('fast path', gen_conll_file):
+            start = time.perf_counter()
+            results[name] = list(gen(path, columns, document_separator=DOCUMENT_SEPARATOR))
+            print(f'{name:>9}: {time.perf_counter() - start:.2f}s')
+        print(f'identical output: {results["original"] == results["fast path"]}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""Peak memory and time of read_json against from_json on the whole file.
+
+Usage: python benchmarks/json_reader.py [--records 200000] [--num-proc 2]
+"""
+import time
+import argparse
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+from ai_den.utils.dataclasses import from_data, from_json, read_json, write_json
+from records import Record, make_record_dicts
+
+
+def count(objs) -> int:
+    return sum(1 for _ in objs)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--records', type=int, default=200_000)
+    parser.add_argument('--num-proc', type=int, default=2)
+    args = parser.parse_args()
+    objs = from_data(Record, make_record_dicts(args.records))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        array_path, lines_path = Path(tmp_dir) / 'records.json', Path(tmp_dir) / 'records.jsonl'
+        write_json(objs, array_path, lines=False)
+        write_json(objs, lines_path)
+        del objs
+        print(f'{args.records:,} records, {array_path.stat().st_size / 2**20:.0f} MB array')
+        for name, fn in (
+            ('from_json, whole file', lambda: len(from_json(Record, array_path.read_text(encoding='utf-8')))),
+            ('read_json, array', lambda: count(read_json(Record, array_path))),
+            ('read_json, JSONL', lambda: count(read_json(Record, lines_path))),
+            (f'read_json, JSONL, num_proc={args.num_proc}', lambda: count(read_json(Record, lines_path, num_proc=args.num_proc))),
+        ):
+            start = time.perf_counter()
+            n = fn()
+            seconds = time.perf_counter() - start
+            # tracing slows allocations down a lot, so memory is measured in a second run
+            tracemalloc.start()
+            fn()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f'{name:>29}: {n:,} records in {seconds:.2f}s, {peak / 2**20:.1f} MB peak traced memory')
+
+
+if __name__ == '__main__':
+    main()
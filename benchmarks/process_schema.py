@@ -0,0 +1,101 @@
+"""Time and output size of process_schema against the jsonref pipeline it replaced.
+
+Usage: python benchmarks/process_schema.py [--fields 30] [--repeat 20]
+"""
+import copy
+import json
+import timeit
+import argparse
+from typing import Any, Optional
+
+import jsonref
+from pydantic import BaseModel, create_model
+
+from ai_den.utils.json_schema import process_schema
+
+
+class Address(BaseModel):
+    """A postal address."""
+    street: str
+    city: str
+    country: Optional[str] = None
+
+
+class Person(BaseModel):
+    """A person and where they live."""
+    name: str
+    home: Address
+    work: Optional[Address] = None
+
+
+class Organization(BaseModel):
+    """An organization with its members."""
+    name: str
+    address: Address
+    members: list[Person]
+
+
+def make_model(num_fields: int) -> type[BaseModel]:
+    # every field reuses the shared definitions, as in large extraction schemas
+    fields = {f'field_{i}': (Organization if i % 2 else Person, ...) for i in range(num_fields)}
+    return create_model('Document', **fields)
+
+
+def jsonref_pipeline(schema: dict[str, Any]) -> dict[str, Any]:
+    # process_schema before it was made single-pass
+    schema = jsonref.replace_refs(schema, proxies=False)
+    delete_entry(schema, '$defs')
+    delete_entry(schema, 'title')
+    flatten_entry(schema, 'allOf')
+    return schema
+
+
+def delete_entry(obj: Any, name: str) -> None:
+    if isinstance(obj, dict):
+        if name in obj:
+            del obj[name]
+        for k, v in obj.items():
+            if k == 'properties':
+                for x in v.values():
+                    delete_entry(x, name)
+            else:
+                delete_entry(v, name)
+    elif isinstance(obj, list):
+        for x in obj:
+            delete_entry(x, name)
+
+
+def flatten_entry(obj: Any, name: str):
+    if isinstance(obj, dict):
+        clauses = obj.get(name, [])
+        if len(clauses) == 1:
+            obj.pop(name)
+            obj.update(clauses[0])
+        for x in obj.values():
+            flatten_entry(x, name)
+    elif isinstance(obj, list):
+        for x in obj:
+            flatten_entry(x, name)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--fields', type=int, default=30)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    schema = make_model(args.fields).model_json_schema()
+    old = jsonref_pipeline(copy.deepcopy(schema))
+    new = process_schema(schema)
+    print(f'identical output: {json.dumps(old) == json.dumps(new)}')
+    # the old pipeline mutates its input, so both are timed on a fresh copy
+    for name, fn in ('jsonref pipeline', jsonref_pipeline), ('single pass', process_schema):
+        seconds = min(timeit.repeat(lambda: fn(copy.deepcopy(schema)), number=1, repeat=args.repeat))
+        copy_seconds = min(timeit.repeat(lambda: copy.deepcopy(schema), number=1, repeat=args.repeat))
+        print(f'{name:>16}: {1000 * (seconds - copy_seconds):.2f}ms')
+    for inline_shared in True, False:
+        size = len(json.dumps(process_schema(schema, inline_shared=inline_shared)))
+        print(f'inline_shared={inline_shared}: {size:,} chars')
+
+
+if __name__ == '__main__':
+    main()
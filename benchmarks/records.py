@@ -0,0 +1,46 @@
+"""Nested records shared by the dataclass benchmarks."""
+import random
+from dataclasses import dataclass, field
+from typing import Any, Literal, Optional
+
+
+@dataclass
+class Entity:
+    text: str
+    label: Literal['PER', 'LOC', 'ORG']
+    start: int
+    end: int
+    score: float = 1.0
+
+
+@dataclass
+class Parent:
+    id: str
+    source: Optional[str] = None
+
+
+@dataclass
+class Record:
+    id: str
+    text: str
+    entities: list[Entity]
+    attributes: dict[str, list[str]] = field(default_factory=dict)
+    parent: Optional[Parent] = None
+
+
+def make_record_dicts(n: int, seed: int = 0) -> list[dict[str, Any]]:
+    """Returns n records as parsed json, each with two entities, a dict of lists, and usually a parent."""
+    rng = random.Random(seed)
+    return [
+        {
+            'id': f'record-{i}',
+            'text': f'Sentence {i} mentions Ada Lovelace in London.',
+            'entities': [
+                {'text': 'Ada Lovelace', 'label': 'PER', 'start': 3, 'end': 5, 'score': rng.random()},
+                {'text': 'London', 'label': 'LOC', 'start': 6, 'end': 7},
+            ],
+            'attributes': {'topics': ['history', 'math'], 'tags': [str(rng.randrange(100))]},
+            'parent': {'id': f'document-{i // 10}', 'source': 'wiki'} if i % 4 else None,
+        }
+        for i in range(n)
+    ]
@@ -0,0 +1,87 @@
+"""Time of SpanEvaluator against per-sentence Python span matching, on random BIO tags.
+
+Usage: python benchmarks/span_evaluation.py [--sequences 20000] [--batch-size 1000] [--seed 0]
+"""
+import time
+import random
+import argparse
+from collections import Counter
+
+from ai_den.utils.ner import LabelVocabulary, Spans
+from ai_den.utils.evaluation import SpanEvaluator
+
+
+TYPES = ['PER', 'LOC', 'ORG', 'MISC']
+
+
+def random_tags(rng: random.Random, length: int) -> list[str]:
+    tags = []
+    while len(tags) < length:
+        if rng.random() < 0.7:
+            tags.append('O')
+            continue
+        entity_type = rng.choice(TYPES)
+        tags += [f'B-{entity_type}'] + [f'I-{entity_type}'] * rng.randint(0, 3)
+    return tags[:length]
+
+
+def perturb(rng: random.Random, tags: list[str]) -> list[str]:
+    # predictions that are mostly right, with some boundaries and types changed
+    return [rng.choice(['O', f'B-{rng.choice(TYPES)}', f'I-{rng.choice(TYPES)}']) if rng.random() < 0.1 else t for t in tags]
+
+
+def python_counts(gold: Spans, pred: Spans, entity_types: list[str]) -> dict[str, Counter]:
+    counts = {name: Counter() for name in ('gold', 'pred', 'exact', 'partial_gold', 'partial_pred')}
+    for i in range(len(gold)):
+        gold_spans = set(zip(*(a.tolist() for a in gold[i])))
+        pred_spans = set(zip(*(a.tolist() for a in pred[i])))
+        for name, spans in ('gold', gold_spans), ('pred', pred_spans):
+            counts[name].update(entity_types[t] for _, _, t in spans)
+        counts['exact'].update(entity_types[t] for _, _, t in gold_spans & pred_spans)
+        for name, queries, others in ('partial_gold', gold_spans, pred_spans), ('partial_pred', pred_spans, gold_spans):
+            for start, end, t in queries:
+                if any(t == u and start < e and s < end for s, e, u in others):
+                    counts[name][entity_types[t]] += 1
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sequences', type=int, default=20_000)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    gold_tags = [random_tags(rng, rng.randint(5, 40)) for _ in range(args.sequences)]
+    pred_tags = [perturb(rng, tags) for tags in gold_tags]
+    vocab = LabelVocabulary.from_tags(gold_tags + pred_tags)
+    gold = vocab.extract_spans(*vocab.encode(gold_tags))
+    pred = vocab.extract_spans(*vocab.encode(pred_tags))
+    print(f'{args.sequences:,} sequences, {len(gold.starts):,} gold and {len(pred.starts):,} predicted spans')
+
+    start = time.perf_counter()
+    expected = python_counts(gold, pred, vocab.entity_types)
+    print(f'per-sentence python: {time.perf_counter() - start:.2f}s')
+
+    evaluator = SpanEvaluator.from_vocabulary(vocab)
+    start = time.perf_counter()
+    evaluator.update(gold, pred)
+    print(f'one update: {time.perf_counter() - start:.2f}s')
+    counts = {
+        name: Counter({t: int(n) for t, n in zip(evaluator.entity_types, c) if n})
+        for name, c in evaluator.counts.items()
+    }
+    print(f'counts match: {counts == {name: +c for name, c in expected.items()}}')
+
+    evaluator.reset()
+    start = time.perf_counter()
+    for i in range(0, args.sequences, args.batch_size):
+        batch_gold = vocab.extract_spans(*vocab.encode(gold_tags[i:i + args.batch_size]))
+        batch_pred = vocab.extract_spans(*vocab.encode(pred_tags[i:i + args.batch_size]))
+        evaluator.update(batch_gold, batch_pred)
+    print(f'batches of {args.batch_size}, with tag encoding: {time.perf_counter() - start:.2f}s')
+    print(f'micro exact f1: {evaluator.compute()["exact"]["micro"]["f1"]:.4f}')
+
+
+if __name__ == '__main__':
+    main()
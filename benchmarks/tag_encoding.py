@@ -0,0 +1,53 @@
+"""Time of batched BIO tag encoding and span extraction against a per-example Python loop.
+
+Usage: python benchmarks/tag_encoding.py [--sequences 60000] [--seed 0]
+"""
+import time
+import random
+import argparse
+
+from ai_den.utils.ner import LabelVocabulary
+from span_evaluation import random_tags, perturb
+
+
+def python_spans(tags: list[str]) -> list[tuple[int, int, str]]:
+    # lenient BIO reading, like conlleval: an I tag of another type starts a new entity
+    spans, start, current = [], None, None
+    for i, tag in enumerate(tags + ['O']):
+        prefix, _, entity_type = tag.partition('-')
+        if current is not None and (prefix != 'I' or entity_type != current):
+            spans.append((start, i, current))
+            current = None
+        if prefix in ('B', 'I') and current is None:
+            start, current = i, entity_type
+    return spans
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sequences', type=int, default=60_000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    # perturbed tags include I tags that don't continue an entity
+    tags = [perturb(rng, random_tags(rng, rng.randint(5, 40))) for _ in range(args.sequences)]
+    vocab = LabelVocabulary.from_tags(tags)
+
+    start = time.perf_counter()
+    expected = [python_spans(t) for t in tags]
+    print(f'per-example python: {time.perf_counter() - start:.2f}s')
+
+    start = time.perf_counter()
+    spans = vocab.extract_spans(*vocab.encode(tags))
+    print(f'encode + extract_spans: {time.perf_counter() - start:.2f}s')
+
+    labels = vocab.labels(spans)
+    result = [
+        list(zip(spans.starts[lo:hi].tolist(), spans.ends[lo:hi].tolist(), labels[lo:hi].tolist()))
+        for lo, hi in zip(spans.offsets[:-1], spans.offsets[1:])
+    ]
+    print(f'identical spans: {result == expected}')
+
+
+if __name__ == '__main__':
+    main()
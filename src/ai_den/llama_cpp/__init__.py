@@ -1,2 +1,7 @@
 from ai_den.llama_cpp.model import LlamaCpp
 from ai_den.llama_cpp.tokenizer import LlamaCppTokenizer
+from ai_den.llama_cpp.few_shot import FewShotSelector
+from ai_den.llama_cpp.tools import Tool, ToolRegistry
+from ai_den.llama_cpp.harness import InferenceHarness, SequentialBackend, ExecutorBackend, ProcessBackend
+from ai_den.llama_cpp.server import LlamaCppServer
+from ai_den.llama_cpp.manager import ModelManager
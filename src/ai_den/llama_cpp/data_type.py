@@ -1,5 +1,7 @@
 import re
 import json
+import copy
+from decimal import Decimal
 from dataclasses import is_dataclass
 from typing import Any, Generic, Optional, TypeVar, assert_never
 from pydantic import TypeAdapter
@@ -38,13 +40,35 @@ PRODUCTIONS = {
 PRIMITIVE_TYPES = {NULL, BOOLEAN, INTEGER, NUMBER, STRING}
 
 
+# a single (possibly escaped) character of a json string, used to bound string lengths
+CHAR = 'char'
+CHAR_PRODUCTION = r'[^"\\] | "\\" (["\\/bfnrt] | "u" [0-9a-fA-F] [0-9a-fA-F] [0-9a-fA-F] [0-9a-fA-F])'
+
+STRING_BOUNDS = ('minLength', 'maxLength')
+NUMBER_BOUNDS = ('minimum', 'maximum', 'exclusiveMinimum', 'exclusiveMaximum', 'multipleOf')
+
+# fraction digits of bounded numbers without a multipleOf, the decimal digits a double always holds exactly
+MAX_FRACTION_DIGITS = 15
+
+
 class DataType(Generic[T]):
-    def __init__(self, data_type: type[T]):
+    def __init__(self, data_type: type[T], schema: Optional[Schema] = None):
         self.data_type = data_type
         self.type_adapter = TypeAdapter(data_type)
+        # an explicit schema overrides the one derived from the data type
+        self._schema = schema
+        self.llama_grammars: dict[bool, LlamaGrammar] = {}
         self.init_grammar()
 
+    @classmethod
+    def from_schema(cls, schema: Schema) -> 'DataType[Any]':
+        """Returns a data type for a json schema, e.g., from an API request, whose values are parsed as plain json."""
+        return cls(Any, schema)
+
     def schema(self) -> Schema:
+        if self._schema is not None:
+            # the grammar construction modifies the schema
+            return copy.deepcopy(self._schema)
         return self.type_adapter.json_schema()
 
     def json_schema(
@@ -67,7 +91,11 @@ class DataType(Generic[T]):
         return self.type_adapter.validate_json(data, strict=strict)
 
     def llama_grammar(self, *, verbose: bool = False) -> LlamaGrammar:
-        return LlamaGrammar.from_string(self.gbnf(), verbose=verbose)
+        # parsing the grammar is costly, and llama resets the grammar state before each generation
+        if (grammar := self.llama_grammars.get(verbose)) is None:
+            grammar = LlamaGrammar.from_string(self.gbnf(), verbose=verbose)
+            self.llama_grammars[verbose] = grammar
+        return grammar
 
     def gbnf(self) -> str:
         return '\n'.join(
@@ -110,16 +138,27 @@ class DataType(Generic[T]):
         if defs := schema.get('$defs'):
             self.add_defs_to_grammar(defs, root=ref)
 
-        # create production for union of schemas
-        if anyOf := schema.get('anyOf'):
-            self.productions[name] = ' | '.join(self.add_schema_to_grammar(clause) for clause in anyOf)
+        # create production for union of schemas (oneOf is used by discriminated unions)
+        if clauses := schema.get('anyOf') or schema.get('oneOf'):
+            self.productions[name] = ' | '.join(self.add_schema_to_grammar(clause) for clause in clauses)
+            return name
+
+        # handle constants
+        if 'const' in schema:
+            self.productions[name] = make_json_literal(schema['const'])
             return name
 
         # handle enums
         if enum := schema.get('enum'):
-            self.productions[name] = ' | '.join(make_string_literal(s) for s in enum)
+            self.productions[name] = ' | '.join(make_json_literal(s) for s in enum)
             return name
-        
+
+        # a list of types is a union of schemas that differ only in their type
+        if isinstance(types := schema.get('type'), list):
+            clauses = [{**schema, 'type': t} for t in types]
+            self.productions[name] = ' | '.join(self.add_schema_to_grammar(clause) for clause in clauses)
+            return name
+
         # create production based on schema type
         match schema.get('type'):
             case 'array':
@@ -128,6 +167,12 @@ class DataType(Generic[T]):
             case 'object':
                 return self.add_object_to_grammar(name, schema)
 
+            case 'string' if any(k in schema for k in STRING_BOUNDS):
+                return self.add_string_to_grammar(name, schema)
+
+            case 'integer' | 'number' if any(k in schema for k in NUMBER_BOUNDS):
+                return self.add_number_to_grammar(name, schema)
+
             case t if t in PRIMITIVE_TYPES:
                 if t not in self.productions:
                     self.productions[t] = PRODUCTIONS[t]
@@ -144,8 +189,13 @@ class DataType(Generic[T]):
             )
 
     def add_array_to_grammar(self, name: str, schema: Schema) -> str:
+        prefix_items = schema.get('prefixItems') or []
+        items = schema.get('items')
+        min_items = schema.get('minItems', 0)
+        max_items = schema.get('maxItems')
+
         # check if schema has restrictions
-        if not schema.get('prefixItems') and not schema.get('items'):
+        if not prefix_items and not items and min_items == 0 and max_items is None:
             self.productions.update(PRODUCTIONS)
             return ARRAY
 
@@ -153,27 +203,88 @@ class DataType(Generic[T]):
         rule = '"["'
 
         # prefixItems is a list of schemas that occurs when handling tuples
-        if prefixItems := schema.get('prefixItems'):
-            rule += '","'.join(
-                f' {SPACE} {self.add_schema_to_grammar(item)} {SPACE} '
-                for item in prefixItems
+        if prefix_items:
+            rule += ' ' + ' "," '.join(
+                f'{SPACE} {self.add_schema_to_grammar(item)} {SPACE}'
+                for item in prefix_items
             )
-
-        # items is a single schema for the list items
-        if items := schema.get('items'):
-            if prefixItems:
-                rule += f'","'
-            prod_name = self.add_schema_to_grammar(items)
-            rule += f' {SPACE} ({prod_name} {SPACE} ("," {SPACE} {prod_name} {SPACE})*)? '
+        else:
+            rule += f' {SPACE}'
+
+        # items is a single schema for the rest of the items (any value if empty, none if false)
+        if items is not False and (items is not None or not prefix_items):
+            if items:
+                prod_name = self.add_schema_to_grammar(items)
+            else:
+                self.productions.update(PRODUCTIONS)
+                prod_name = VALUE
+            # the item count bounds include the prefix items
+            if repetition := make_repetition(
+                f'{prod_name} {SPACE}',
+                min_count=max(0, min_items - len(prefix_items)),
+                max_count=None if max_items is None else max(0, max_items - len(prefix_items)),
+                separator=f'"," {SPACE}',
+                leading_separator=bool(prefix_items),
+            ):
+                rule += f' {repetition}'
 
         # close array
-        rule += '"]"'
+        rule += ' "]"'
 
         # add production rule
         self.productions[name] = rule
 
         return name
 
+    def add_string_to_grammar(self, name: str, schema: Schema) -> str:
+        if CHAR not in self.productions:
+            self.productions[CHAR] = CHAR_PRODUCTION
+        chars = make_repetition(CHAR, schema.get('minLength', 0), schema.get('maxLength'))
+        quote = '"\\""'
+        self.productions[name] = f'{quote} {chars} {quote}' if chars else f'{quote} {quote}'
+        return name
+
+    def add_number_to_grammar(self, name: str, schema: Schema) -> str:
+        lower = schema.get('minimum', schema.get('exclusiveMinimum'))
+        upper = schema.get('maximum', schema.get('exclusiveMaximum'))
+
+        fraction = ''
+        if schema['type'] == 'number':
+            # bound the fraction digits by the precision of multipleOf, e.g., 0.01 allows two and 5 allows none;
+            # repr is the shortest exact form of a float, so small values like 1e-07 keep all their digits
+            multiple_of = schema.get('multipleOf')
+            if multiple_of is not None and multiple_of > 0:
+                decimals = max(0, -Decimal(repr(multiple_of)).normalize().as_tuple().exponent)
+            elif lower is not None or upper is not None:
+                decimals = MAX_FRACTION_DIGITS
+            else:
+                decimals = None
+            if decimals is None:
+                fraction = ' ("." [0-9]+)?'
+            elif decimals >= 1:
+                fraction = f' ("." {make_repetition("[0-9]", 1, decimals)})?'
+
+        # negative and positive values, each with its integer digits bounded by the bound on its side;
+        # exponents can only be bounded by their value, so they are allowed only on an unbounded side
+        allow_exponent = schema['type'] == 'number'
+        negative = make_number_magnitude(lower, fraction, allow_exponent) if lower is None or lower < 0 else None
+        positive = make_number_magnitude(upper, fraction, allow_exponent) if upper is None or upper >= 0 else None
+
+        if negative is None and positive is None:
+            raise ValueError(f'no number is between {lower} and {upper}')
+        elif negative == positive:
+            # the sign is only needed if negative values are allowed
+            rule = f'"-"? {positive}'
+        elif negative is None:
+            rule = positive
+        elif positive is None:
+            rule = f'"-" {negative}'
+        else:
+            rule = f'"-" {negative} | {positive}'
+
+        self.productions[name] = rule
+        return name
+
     def add_key_value_pair_to_grammar(self, object_name: str, property_name: str, property_schema: Schema) -> str:
         # get production name for property value
         value = self.add_schema_to_grammar(property_schema)
@@ -188,10 +299,12 @@ class DataType(Generic[T]):
         required, optional = [], []
 
         if properties := schema.get('properties'):
+            # properties are required unless they have a default or the schema lists the required ones without them
+            required_names = schema.get('required', properties.keys())
             # make productions for key-value pairs and organize them into required and optional
             for property_name, property_schema in reversed(properties.items()):
-                if 'default' in property_schema:
-                    property_schema.pop('default')
+                if 'default' in property_schema or property_name not in required_names:
+                    property_schema.pop('default', None)
                     production_name = self.add_key_value_pair_to_grammar(name, property_name, property_schema)
                     optional.insert(0, production_name)
                 else:
@@ -267,7 +380,7 @@ class DataType(Generic[T]):
                 return VALUE
 
             # check if schema represents a primitive type
-            if len(schema) == 1 and schema.get('type') in PRIMITIVE_TYPES:
+            if len(schema) == 1 and isinstance(schema.get('type'), str) and schema['type'] in PRIMITIVE_TYPES:
                 name = schema['type']
                 self.production_names[schema_repr] = name
                 return name
@@ -293,17 +406,17 @@ class DataType(Generic[T]):
             prefix = name
         elif 'enum' in schema:
             prefix = 'enum'
-        elif 'anyOf' in schema:
+        elif 'anyOf' in schema or 'oneOf' in schema or isinstance(schema.get('type'), list):
             prefix = 'union'
-        elif schema.get('type') == 'array':
-            prefix = 'array'
-        elif schema.get('type') == 'object':
-            prefix = 'object'
+        elif 'const' in schema:
+            prefix = 'const'
+        elif schema.get('type') in {ARRAY, OBJECT, STRING, INTEGER, NUMBER}:
+            prefix = schema['type']
         else:
             prefix = 'production'
 
         # maybe append count to prefix to ensure uniqueness
-        if prefix in {'enum', 'union', 'array', 'object', 'production'}:
+        if prefix in {'enum', 'union', 'const', ARRAY, OBJECT, STRING, INTEGER, NUMBER, 'production'}:
             # append prefix count to production name
             n = 1 + self.prefix_counter.get(prefix, 0)
             self.prefix_counter[prefix] = n
@@ -329,6 +442,50 @@ def make_string_literal(string: str) -> str:
     return '"\\"' + re.sub(pattern, repl, string) + '\\""'
 
 
+def make_json_literal(value: Any) -> str:
+    if isinstance(value, str):
+        return make_string_literal(value)
+    # grammar literal for the json representation of numbers, booleans and null
+    return '"' + json.dumps(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def make_number_magnitude(bound: Optional[float], fraction: str, allow_exponent: bool) -> str:
+    """Returns a rule for the magnitude of a number, with as many integer digits as the bound has."""
+    if bound is None:
+        rule = '([0-9] | [1-9] [0-9]*)' + fraction
+        return f'{rule} ([eE] [-+]? [0-9]+)?' if allow_exponent else rule
+    max_digits = len(str(int(abs(bound))))
+    if max_digits == 1:
+        return '[0-9]' + fraction
+    return f'([0-9] | [1-9] {make_repetition("[0-9]", 0, max_digits - 1)})' + fraction
+
+
+def make_repetition(
+        item: str,
+        min_count: int = 0,
+        max_count: Optional[int] = None,
+        *,
+        separator: Optional[str] = None,
+        leading_separator: bool = False,
+) -> str:
+    """Returns a rule that matches between min_count and max_count occurrences of item, as nested optionals."""
+    if max_count is not None and max_count < min_count:
+        raise ValueError(f'invalid repetition bounds: {min_count}, {max_count}')
+    sep_item = item if separator is None else f'{separator} {item}'
+    first = sep_item if leading_separator else item
+    required = [first] + [sep_item] * (min_count - 1) if min_count > 0 else []
+    if max_count is None:
+        if required:
+            return ' '.join(required + [f'({sep_item})*'])
+        return f'({first} ({sep_item})*)?'
+    optional = ''
+    for i in reversed(range(max_count - min_count)):
+        # only the first item overall can lack a separator
+        it = first if i == 0 and not required else sep_item
+        optional = f'({it} {optional})?' if optional else f'({it})?'
+    return ' '.join(required + [optional] if optional else required)
+
+
 def recursively_expand_optionals(chunks: list[str]) -> list[str]:
     if not chunks:
         return []
@@ -350,12 +507,14 @@ def strip_schema(schema: Schema) -> Schema:
     new_schema = {}
     for key, value in schema.items():
         match key:
-            case 'type' | 'default' | 'enum' | '$ref':
+            case 'type' | 'default' | 'enum' | 'const' | '$ref' | 'minItems' | 'maxItems':
+                new_schema[key] = value
+            case 'minLength' | 'maxLength' | 'minimum' | 'maximum' | 'exclusiveMinimum' | 'exclusiveMaximum' | 'multipleOf':
                 new_schema[key] = value
-            case 'anyOf' | 'prefixItems':
+            case 'anyOf' | 'oneOf' | 'prefixItems':
                 new_schema[key] = [strip_schema(clause) for clause in value]
             case 'items' | 'additionalProperties':
-                new_schema[key] = strip_schema(value)
+                new_schema[key] = strip_schema(value) if isinstance(value, dict) else value
             case 'properties' | '$defs':
                 new_schema[key] = {name: strip_schema(prop) for name, prop in value.items()}
             case _:
@@ -0,0 +1,112 @@
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+from ai_den.utils.arrays import lengths_to_offsets
+
+
+@dataclass
+class BatchEncoding:
+    """Token ids of several sequences packed into flat arrays, with sequence i at ids[offsets[i]:offsets[i+1]]."""
+
+    ids: np.ndarray
+    offsets: np.ndarray
+    char_offsets: Optional[np.ndarray] = None
+
+    @classmethod
+    def from_lists(cls, encoded: list[list[int]], char_offsets: Optional[list[np.ndarray]] = None) -> 'BatchEncoding':
+        offsets = lengths_to_offsets(map(len, encoded))
+        ids = np.fromiter((id for ids in encoded for id in ids), dtype=np.intc, count=offsets[-1])
+        if char_offsets is not None:
+            char_offsets = np.concatenate(char_offsets) if char_offsets else np.empty((0, 2), dtype=np.int64)
+        return cls(ids, offsets, char_offsets)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> np.ndarray:
+        return self.ids[self.offsets[i]:self.offsets[i+1]]
+
+    @property
+    def lengths(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    def get_char_offsets(self, i: int) -> np.ndarray:
+        if self.char_offsets is None:
+            raise ValueError('char offsets were not requested')
+        return self.char_offsets[self.offsets[i]:self.offsets[i+1]]
+
+    def to_padded(
+            self,
+            pad_id: int = 0,
+            *,
+            max_length: Optional[int] = None,
+            left: bool = False,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Returns a (batch, length) array of ids padded with pad_id, and the length of each row."""
+        lengths = self.lengths
+        if max_length is None:
+            max_length = int(lengths.max(initial=0))
+        lengths = np.minimum(lengths, max_length)
+        padded = np.full((len(self), max_length), pad_id, dtype=self.ids.dtype)
+        # scatter the packed ids into their rows without looping over sequences
+        rows = np.repeat(np.arange(len(self)), lengths)
+        cols = np.arange(len(rows)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        src = np.repeat(self.offsets[:-1], lengths) + cols
+        if left:
+            cols += np.repeat(max_length - lengths, lengths)
+        padded[rows, cols] = self.ids[src]
+        return padded, lengths
+
+
+@dataclass
+class WordAlignment:
+    """Alignment between the words of a sequence and the tokens of their joined text, with -1 for tokens outside words."""
+
+    text: str
+    ids: np.ndarray
+    char_offsets: np.ndarray
+    word_char_offsets: np.ndarray
+    word_to_tokens: np.ndarray
+    token_to_word: np.ndarray
+
+    @classmethod
+    def from_offsets(
+            cls,
+            text: str,
+            ids: np.ndarray,
+            char_offsets: np.ndarray,
+            word_char_offsets: np.ndarray,
+    ) -> 'WordAlignment':
+        token_starts, token_ends = char_offsets[:, 0], char_offsets[:, 1]
+        word_starts, word_ends = word_char_offsets[:, 0], word_char_offsets[:, 1]
+        # first token that ends after the word starts, and first token that starts after the word ends
+        word_to_tokens = np.stack([
+            np.searchsorted(token_ends, word_starts, side='right'),
+            np.searchsorted(token_starts, word_ends, side='left'),
+        ], axis=1)
+        # each token belongs to the word that contains its first character, if any
+        token_to_word = np.searchsorted(word_ends, token_starts, side='right')
+        in_word = token_to_word < len(word_starts)
+        in_word[in_word] &= word_starts[token_to_word[in_word]] < token_ends[in_word]
+        token_to_word[~in_word] = -1
+        return cls(text, ids, char_offsets, word_char_offsets, word_to_tokens, token_to_word)
+
+    def word_span_to_tokens(self, start: int, end: int) -> tuple[int, int]:
+        """Returns the token span covering words[start:end]."""
+        return int(self.word_to_tokens[start, 0]), int(self.word_to_tokens[end - 1, 1])
+
+    def char_span_to_tokens(self, start: int, end: int) -> tuple[int, int]:
+        """Returns the token span covering text[start:end]."""
+        return (
+            int(np.searchsorted(self.char_offsets[:, 1], start, side='right')),
+            int(np.searchsorted(self.char_offsets[:, 0], end, side='left')),
+        )
+
+
+def word_char_offsets(words: list[str], separator: str = ' ') -> np.ndarray:
+    """Returns the start and end character positions of each word in separator.join(words)."""
+    lengths = np.fromiter(map(len, words), dtype=np.int64, count=len(words))
+    ends = np.cumsum(lengths + len(separator)) - len(separator)
+    return np.stack([ends - lengths, ends], axis=1)
@@ -0,0 +1,156 @@
+import hashlib
+from pathlib import Path
+from typing import Any, Optional
+from collections.abc import Callable, Iterator
+
+import numpy as np
+from datasets import Dataset
+
+from ai_den.utils.paths import CACHE_DIR, PathLike
+from ai_den.utils.files import atomic_save
+from ai_den.llama_cpp.model import Example, LlamaCpp
+
+
+EMBEDDINGS_CACHE_DIR = CACHE_DIR / 'embeddings'
+
+
+Formatter = str | Callable[[dict[str, Any]], str]
+
+
+class FewShotSelector:
+    """Selects the training examples closest to a query, with embeddings cached in a memory-mapped file."""
+
+    def __init__(
+            self,
+            llm: LlamaCpp,
+            dataset: Dataset,
+            input_format: Formatter,
+            output_format: Formatter,
+            *,
+            k: int = 4,
+            batch_size: int = 64,
+            chunk_size: int = 65536,
+            cache_dir: PathLike = EMBEDDINGS_CACHE_DIR,
+    ):
+        self.llm = llm
+        self.dataset = dataset
+        self.input_format = input_format
+        self.output_format = output_format
+        self.k = k
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.cache_dir = Path(cache_dir)
+        self.embeddings = self.load_embeddings()
+
+    def __call__(self, query: str, k: Optional[int] = None) -> list[Example]:
+        return self.select(query, k)
+
+    @property
+    def cache_path(self) -> Path:
+        return self.cache_dir / f'{self.fingerprint()}.npy'
+
+    def fingerprint(self) -> str:
+        h = hashlib.sha256()
+        # embeddings depend on the model weights
+        h.update(self.llm.model_path.name.encode())
+        h.update(str(self.llm.model_path.stat().st_size).encode())
+        # and on the embedded texts
+        if isinstance(self.input_format, str):
+            h.update(self.dataset._fingerprint.encode())
+            h.update(self.input_format.encode())
+        else:
+            # formatting functions can't be hashed reliably, so we hash their output
+            for text in self.inputs():
+                h.update(text.encode())
+                h.update(b'\0')
+        return h.hexdigest()
+
+    def inputs(self) -> Iterator[str]:
+        if isinstance(self.input_format, str):
+            yield from self.dataset[self.input_format]
+        else:
+            yield from map(self.input_format, self.dataset)
+
+    def load_embeddings(self) -> np.ndarray:
+        path = self.cache_path
+        if not path.exists():
+            self.compute_embeddings(path)
+        return np.load(path, mmap_mode='r')
+
+    def compute_embeddings(self, path: Path):
+        atomic_save(path, self.write_embeddings)
+
+    def write_embeddings(self, path: Path):
+        embeddings = None
+        batch, start = [], 0
+        for text in self.inputs():
+            batch.append(text)
+            if len(batch) == self.batch_size:
+                embeddings = self.write_batch(path, embeddings, batch, start)
+                start += len(batch)
+                batch = []
+        if not batch and embeddings is None:
+            raise ValueError('cannot select examples from an empty dataset')
+        if batch:
+            embeddings = self.write_batch(path, embeddings, batch, start)
+        embeddings.flush()
+
+    def write_batch(
+            self,
+            path: Path,
+            embeddings: Optional[np.memmap],
+            batch: list[str],
+            start: int,
+    ) -> np.memmap:
+        batch_embeddings = self.llm.embed(batch)
+        if embeddings is None:
+            embeddings = np.lib.format.open_memmap(
+                path,
+                mode='w+',
+                dtype=np.float32,
+                shape=(len(self.dataset), batch_embeddings.shape[1]),
+            )
+        embeddings[start:start+len(batch)] = batch_embeddings
+        return embeddings
+
+    def search(self, queries: str | list[str], k: Optional[int] = None) -> tuple[np.ndarray, np.ndarray]:
+        """Returns the indices and cosine similarities of the k nearest examples for each query."""
+        if isinstance(queries, str):
+            indices, scores = self.search([queries], k)
+            return indices[0], scores[0]
+        k = min(self.k if k is None else k, len(self.embeddings))
+        q = self.llm.embed(queries)
+        n = len(self.embeddings)
+        best_indices = np.empty((len(queries), 0), dtype=np.int64)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        # scan the memory-mapped embeddings in chunks to keep memory bounded
+        for start in range(0, n, self.chunk_size):
+            chunk = np.asarray(self.embeddings[start:start+self.chunk_size])
+            scores = np.concatenate([best_scores, q @ chunk.T], axis=1)
+            indices = np.concatenate([
+                best_indices,
+                np.broadcast_to(np.arange(start, start + len(chunk)), (len(queries), len(chunk))),
+            ], axis=1)
+            # the first chunks may hold fewer than k candidates
+            top_k = min(k, scores.shape[1])
+            top = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+            best_scores = np.take_along_axis(scores, top, axis=1)
+            best_indices = np.take_along_axis(indices, top, axis=1)
+        # sort results by decreasing similarity
+        order = np.argsort(-best_scores, axis=1, kind='stable')
+        return np.take_along_axis(best_indices, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+
+    def select(self, query: str, k: Optional[int] = None) -> list[Example]:
+        """Returns the k examples most similar to the query, most similar first."""
+        indices, _ = self.search(query, k)
+        return [self.format_example(self.dataset[int(i)]) for i in indices]
+
+    def format_example(self, row: dict[str, Any]) -> Example:
+        return format_row(row, self.input_format), format_row(row, self.output_format)
+
+    def prompt_to_messages(self, prompt: str, *, k: Optional[int] = None, **kwargs):
+        return self.llm.prompt_to_messages(prompt, examples=self.select(prompt, k), **kwargs)
+
+
+def format_row(row: dict[str, Any], format: Formatter) -> str:
+    return row[format] if isinstance(format, str) else format(row)
@@ -0,0 +1,277 @@
+import json
+from pathlib import Path
+from dataclasses import dataclass
+from typing import Any, Optional
+from collections.abc import Callable, Iterator, Sequence
+from concurrent.futures import BrokenExecutor, Executor, Future, ProcessPoolExecutor
+
+from tqdm.auto import tqdm
+from datasets import Dataset, Features, Value
+
+from ai_den.utils.paths import PathLike
+from ai_den.utils.files import atomic_save
+from ai_den.utils.datasets import fingerprint_value
+from ai_den.utils.dataclasses import from_data, get_json_encoder, is_dataclass_type
+from ai_den.llama_cpp.model import LlamaCpp
+from ai_den.llama_cpp.data_type import DataType
+from ai_den.llama_cpp.few_shot import Formatter, format_row
+
+
+# bump when the layout of the output shards changes
+HARNESS_VERSION = 1
+
+MANIFEST_NAME = 'manifest.json'
+
+
+@dataclass
+class Failure:
+    """Stands in for the output of a prompt whose generation raised an exception."""
+
+    error: str
+
+
+class EncodedOutput(str):
+    """An output already encoded as json, e.g., by a worker process."""
+
+
+# a backend generates the outputs for a list of prompts, in order; backends may also have
+# a manifest method returning what identifies their outputs, e.g., the model and prompt
+Backend = Callable[[list[str]], list[Any]]
+
+
+def model_id(model_path: PathLike) -> str:
+    """Identifies a model file by its path, size and modification time."""
+    path = Path(model_path).resolve()
+    stat = path.stat()
+    return f'{path}:{stat.st_size}:{stat.st_mtime_ns}'
+
+
+# kwargs of LlamaCpp.__call__ that make up the prompt, rather than control generation
+PROMPT_KWARGS = ('system_prompt', 'examples')
+
+
+def backend_manifest(
+        model_path: PathLike,
+        system_prompt: Optional[str],
+        data_type: Optional[DataType],
+        kwargs: dict[str, Any],
+) -> dict[str, Any]:
+    # the system prompt given per call takes precedence over the model's
+    system_prompt = kwargs.get('system_prompt', system_prompt)
+    generation_kwargs = {k: v for k, v in kwargs.items() if k not in PROMPT_KWARGS}
+    return {
+        'model': model_id(model_path),
+        'prompt': fingerprint_value((system_prompt, kwargs.get('examples')), set()),
+        'schema': fingerprint_value(data_type.schema() if data_type is not None else None, set()),
+        'generation': fingerprint_value(generation_kwargs, set()),
+    }
+
+
+class SequentialBackend:
+    """Generates outputs one prompt at a time with a loaded model."""
+
+    def __init__(self, llm: LlamaCpp, data_type: Optional[type] = None, **kwargs):
+        self.llm = llm
+        # build the data type once, so its grammar is shared by all prompts
+        self.data_type = DataType(data_type) if data_type is not None else None
+        self.kwargs = kwargs
+
+    def __call__(self, prompts: list[str]) -> list[Any]:
+        return [generate(self.llm, prompt, self.data_type, self.kwargs) for prompt in prompts]
+
+    def manifest(self) -> dict[str, Any]:
+        return backend_manifest(self.llm.model_path, self.llm.system_prompt, self.data_type, self.kwargs)
+
+
+class ExecutorBackend:
+    """Maps a picklable function over the prompts with a concurrent.futures executor."""
+
+    def __init__(self, executor: Executor, fn: Callable[[str], Any], manifest: Optional[dict[str, Any]] = None):
+        self.executor = executor
+        self.fn = fn
+        self._manifest = manifest or {}
+
+    def __call__(self, prompts: list[str]) -> list[Any]:
+        futures = [self.executor.submit(self.fn, prompt) for prompt in prompts]
+        return [result_or_failure(future) for future in futures]
+
+    def manifest(self) -> dict[str, Any]:
+        return self._manifest
+
+
+class ProcessBackend(ExecutorBackend):
+    """Loads one model in each worker process and spreads the prompts among them."""
+
+    def __init__(
+            self,
+            model_path: PathLike,
+            num_proc: int,
+            data_type: Optional[type] = None,
+            model_kwargs: Optional[dict[str, Any]] = None,
+            **kwargs,
+    ):
+        model_kwargs = model_kwargs or {}
+        executor = ProcessPoolExecutor(
+            max_workers=num_proc,
+            initargs=(model_path, data_type, model_kwargs, kwargs),
+            initializer=init_worker,
+        )
+        data_type = DataType(data_type) if data_type is not None else None
+        manifest = backend_manifest(model_path, model_kwargs.get('system_prompt'), data_type, kwargs)
+        super().__init__(executor, generate_in_worker, manifest)
+
+    def close(self):
+        self.executor.shutdown()
+
+
+# model loaded by each worker of a ProcessBackend
+_worker_state: Optional[tuple[LlamaCpp, Optional[DataType], dict[str, Any]]] = None
+
+
+def init_worker(model_path: PathLike, data_type: Optional[type], model_kwargs: dict[str, Any], kwargs: dict[str, Any]):
+    global _worker_state
+    llm = LlamaCpp(model_path, **model_kwargs)
+    _worker_state = llm, DataType(data_type) if data_type is not None else None, kwargs
+
+
+def generate_in_worker(prompt: str) -> Any:
+    llm, data_type, kwargs = _worker_state
+    output = generate(llm, prompt, data_type, kwargs)
+    # send back json, since parsed outputs may not be picklable
+    return output if isinstance(output, Failure) else EncodedOutput(get_json_encoder().encode(output))
+
+
+def result_or_failure(future: Future) -> Any:
+    try:
+        return future.result()
+    except BrokenExecutor:
+        # every remaining prompt would fail as well
+        raise
+    except Exception as e:
+        return Failure(f'{type(e).__name__}: {e}')
+
+
+def generate(llm: LlamaCpp, prompt: str, data_type: Optional[DataType], kwargs: dict[str, Any]) -> Any:
+    try:
+        return llm(prompt, data_type=data_type, **kwargs)
+    except Exception as e:
+        # a single bad row shouldn't stop a long run
+        return Failure(f'{type(e).__name__}: {e}')
+
+
+class InferenceHarness:
+    """Runs a backend over a dataset, writing the outputs to parquet shards so that an interrupted run resumes."""
+
+    def __init__(
+            self,
+            backend: Backend,
+            prompt: Formatter,
+            output_dir: PathLike,
+            *,
+            shard_size: int = 256,
+            keep_columns: Sequence[str] = (),
+            output_field: str = 'output',
+            error_field: str = 'error',
+            cache_key: Optional[str] = None,
+    ):
+        self.backend = backend
+        self.prompt = prompt
+        self.output_dir = Path(output_dir)
+        self.shard_size = shard_size
+        self.keep_columns = list(keep_columns)
+        self.output_field = output_field
+        self.error_field = error_field
+        # identifies the prompt formatter, for formatters that can't be fingerprinted
+        self.cache_key = cache_key
+
+    def shard_path(self, i: int) -> Path:
+        return self.output_dir / f'shard-{i:05d}.parquet'
+
+    def run(self, dataset: Dataset) -> Dataset:
+        """Generates the outputs of all rows that don't have a completed shard, and returns all outputs."""
+        self.check_manifest(dataset)
+        num_shards = (len(dataset) + self.shard_size - 1) // self.shard_size
+        done = [i for i in range(num_shards) if self.shard_path(i).exists()]
+        done_rows = sum(self.shard_rows(dataset, i) for i in done)
+        with tqdm(total=len(dataset), initial=done_rows, unit='row', desc='inference') as progress:
+            for i in range(num_shards):
+                if self.shard_path(i).exists():
+                    continue
+                self.run_shard(dataset, i)
+                progress.update(self.shard_rows(dataset, i))
+        if num_shards == 0:
+            # there are no shards to load
+            features = self.output_features(dataset)
+            return Dataset.from_dict({name: [] for name in features}, features=features)
+        return self.load(num_shards)
+
+    def run_shard(self, dataset: Dataset, i: int):
+        start = i * self.shard_size
+        rows = dataset.select(range(start, start + self.shard_rows(dataset, i)))
+        prompts = [format_row(row, self.prompt) for row in rows]
+        outputs = self.backend(prompts)
+        if len(outputs) != len(prompts):
+            raise RuntimeError(f'backend returned {len(outputs)} outputs for {len(prompts)} prompts')
+        encoder = get_json_encoder()
+        columns = {'index': list(range(start, start + len(rows)))}
+        for name in self.keep_columns:
+            columns[name] = list(rows[name])
+        columns[self.output_field] = [
+            None if isinstance(o, Failure) else o if isinstance(o, EncodedOutput) else encoder.encode(o)
+            for o in outputs
+        ]
+        columns[self.error_field] = [o.error if isinstance(o, Failure) else None for o in outputs]
+        shard = Dataset.from_dict(columns, features=self.output_features(dataset))
+        # an interrupted write never looks like a completed shard
+        atomic_save(self.shard_path(i), lambda tmp_path: shard.to_parquet(str(tmp_path)))
+
+    def output_features(self, dataset: Dataset) -> Features:
+        features = {'index': Value('int64')}
+        for name in self.keep_columns:
+            features[name] = dataset.features[name]
+        # explicit types, so that shards where every row failed (or none did) can still be concatenated
+        features[self.output_field] = Value('string')
+        features[self.error_field] = Value('string')
+        return Features(features)
+
+    def shard_rows(self, dataset: Dataset, i: int) -> int:
+        return min(self.shard_size, len(dataset) - i * self.shard_size)
+
+    def check_manifest(self, dataset: Dataset):
+        manifest = {
+            'version': HARNESS_VERSION,
+            'dataset': dataset._fingerprint,
+            'num_rows': len(dataset),
+            'shard_size': self.shard_size,
+            'format': self.cache_key if self.cache_key is not None else fingerprint_value(self.prompt, set()),
+        }
+        if (describe_backend := getattr(self.backend, 'manifest', None)) is not None:
+            manifest.update(describe_backend())
+        path = self.output_dir / MANIFEST_NAME
+        if path.exists():
+            existing = json.loads(path.read_text())
+            if existing != manifest:
+                changed = sorted(k for k in manifest.keys() | existing.keys() if manifest.get(k) != existing.get(k))
+                raise ValueError(f'{self.output_dir} holds outputs of a different run, with a different {", ".join(changed)}')
+            return
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(manifest))
+
+    def load(self, num_shards: Optional[int] = None) -> Dataset:
+        """Returns the outputs of the completed shards as a single dataset."""
+        paths = sorted(self.output_dir.glob('shard-*.parquet'))
+        if num_shards is not None:
+            paths = paths[:num_shards]
+        if not paths:
+            raise FileNotFoundError(f'no completed shards in {self.output_dir}')
+        return Dataset.from_parquet([str(p) for p in paths])
+
+    def outputs(self, data_type: Optional[type] = None) -> Iterator[Any]:
+        """Yields the parsed outputs of the completed shards in order, or None for failed rows."""
+        for row in self.load():
+            output = row[self.output_field]
+            if output is None:
+                yield None
+                continue
+            output = json.loads(output)
+            yield from_data(data_type, output) if is_dataclass_type(data_type) else output
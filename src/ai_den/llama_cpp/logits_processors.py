@@ -0,0 +1,125 @@
+from weakref import WeakKeyDictionary
+from collections.abc import Iterable, Mapping
+
+import numpy as np
+import numpy.typing as npt
+
+from ai_den.llama_cpp.tokenizer import ENCODING, LlamaCppTokenizer
+from ai_den.llama_cpp.trie import get_vocab_trie
+
+
+Tokens = Iterable[int] | Iterable[str]
+
+
+class VocabMasks:
+    """Token masks precomputed once per tokenizer."""
+
+    def __init__(self, tokenizer: LlamaCppTokenizer):
+        self.vocab_size = tokenizer.vocab_size
+        self.eos_token_id = tokenizer.eos_token_id
+        self.trie = get_vocab_trie(tokenizer)
+        self.token_set_masks: dict[frozenset[int], np.ndarray] = {}
+
+    def token_set_mask(self, token_ids: Iterable[int]) -> np.ndarray:
+        key = frozenset(token_ids)
+        if (mask := self.token_set_masks.get(key)) is None:
+            mask = np.zeros(self.vocab_size, dtype=bool)
+            mask[np.fromiter(key, dtype=np.intc, count=len(key))] = True
+            mask.flags.writeable = False
+            self.token_set_masks[key] = mask
+        return mask
+
+    def substring_mask(self, text: bytes) -> np.ndarray:
+        """Marks the tokens whose decoded piece occurs somewhere in text."""
+        mask = np.zeros(self.vocab_size, dtype=bool)
+        # walk the vocabulary trie from every position of the text instead of scanning the vocabulary
+        mask[self.trie.substrings_of(text)] = True
+        return mask
+
+
+_vocab_masks: WeakKeyDictionary[LlamaCppTokenizer, VocabMasks] = WeakKeyDictionary()
+
+
+def get_vocab_masks(tokenizer: LlamaCppTokenizer) -> VocabMasks:
+    if (masks := _vocab_masks.get(tokenizer)) is None:
+        masks = VocabMasks(tokenizer)
+        _vocab_masks[tokenizer] = masks
+    return masks
+
+
+class TokenMaskLogitsProcessor:
+    """Sets the scores of all the tokens outside of the mask to -inf, in place."""
+
+    def __init__(self, mask: npt.NDArray[np.bool_]):
+        self.allowed = np.flatnonzero(mask)
+        self.banned = np.flatnonzero(~mask)
+
+    def __call__(self, input_ids: npt.NDArray[np.intc], scores: npt.NDArray[np.single]) -> npt.NDArray[np.single]:
+        if len(self.allowed) < len(self.banned):
+            # cheaper to save the few allowed scores and reset everything else
+            allowed_scores = scores[self.allowed]
+            scores.fill(-np.inf)
+            scores[self.allowed] = allowed_scores
+        else:
+            scores[self.banned] = -np.inf
+        return scores
+
+
+class TokenBiasLogitsProcessor:
+    """Adds a fixed bias to the scores of some tokens, in place."""
+
+    def __init__(self, token_ids: npt.ArrayLike, biases: npt.ArrayLike):
+        self.token_ids = np.asarray(token_ids, dtype=np.intc)
+        self.biases = np.asarray(biases, dtype=np.single)
+
+    def __call__(self, input_ids: npt.NDArray[np.intc], scores: npt.NDArray[np.single]) -> npt.NDArray[np.single]:
+        scores[self.token_ids] += self.biases
+        return scores
+
+
+def allowed_tokens(
+        tokenizer: LlamaCppTokenizer,
+        tokens: Tokens,
+        *,
+        allow_eos: bool = True,
+) -> TokenMaskLogitsProcessor:
+    """Returns a logits processor that only allows the given tokens."""
+    token_ids = set(to_token_ids(tokenizer, tokens))
+    if allow_eos:
+        token_ids.add(tokenizer.eos_token_id)
+    return TokenMaskLogitsProcessor(get_vocab_masks(tokenizer).token_set_mask(token_ids))
+
+
+def banned_tokens(tokenizer: LlamaCppTokenizer, tokens: Tokens) -> TokenMaskLogitsProcessor:
+    """Returns a logits processor that never allows the given tokens."""
+    mask = get_vocab_masks(tokenizer).token_set_mask(to_token_ids(tokenizer, tokens))
+    return TokenMaskLogitsProcessor(~mask)
+
+
+def substring_tokens(
+        tokenizer: LlamaCppTokenizer,
+        text: str,
+        *,
+        allow_eos: bool = True,
+) -> TokenMaskLogitsProcessor:
+    """Returns a logits processor that only allows tokens that are substrings of text."""
+    if tokenizer.is_sentencepiece and not text.startswith(' '):
+        # sentencepiece prepends a space to the first word
+        text = ' ' + text
+    masks = get_vocab_masks(tokenizer)
+    mask = masks.substring_mask(text.encode(ENCODING))
+    if allow_eos:
+        mask[masks.eos_token_id] = True
+    return TokenMaskLogitsProcessor(mask)
+
+
+def token_biases(tokenizer: LlamaCppTokenizer, biases: Mapping[int, float] | Mapping[str, float]) -> TokenBiasLogitsProcessor:
+    """Returns a logits processor that adds a bias to the scores of the given tokens."""
+    return TokenBiasLogitsProcessor(
+        token_ids=to_token_ids(tokenizer, biases.keys()),
+        biases=list(biases.values()),
+    )
+
+
+def to_token_ids(tokenizer: LlamaCppTokenizer, tokens: Tokens) -> list[int]:
+    return [t if isinstance(t, int) else tokenizer.convert_tokens_to_ids(t) for t in tokens]
@@ -0,0 +1,201 @@
+import gc
+import struct
+import threading
+from pathlib import Path
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, BinaryIO, Optional
+from collections.abc import Callable, Hashable
+
+from ai_den.utils.paths import PathLike
+from ai_den.llama_cpp.model import LlamaCpp
+
+
+ModelKey = tuple[str, tuple[tuple[str, Hashable], ...]]
+
+
+# sizes of the fixed-size GGUF metadata value types, by type id
+GGUF_SCALAR_SIZES = {0: 1, 1: 1, 2: 2, 3: 2, 4: 4, 5: 4, 6: 4, 7: 1, 10: 8, 11: 8, 12: 8}
+GGUF_STRING, GGUF_ARRAY = 8, 9
+
+
+def model_footprint(model_path: Path, n_gpu_layers: int = -1) -> tuple[int, int]:
+    """Estimates the host and device memory used by a model from the size of its GGUF file and the offloaded layers."""
+    size = model_path.stat().st_size
+    if n_gpu_layers == 0:
+        return size, 0
+    if (num_layers := gguf_block_count(model_path)) is None:
+        # without the number of layers, assume that all of them are offloaded
+        return 0, size
+    # weights are spread about evenly over the layers; a negative count offloads all of them
+    offloaded = num_layers if n_gpu_layers < 0 else min(n_gpu_layers, num_layers)
+    device = size * offloaded // num_layers
+    return size - device, device
+
+
+def gguf_block_count(model_path: Path) -> Optional[int]:
+    """Returns the number of layers in the metadata of a GGUF file, or None if it isn't found."""
+    with open(model_path, 'rb') as f:
+        try:
+            magic, version = struct.unpack('<4sI', f.read(8))
+            if magic != b'GGUF' or version < 2:
+                return None
+            _, num_kv = struct.unpack('<QQ', f.read(16))
+            for _ in range(num_kv):
+                key = read_gguf_string(f)
+                (value_type,) = struct.unpack('<I', f.read(4))
+                if key.endswith('.block_count') and value_type in (4, 5, 10, 11):
+                    return int.from_bytes(f.read(GGUF_SCALAR_SIZES[value_type]), 'little', signed=value_type in (5, 11))
+                skip_gguf_value(f, value_type)
+        except (struct.error, KeyError):
+            # truncated metadata or an unknown value type
+            pass
+    return None
+
+
+def read_gguf_string(f: BinaryIO) -> str:
+    (length,) = struct.unpack('<Q', f.read(8))
+    return f.read(length).decode('utf-8', errors='replace')
+
+
+def skip_gguf_value(f: BinaryIO, value_type: int):
+    if value_type == GGUF_STRING:
+        (length,) = struct.unpack('<Q', f.read(8))
+        f.seek(length, 1)
+    elif value_type == GGUF_ARRAY:
+        item_type, count = struct.unpack('<IQ', f.read(12))
+        if item_type in GGUF_SCALAR_SIZES:
+            f.seek(count * GGUF_SCALAR_SIZES[item_type], 1)
+        else:
+            for _ in range(count):
+                skip_gguf_value(f, item_type)
+    else:
+        f.seek(GGUF_SCALAR_SIZES[value_type], 1)
+
+
+class ModelManager:
+    """Keeps models loaded up to a memory budget, unloading the least recently used first."""
+
+    def __init__(
+            self,
+            memory_budget: int,
+            *,
+            gpu_memory_budget: Optional[int] = None,
+            loader: Callable[..., LlamaCpp] = LlamaCpp,
+            footprint: Callable[[Path, int], tuple[int, int]] = model_footprint,
+            **model_kwargs,
+    ):
+        # without a separate gpu budget, host and device memory count against memory_budget together
+        self.memory_budget = memory_budget
+        self.gpu_memory_budget = gpu_memory_budget
+        self.loader = loader
+        self.footprint = footprint
+        self.model_kwargs = model_kwargs
+        # resident models in order of use, the least recently used first
+        self.models: OrderedDict[ModelKey, LlamaCpp] = OrderedDict()
+        # host and device memory of each resident model
+        self.sizes: dict[ModelKey, tuple[int, int]] = {}
+        self.pending: dict[ModelKey, Future] = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='model-loader')
+
+    def __len__(self) -> int:
+        return len(self.models)
+
+    def __contains__(self, model_path: PathLike) -> bool:
+        return self.key(model_path, {}) in self.models
+
+    @property
+    def memory_used(self) -> int:
+        with self.lock:
+            return self._memory_used()[0]
+
+    @property
+    def gpu_memory_used(self) -> int:
+        with self.lock:
+            return self._memory_used()[1]
+
+    def _memory_used(self) -> tuple[int, int]:
+        charges = [self._charge(key) for key in self.sizes]
+        return sum(host for host, _ in charges), sum(device for _, device in charges)
+
+    def _charge(self, key: ModelKey) -> tuple[int, int]:
+        # the memory of a model counted against the host and device budgets
+        host, device = self.sizes[key]
+        return (host + device, 0) if self.gpu_memory_budget is None else (host, device)
+
+    def key(self, model_path: PathLike, kwargs: dict[str, Any]) -> ModelKey:
+        kwargs = {**self.model_kwargs, **kwargs}
+        return str(Path(model_path).resolve()), tuple(sorted(kwargs.items()))
+
+    def get(self, model_path: PathLike, **kwargs) -> LlamaCpp:
+        """Returns the model, loading it first if it isn't resident."""
+        return self.prefetch(model_path, **kwargs).result()
+
+    def prefetch(self, model_path: PathLike, **kwargs) -> Future:
+        """Starts loading the model in the background, if it isn't resident or already loading."""
+        key = self.key(model_path, kwargs)
+        with self.lock:
+            if (llm := self.models.get(key)) is not None:
+                self.models.move_to_end(key)
+                future = Future()
+                future.set_result(llm)
+                return future
+            if (future := self.pending.get(key)) is None:
+                future = self.executor.submit(self.load, key)
+                self.pending[key] = future
+            return future
+
+    def load(self, key: ModelKey) -> LlamaCpp:
+        model_path, kwargs = Path(key[0]), dict(key[1])
+        try:
+            host, device = self.footprint(model_path, kwargs.get('n_gpu_layers', -1))
+            if self.gpu_memory_budget is None:
+                self.evict(self.memory_budget - host - device)
+            else:
+                self.evict(self.memory_budget - host, self.gpu_memory_budget - device)
+            llm = self.loader(model_path, **kwargs)
+            with self.lock:
+                self.models[key] = llm
+                self.sizes[key] = host, device
+            return llm
+        finally:
+            with self.lock:
+                self.pending.pop(key, None)
+
+    def evict(self, max_memory: int, max_gpu_memory: Optional[int] = None):
+        """Unloads the least recently used models until at most max_memory (and max_gpu_memory) is used."""
+        evicted = False
+        with self.lock:
+            while over := self._over_budget(max_memory, max_gpu_memory):
+                # the least recently used model that frees memory where the budget is exceeded
+                key = next((k for k in self.models if any(o and n for o, n in zip(over, self._charge(k)))), None)
+                if key is None:
+                    break
+                del self.models[key], self.sizes[key]
+                evicted = True
+        if evicted:
+            # llama frees its memory when the model is garbage collected
+            gc.collect()
+
+    def _over_budget(self, max_memory: int, max_gpu_memory: Optional[int]) -> Optional[tuple[bool, bool]]:
+        # which of the host and device budgets are exceeded, or None if neither is
+        host, device = self._memory_used()
+        over = host > max_memory, max_gpu_memory is not None and device > max_gpu_memory
+        return over if any(over) else None
+
+    def unload(self, model_path: Optional[PathLike] = None, **kwargs):
+        """Unloads a model, or all models if no path is given."""
+        with self.lock:
+            if model_path is None:
+                self.models.clear()
+                self.sizes.clear()
+            else:
+                key = self.key(model_path, kwargs)
+                self.models.pop(key, None)
+                self.sizes.pop(key, None)
+        gc.collect()
+
+    def close(self):
+        self.executor.shutdown()
+        self.unload()
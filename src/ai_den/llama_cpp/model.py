@@ -1,20 +1,29 @@
 import json
+import random
 from pathlib import Path
-from typing import Optional, TypeVar, overload
-from collections.abc import Iterable
+from typing import TYPE_CHECKING, Any, Optional, TypeVar, overload
+from collections.abc import Iterable, Iterator
 
 import numpy as np
+from pydantic import ValidationError
 from llama_cpp import Llama, LlamaGrammar, LogitsProcessor, ChatCompletionRequestMessage
 from llama_cpp.llama_chat_format import Jinja2ChatFormatter
 from transformers.utils import is_in_notebook
 
 from ai_den.utils.paths import PathLike
+from ai_den.utils.voting import Voting, vote
 from ai_den.llama_cpp.tokenizer import LlamaCppTokenizer
 from ai_den.llama_cpp.data_type import DataType
 
+if TYPE_CHECKING:
+    from ai_den.llama_cpp.tools import ToolRegistry
+
 
 T = TypeVar('T')
 
+# a few-shot example as a (prompt, response) pair
+Example = tuple[str, str]
+
 
 GRAMMARS_DIR = Path(__file__).parent / 'grammars'
 
@@ -28,6 +37,7 @@ class LlamaCpp:
             n_threads: int = 8,
             n_gpu_layers: int = -1,
             logits_all: bool = True,
+            embedding: bool = False,
             verbose: bool = False,
             grammars_dir: PathLike = GRAMMARS_DIR,
     ):
@@ -41,6 +51,7 @@ class LlamaCpp:
             n_threads=n_threads,
             n_gpu_layers=n_gpu_layers,
             logits_all=logits_all,
+            embedding=embedding,
             verbose=verbose,
         )
 
@@ -53,51 +64,63 @@ class LlamaCpp:
             verbose: bool = False,
             json_mode: bool = False,
             chat_mode: bool = True,
-            data_type: Optional[type[T]] = None,
+            data_type: Optional[type[T] | DataType[T]] = None,
             strict: bool = False,
+            examples: Optional[Iterable[Example]] = None,
+            system_prompt: Optional[str] = None,
             **kwargs,
     ) -> str:
-        kwargs['stream'] = verbose
-
         data_class = None
 
         if data_type:
             json_mode = True
-            data_class = DataType(data_type)
+            # prebuilt data types reuse their grammar across calls
+            data_class = data_type if isinstance(data_type, DataType) else DataType(data_type)
             kwargs['grammar'] = data_class.llama_grammar()
         elif json_mode and 'grammar' not in kwargs:
             kwargs['grammar'] = self.load_grammar('json')
 
-        if chat_mode:
-            messages = self.prompt_to_messages(prompt)
-            resp = self.create_chat_completion(messages, **kwargs)
-        else:
-            resp = self.create_completion(prompt, **kwargs)
+        if examples is not None and not chat_mode:
+            raise ValueError('few-shot examples require chat_mode')
 
         generated_text = ''
 
         if verbose:
+            # the completion methods apply the chat handler and all sampling options, as without verbose
+            if chat_mode:
+                messages = self.prompt_to_messages(prompt, system_prompt=system_prompt, examples=examples)
+                chunks = (
+                    chunk['choices'][0]['delta'].get('content') or ''
+                    for chunk in self.create_chat_completion(messages, stream=True, **kwargs)
+                )
+            else:
+                chunks = (chunk['choices'][0]['text'] for chunk in self.create_completion(prompt, stream=True, **kwargs))
+
             if is_in_notebook():
                 from IPython.display import Markdown, display
 
                 handle = display(Markdown(generated_text), display_id=True)
 
-                for chunk in resp:
-                    if content := chunk['choices'][0]['delta'].get('content'):
-                        generated_text += content
-                        markdown = f'```json\n{generated_text}\n```' if json_mode else generated_text
-                        handle.update(Markdown(markdown))
+                for content in chunks:
+                    generated_text += content
+                    markdown = f'```json\n{generated_text}\n```' if json_mode else generated_text
+                    handle.update(Markdown(markdown))
 
             else:
-                for chunk in resp:
-                    if content := chunk['choices'][0]['delta'].get('content'):
-                        generated_text += content
-                        print(content, end='')
+                for content in chunks:
+                    generated_text += content
+                    print(content, end='')
                 print()
 
-        else:
+        elif chat_mode:
+            messages = self.prompt_to_messages(prompt, system_prompt=system_prompt, examples=examples)
+            resp = self.create_chat_completion(messages, **kwargs)
             generated_text = resp['choices'][0]['message']['content']
 
+        else:
+            resp = self.create_completion(prompt, **kwargs)
+            generated_text = resp['choices'][0]['text']
+
         if data_class:
             return data_class.parse_json(generated_text, strict=strict)
         elif json_mode:
@@ -105,6 +128,103 @@ class LlamaCpp:
         else:
             return generated_text
 
+    def stream(
+            self,
+            prompt: str,
+            *,
+            chat_mode: bool = True,
+            system_prompt: Optional[str] = None,
+            examples: Optional[Iterable[Example]] = None,
+            temperature: float = 0.0,
+            max_tokens: Optional[int] = None,
+            grammar: Optional[LlamaGrammar] = None,
+            logits_processor: Optional[LogitsProcessor] = None,
+            seed: Optional[int] = None,
+    ) -> Iterator[str]:
+        """Yields the generated text as it is produced, once characters split over several tokens are complete."""
+        if chat_mode:
+            messages = self.prompt_to_messages(prompt, system_prompt=system_prompt, examples=examples)
+            prompt = self.messages_to_prompt(messages, add_generation_prompt=True)
+        # chat templates usually render the bos token themselves
+        tokens = self.tokenizer.encode(prompt, add_special_tokens=not prompt.startswith(self.tokenizer.bos_token))
+        if seed is not None:
+            self.llm.set_seed(seed)
+        detokenizer = self.tokenizer.detokenizer(skip_special_tokens=True)
+        generated = self.llm.generate(
+            tokens,
+            temp=temperature,
+            grammar=grammar,
+            logits_processor=logits_processor,
+        )
+        for i, token in enumerate(generated):
+            # generation ends at the first control token, e.g., eos or an end of turn marker
+            if self.tokenizer.special_tokens_mask[token]:
+                break
+            if text := detokenizer.feed(token):
+                yield text
+            if max_tokens is not None and i + 1 >= max_tokens:
+                break
+        if text := detokenizer.flush():
+            yield text
+
+    def call_tool(
+            self,
+            prompt: str,
+            tools: 'ToolRegistry',
+            *,
+            system_prompt: Optional[str] = None,
+            **kwargs,
+    ) -> Any:
+        """Generates a call to one of the tools, constrained by their grammar, and returns its result."""
+        call = self(
+            prompt,
+            data_type=tools.data_type,
+            system_prompt=tools.system_prompt(self.system_prompt if system_prompt is None else system_prompt),
+            **kwargs,
+        )
+        return tools.dispatch(call)
+
+    def sample(
+            self,
+            prompt: str,
+            n: int,
+            *,
+            data_type: Optional[type[T] | DataType[T]] = None,
+            temperature: float = 0.7,
+            seed: Optional[int] = None,
+            **kwargs,
+    ) -> list[Any]:
+        """Generates n samples for the same prompt as n sequential completions, so the cost is linear in n; samples that fail to parse are skipped."""
+        # each sample is seeded with seed + i; decoding isn't shared between samples by forking or batching sequences
+        if data_type is not None and not isinstance(data_type, DataType):
+            # build the data type once, so all samples share its grammar
+            data_type = DataType(data_type)
+        if seed is None:
+            seed = random.randrange(2**31)
+        samples = []
+        for i in range(n):
+            try:
+                samples.append(self(prompt, data_type=data_type, temperature=temperature, seed=seed + i, **kwargs))
+            except (ValidationError, json.JSONDecodeError):
+                # e.g., json truncated by max_tokens
+                continue
+        return samples
+
+    def self_consistency(
+            self,
+            prompt: str,
+            n: int = 5,
+            *,
+            voting: Voting = 'exact',
+            field: Optional[str] = None,
+            **kwargs,
+    ) -> Any:
+        """Samples n results for the prompt and aggregates them by voting."""
+        samples = self.sample(prompt, n, **kwargs)
+        if not samples:
+            raise ValueError(f'none of the {n} samples could be parsed')
+        return vote(samples, voting, field=field)
+
     def set_chat_template(self, template: str):
         self.llm.metadata['tokenizer.chat_template'] = template
         self.llm.chat_handler = self.chat_formatter(add_generation_prompt=True).to_chat_handler()
@@ -131,6 +251,7 @@ class LlamaCpp:
             prompt: str,
             *,
             system_prompt: Optional[str] = None,
+            examples: Optional[Iterable[Example]] = None,
     ) -> list[ChatCompletionRequestMessage]:
         messages = []
 
@@ -140,6 +261,12 @@ class LlamaCpp:
         if system_prompt is not None:
             messages.append({'role': 'system', 'content': system_prompt})
 
+        # few-shot examples are rendered as previous turns of the conversation
+        if examples is not None:
+            for example_prompt, example_response in examples:
+                messages.append({'role': 'user', 'content': example_prompt})
+                messages.append({'role': 'assistant', 'content': example_response})
+
         messages.append({'role': 'user', 'content': prompt})
 
         return messages
@@ -163,11 +290,13 @@ class LlamaCpp:
 
     def create_grammar(
             self,
-            data_type: type,
+            data_type: type | DataType,
             *,
             verbose: bool = False,
     ) -> LlamaGrammar:
-        return DataType(data_type).llama_grammar(verbose=verbose)
+        if not isinstance(data_type, DataType):
+            data_type = DataType(data_type)
+        return data_type.llama_grammar(verbose=verbose)
 
     def create_completion(
             self,
@@ -175,20 +304,26 @@ class LlamaCpp:
             *,
             stream: bool = False,
             temperature: float = 0.0,
+            top_p: float = 0.95,
             max_tokens: Optional[int] = None,
+            stop: Optional[str | list[str]] = None,
             grammar: Optional[LlamaGrammar] = None,
             logprobs: Optional[int] = None,
             logits_processor: Optional[LogitsProcessor] = None,
             data_type: Optional[type[T]] = None,
+            seed: Optional[int] = None,
     ):
         return self.llm.create_completion(
             prompt=prompt,
             stream=stream,
             temperature=temperature,
+            top_p=top_p,
             max_tokens=max_tokens,
+            stop=stop,
             grammar=self.create_grammar(data_type) if data_type else grammar,
             logprobs=logprobs,
             logits_processor=logits_processor,
+            seed=seed,
         )
 
     def create_chat_completion(
@@ -197,21 +332,27 @@ class LlamaCpp:
             *,
             stream: bool = False,
             temperature: float = 0.0,
+            top_p: float = 0.95,
             max_tokens: Optional[int] = None,
+            stop: Optional[str | list[str]] = None,
             grammar: Optional[LlamaGrammar] = None,
             logprobs: Optional[int] = None,
             logits_processor: Optional[LogitsProcessor] = None,
             data_type: Optional[type[T]] = None,
+            seed: Optional[int] = None,
     ):
         return self.llm.create_chat_completion(
             messages=messages,
             stream=stream,
             temperature=temperature,
+            top_p=top_p,
             max_tokens=max_tokens,
+            stop=stop,
             grammar=self.create_grammar(data_type) if data_type else grammar,
             logprobs=logprobs is not None,
             top_logprobs=logprobs,
             logits_processor=logits_processor,
+            seed=seed,
         )
 
     def logprob(self, text: str, start: Optional[int] = None, stop: Optional[int] = None) -> float:
@@ -232,6 +373,23 @@ class LlamaCpp:
         # return total log-probability
         return token_logprobs[start:stop].sum().item()
 
+    def embed(self, texts: str | list[str], normalize: bool = True) -> np.ndarray:
+        """Computes one embedding per text, mean-pooling token embeddings if needed."""
+        if isinstance(texts, str):
+            return self.embed([texts], normalize)[0]
+        embeddings = []
+        for e in self.llm.embed(texts, normalize=False):
+            e = np.asarray(e, dtype=np.float32)
+            # models without a pooling layer return one embedding per token
+            if e.ndim == 2:
+                e = e.mean(axis=0)
+            embeddings.append(e)
+        embeddings = np.stack(embeddings) if embeddings else np.empty((0, self.llm.n_embd()), dtype=np.float32)
+        if normalize:
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            embeddings /= np.maximum(norms, np.finfo(np.float32).tiny)
+        return embeddings
+
     def tokenize(self, text: str, add_special_tokens: bool = True) -> list[int]:
         return self.tokenizer.encode(text, add_special_tokens)
 
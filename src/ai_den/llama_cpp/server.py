@@ -0,0 +1,311 @@
+import json
+import time
+import queue
+import threading
+from functools import lru_cache
+from concurrent.futures import Future
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Optional
+from collections.abc import Callable, Iterator, Mapping
+
+from llama_cpp import LlamaGrammar
+
+from ai_den.llama_cpp.model import LlamaCpp
+from ai_den.llama_cpp.data_type import DataType
+
+
+# number of response_format schemas whose grammars are kept
+SCHEMA_CACHE_SIZE = 64
+
+# generation parameters forwarded from requests to the model, with their types
+GENERATION_PARAMS = {
+    'temperature': (int, float),
+    'top_p': (int, float),
+    'max_tokens': int,
+    'seed': int,
+    'stop': (str, list),
+}
+
+
+class APIError(Exception):
+    """An error reported to the client in the format of the OpenAI API."""
+
+    def __init__(self, message: str, status: HTTPStatus = HTTPStatus.BAD_REQUEST, param: Optional[str] = None):
+        super().__init__(message)
+        self.status = status
+        self.param = param
+
+    def to_dict(self) -> dict[str, Any]:
+        error_type = 'invalid_request_error' if self.status < 500 else 'server_error'
+        return {'error': {'message': str(self), 'type': error_type, 'param': self.param, 'code': None}}
+
+
+class ModelWorker:
+    """Runs all requests for a model in a single thread, in the order they arrive."""
+
+    def __init__(self, name: str, llm: LlamaCpp):
+        self.name = name
+        self.llm = llm
+        # grammars hold sampling state, so each worker keeps its own, keyed by the canonical json of the schema
+        self.grammar: Callable[[str], LlamaGrammar] = lru_cache(maxsize=SCHEMA_CACHE_SIZE)(make_grammar)
+        self.jobs: queue.Queue[Optional[tuple[Callable[[LlamaCpp], Any], Future]]] = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name=f'llama-{name}', daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while (job := self.jobs.get()) is not None:
+            fn, future = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(self.llm))
+            except BaseException as e:
+                future.set_exception(e)
+
+    def submit(self, fn: Callable[[LlamaCpp], Any]) -> Future:
+        future = Future()
+        self.jobs.put((fn, future))
+        return future
+
+    def stream(self, fn: Callable[[LlamaCpp], Iterator[Any]], cancelled: threading.Event) -> Iterator[Any]:
+        """Yields the chunks of a streamed generation as the worker produces them."""
+        chunks = queue.Queue()
+        done = object()
+
+        def job(llm: LlamaCpp):
+            try:
+                for chunk in fn(llm):
+                    # stop generating if the client went away
+                    if cancelled.is_set():
+                        break
+                    chunks.put(chunk)
+            finally:
+                chunks.put(done)
+
+        future = self.submit(job)
+        while (chunk := chunks.get()) is not done:
+            yield chunk
+        # re-raise errors from the worker
+        future.result()
+
+    def close(self):
+        self.jobs.put(None)
+        self.thread.join()
+
+
+def make_grammar(schema: str) -> LlamaGrammar:
+    return DataType.from_schema(json.loads(schema)).llama_grammar()
+
+
+class LlamaCppServer:
+    """Serves one or more models through an OpenAI-compatible HTTP API."""
+
+    def __init__(
+            self,
+            models: LlamaCpp | Mapping[str, LlamaCpp],
+            host: str = '127.0.0.1',
+            port: int = 8000,
+    ):
+        if isinstance(models, LlamaCpp):
+            models = {models.model_path.stem: models}
+        if not models:
+            raise ValueError('no models to serve')
+        self.workers = {name: ModelWorker(name, llm) for name, llm in models.items()}
+        self.created = int(time.time())
+        self.httpd = ThreadingHTTPServer((host, port), make_handler(self))
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}/v1'
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def start(self):
+        """Serves requests in a background thread."""
+        self.thread = threading.Thread(target=self.serve_forever, name='llama-server', daemon=True)
+        self.thread.start()
+
+    def shutdown(self):
+        if self.thread is not None:
+            self.httpd.shutdown()
+            self.thread.join()
+            self.thread = None
+        self.httpd.server_close()
+        for worker in self.workers.values():
+            worker.close()
+
+    def __enter__(self) -> 'LlamaCppServer':
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+
+    def list_models(self) -> dict[str, Any]:
+        return {
+            'object': 'list',
+            'data': [
+                {'id': name, 'object': 'model', 'created': self.created, 'owned_by': 'ai_den'}
+                for name in self.workers
+            ],
+        }
+
+    def get_worker(self, request: dict[str, Any]) -> ModelWorker:
+        name = request.get('model')
+        if name is None and len(self.workers) == 1:
+            return next(iter(self.workers.values()))
+        if name not in self.workers:
+            raise APIError(f'model not found: {name}', HTTPStatus.NOT_FOUND, 'model')
+        return self.workers[name]
+
+    def completion(self, request: dict[str, Any], chat: bool, cancelled: threading.Event) -> Any:
+        """Returns the response for a completion request, or an iterator of chunks if streamed."""
+        worker = self.get_worker(request)
+        kwargs = get_generation_params(request)
+        if (schema := get_schema(request)) is not None:
+            try:
+                kwargs['grammar'] = worker.grammar(schema)
+            except Exception as e:
+                # the grammar is built from the schema alone, so any error is the client's
+                raise APIError(f'invalid schema: {type(e).__name__}: {e}', param='response_format') from e
+        stream = bool(request.get('stream'))
+
+        if chat:
+            if not isinstance(messages := request.get('messages'), list):
+                raise APIError('messages must be a list', param='messages')
+            if request.get('logprobs'):
+                kwargs['logprobs'] = request.get('top_logprobs') or 0
+            fn = lambda llm: llm.create_chat_completion(messages, stream=stream, **kwargs)
+        else:
+            if not isinstance(prompt := request.get('prompt'), str):
+                raise APIError('prompt must be a string', param='prompt')
+            if request.get('logprobs') is not None:
+                kwargs['logprobs'] = request['logprobs']
+            fn = lambda llm: llm.create_completion(prompt, stream=stream, **kwargs)
+
+        if stream:
+            return (rename_model(chunk, worker.name) for chunk in worker.stream(fn, cancelled))
+        return rename_model(worker.submit(fn).result(), worker.name)
+
+
+def get_generation_params(request: dict[str, Any]) -> dict[str, Any]:
+    # unsupported parameters are rejected, rather than silently ignored
+    if request.get('n', 1) not in (None, 1):
+        raise APIError('only n=1 is supported', param='n')
+    kwargs = {}
+    for name, types in GENERATION_PARAMS.items():
+        if (value := request.get(name)) is None:
+            continue
+        if isinstance(value, bool) or not isinstance(value, types) or (
+                isinstance(value, list) and not all(isinstance(s, str) for s in value)):
+            raise APIError(f'invalid {name}: {value!r}', param=name)
+        kwargs[name] = value
+    return kwargs
+
+
+def get_schema(request: dict[str, Any]) -> Optional[str]:
+    """Returns the canonical json of the schema requested by response_format, if any."""
+    response_format = request.get('response_format') or {}
+    match response_format.get('type', 'text'):
+        case 'text':
+            return None
+        case 'json_object':
+            return json.dumps({'type': 'object'})
+        case 'json_schema':
+            schema = (response_format.get('json_schema') or {}).get('schema')
+            if not isinstance(schema, dict):
+                raise APIError('json_schema requires a schema', param='response_format')
+            return json.dumps(schema, sort_keys=True)
+        case t:
+            raise APIError(f'unsupported response_format: {t}', param='response_format')
+
+
+def rename_model(response: dict[str, Any], name: str) -> dict[str, Any]:
+    # llama reports the model path, clients expect the name they asked for
+    response['model'] = name
+    return response
+
+
+def make_handler(server: LlamaCppServer) -> type[BaseHTTPRequestHandler]:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            if self.path.rstrip('/') == '/v1/models':
+                self.send_json(server.list_models())
+            else:
+                self.send_error_json(APIError(f'unknown endpoint: {self.path}', HTTPStatus.NOT_FOUND))
+
+        def do_POST(self):
+            path = self.path.rstrip('/')
+            if path not in ('/v1/completions', '/v1/chat/completions'):
+                self.send_error_json(APIError(f'unknown endpoint: {self.path}', HTTPStatus.NOT_FOUND))
+                return
+            cancelled = threading.Event()
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                try:
+                    request = json.loads(self.rfile.read(length))
+                except json.JSONDecodeError as e:
+                    raise APIError(f'invalid json: {e}')
+                if not isinstance(request, dict):
+                    raise APIError('request must be a json object')
+                response = server.completion(request, path == '/v1/chat/completions', cancelled)
+            except APIError as e:
+                self.send_error_json(e)
+                return
+            except Exception as e:
+                self.send_error_json(APIError(f'{type(e).__name__}: {e}', HTTPStatus.INTERNAL_SERVER_ERROR))
+                return
+            if isinstance(response, dict):
+                self.send_json(response)
+                return
+            try:
+                self.send_events(response)
+            except (BrokenPipeError, ConnectionResetError):
+                # the client disconnected, let the worker move on to the next request
+                cancelled.set()
+                for _ in response:
+                    pass
+
+        def send_json(self, obj: Any, status: HTTPStatus = HTTPStatus.OK):
+            body = json.dumps(obj, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def send_error_json(self, error: APIError):
+            self.send_json(error.to_dict(), error.status)
+
+        def send_events(self, chunks: Iterator[dict[str, Any]]):
+            # server-sent events, closing the connection to mark the end of the stream
+            self.send_response(HTTPStatus.OK)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            self.close_connection = True
+            try:
+                for chunk in chunks:
+                    self.wfile.write(f'data: {json.dumps(chunk, ensure_ascii=False)}\n\n'.encode('utf-8'))
+                    self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                raise
+            except Exception as e:
+                # the response has already started, so errors are reported as an event
+                error = APIError(f'{type(e).__name__}: {e}', HTTPStatus.INTERNAL_SERVER_ERROR)
+                self.wfile.write(f'data: {json.dumps(error.to_dict())}\n\n'.encode('utf-8'))
+            self.wfile.write(b'data: [DONE]\n\n')
+            self.wfile.flush()
+
+        def log_message(self, format: str, *args):
+            # keep notebooks quiet
+            pass
+
+    return Handler
@@ -1,11 +1,36 @@
 import re
+import codecs
+import hashlib
+import operator
+from pathlib import Path
+from functools import partial
 from typing import Optional, overload
-from collections.abc import Iterable
+from collections.abc import Iterable, Iterator, Sequence
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import llama_cpp
+from ai_den.utils.paths import CACHE_DIR, PathLike
+from ai_den.utils.files import atomic_save
+from ai_den.utils.arrays import lengths_to_offsets
+from ai_den.llama_cpp.encoding import BatchEncoding, WordAlignment, word_char_offsets
 
 
 ENCODING = 'utf-8'
 
+TOKENIZER_CACHE_DIR = CACHE_DIR / 'tokenizers'
+
+# bump when the format of the cached vocabulary tables changes
+VOCAB_TABLES_VERSION = 4
+
+# number of texts tokenized by each task of encode_batch()
+ENCODE_BATCH_CHUNK_SIZE = 256
+
+SPECIAL_TOKEN_TYPES = (
+    llama_cpp.LLAMA_TOKEN_TYPE_UNKNOWN,
+    llama_cpp.LLAMA_TOKEN_TYPE_CONTROL,
+    llama_cpp.LLAMA_TOKEN_TYPE_USER_DEFINED,
+)
+
 SENTENCEPIECE_WHITESPACE = '\u2581'
 
 
@@ -20,30 +45,279 @@ def parse_byte_token(token: str) -> Optional[str]:
         return chr(int(m[1], base=16))
 
 
+def bytes_to_unicode() -> dict[int, str]:
+    """Returns the mapping used by byte-level BPE vocabularies to represent bytes as printable characters."""
+    bs = list(range(ord('!'), ord('~') + 1)) + list(range(ord('¡'), ord('¬') + 1)) + list(range(ord('®'), ord('ÿ') + 1))
+    cs = bs[:]
+    n = 0
+    for b in range(256):
+        if b not in bs:
+            bs.append(b)
+            cs.append(256 + n)
+            n += 1
+    return dict(zip(bs, map(chr, cs)))
+
+BYTE_DECODER = {c: b for b, c in bytes_to_unicode().items()}
+
+
+def pack_bytes(items: list[bytes]) -> tuple[np.ndarray, np.ndarray]:
+    return np.frombuffer(b''.join(items), dtype=np.uint8), lengths_to_offsets(map(len, items))
+
+def unpack_bytes(data: np.ndarray, offsets: np.ndarray) -> list[bytes]:
+    buffer = data.tobytes()
+    offsets = offsets.tolist()
+    return [buffer[i:j] for i, j in zip(offsets[:-1], offsets[1:])]
+
+def pack_strings(strings: list[str]) -> tuple[np.ndarray, np.ndarray]:
+    return pack_bytes([s.encode(ENCODING) for s in strings])
+
+def unpack_strings(data: np.ndarray, offsets: np.ndarray) -> list[str]:
+    return [b.decode(ENCODING) for b in unpack_bytes(data, offsets)]
+
+
+def hash_vocab(tokenizer: 'LlamaCppTokenizer', texts: list[str], types: np.ndarray) -> str:
+    h = hashlib.sha256()
+    h.update(f'{VOCAB_TABLES_VERSION}:{tokenizer.vocab_type}:{tokenizer.vocab_size}:{tokenizer.bos_token_id}:{tokenizer.eos_token_id}'.encode())
+    # every token, so that vocabularies that differ in a single token get different hashes
+    raw_texts = [text.encode(ENCODING) for text in texts]
+    h.update(np.array([len(text) for text in raw_texts], dtype=np.int64).tobytes())
+    h.update(b''.join(raw_texts))
+    h.update(types.astype(np.int32).tobytes())
+    return h.hexdigest()
+
+
 class LlamaCppTokenizer:
-    def __init__(self, llama: llama_cpp.Llama):
+    def __init__(self, llama: llama_cpp.Llama, cache_dir: Optional[PathLike] = TOKENIZER_CACHE_DIR):
         self.llama = llama
         self.vocab_type = llama_cpp.llama_vocab_type(self.llama.model)
         self.vocab_size = llama_cpp.llama_n_vocab(self.llama.model)
         self.bos_token_id = llama_cpp.llama_token_bos(self.llama.model)
         self.eos_token_id = llama_cpp.llama_token_eos(self.llama.model)
+        self._vocab_fingerprint = None
+
+        # vocabulary tables, all indexed by token id
+        # token_bytes holds the raw bytes of every token, used for byte-level detokenization
+        self.token_texts, self.token_types, self.token_pieces, self.token_bytes = self.load_vocab_tables(cache_dir)
+        self.special_tokens_mask = np.isin(self.token_types, SPECIAL_TOKEN_TYPES)
+        self.token_bytes_skip_special = [
+            b'' if special else b
+            for b, special in zip(self.token_bytes, self.special_tokens_mask.tolist())
+        ]
+        self.token_byte_lengths = np.array([len(b) for b in self.token_bytes], dtype=np.int64)
+
         self.bos_token = self._id_to_token(self.bos_token_id)
         self.eos_token = self._id_to_token(self.eos_token_id)
 
         self.token_ids = {
-            self._id_to_token(i): i
-            for i in range(self.vocab_size)
+            token: i
+            for i, token in enumerate(self.token_texts)
         }
 
     @property
     def is_sentencepiece(self) -> bool:
         return self.vocab_type == llama_cpp.LLAMA_VOCAB_TYPE_SPM
 
+    def vocab_fingerprint(self) -> str:
+        """Returns a hash of the whole vocabulary, which identifies the cached tables derived from it."""
+        if self._vocab_fingerprint is None:
+            self._vocab_fingerprint = hash_vocab(self, self.token_texts, self.token_types)
+        return self._vocab_fingerprint
+
+    def model_key(self) -> Optional[str]:
+        """Returns a hash of the path, size and modification time of the model file, or None if there is no such file."""
+        model_path = getattr(self.llama, 'model_path', None)
+        if model_path is None or not Path(model_path).is_file():
+            return None
+        path = Path(model_path).resolve()
+        stat = path.stat()
+        key = f'{VOCAB_TABLES_VERSION}:{path}:{stat.st_size}:{stat.st_mtime_ns}'
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def read_vocab(self) -> tuple[list[str], np.ndarray]:
+        """Returns the text and the type of every token."""
+        texts = [llama_cpp.llama_token_get_text(self.llama.model, i).decode(ENCODING) for i in range(self.vocab_size)]
+        types = np.array(
+            [llama_cpp.llama_token_get_type(self.llama.model, i) for i in range(self.vocab_size)],
+            dtype=np.int32,
+        )
+        return texts, types
+
+    def load_vocab_tables(
+            self,
+            cache_dir: Optional[PathLike] = None,
+    ) -> tuple[list[str], np.ndarray, list[str], list[bytes]]:
+        """Returns the text, type, decoded piece and raw bytes of every token, reading them from cache if possible."""
+        if cache_dir is None:
+            texts, types = self.read_vocab()
+            return texts, types, *self.build_vocab_tables(texts, types)
+        # keyed by the model file if possible, so that a cache hit doesn't read the vocabulary token by token
+        texts = types = None
+        if (key := self.model_key()) is None:
+            texts, types = self.read_vocab()
+            key = self._vocab_fingerprint = hash_vocab(self, texts, types)
+        path = Path(cache_dir) / f'{key}.npz'
+        if path.exists():
+            with np.load(path) as data:
+                self._vocab_fingerprint = str(data['fingerprint'])
+                return (
+                    unpack_strings(data['texts'], data['text_offsets']),
+                    data['types'],
+                    unpack_strings(data['pieces'], data['piece_offsets']),
+                    unpack_bytes(data['bytes'], data['byte_offsets']),
+                )
+        if texts is None:
+            texts, types = self.read_vocab()
+            self._vocab_fingerprint = hash_vocab(self, texts, types)
+        pieces, token_bytes = self.build_vocab_tables(texts, types)
+        texts_data, text_offsets = pack_strings(texts)
+        pieces_data, piece_offsets = pack_strings(pieces)
+        bytes_data, byte_offsets = pack_bytes(token_bytes)
+        atomic_save(path, lambda tmp_path: np.savez(
+            tmp_path,
+            fingerprint=np.array(self._vocab_fingerprint),
+            texts=texts_data,
+            text_offsets=text_offsets,
+            types=types,
+            pieces=pieces_data,
+            piece_offsets=piece_offsets,
+            bytes=bytes_data,
+            byte_offsets=byte_offsets,
+        ))
+        return texts, types, pieces, token_bytes
+
+    def build_vocab_tables(self, texts: list[str], types: np.ndarray) -> tuple[list[str], list[bytes]]:
+        types = types.tolist()
+        pieces = [self._make_piece(text, token_type) for text, token_type in zip(texts, types)]
+        token_bytes = [self._make_bytes(text, token_type) for text, token_type in zip(texts, types)]
+        return pieces, token_bytes
+
     def encode(self, text: str, add_special_tokens: bool = True) -> list[int]:
         return self.llama.tokenize(text.encode(ENCODING), add_bos=add_special_tokens, special=True)
 
+    def encode_with_offsets(self, text: str, add_special_tokens: bool = True) -> tuple[list[int], np.ndarray]:
+        """Tokenizes text and returns the token ids and the character span of each token."""
+        ids = self.encode(text, add_special_tokens)
+        return ids, self.char_offsets(text, ids, add_special_tokens)
+
+    def align_words(
+            self,
+            words: list[str],
+            separator: str = ' ',
+            add_special_tokens: bool = True,
+    ) -> WordAlignment:
+        """Tokenizes a sequence of words (e.g., a CoNLL sentence) and aligns words to tokens."""
+        text = separator.join(words)
+        ids, char_offsets = self.encode_with_offsets(text, add_special_tokens)
+        return WordAlignment.from_offsets(
+            text=text,
+            ids=np.asarray(ids, dtype=np.intc),
+            char_offsets=char_offsets,
+            word_char_offsets=word_char_offsets(words, separator),
+        )
+
+    def align_words_batch(
+            self,
+            batch: Sequence[list[str]],
+            separator: str = ' ',
+            add_special_tokens: bool = True,
+            *,
+            num_threads: Optional[int] = None,
+    ) -> list[WordAlignment]:
+        texts = [separator.join(words) for words in batch]
+        encoding = self.encode_batch(texts, add_special_tokens, return_char_offsets=True, num_threads=num_threads)
+        return [
+            WordAlignment.from_offsets(
+                text=text,
+                ids=encoding[i],
+                char_offsets=encoding.get_char_offsets(i),
+                word_char_offsets=word_char_offsets(words, separator),
+            )
+            for i, (text, words) in enumerate(zip(texts, batch))
+        ]
+
+    def encode_batch(
+            self,
+            texts: Sequence[str],
+            add_special_tokens: bool = True,
+            *,
+            return_char_offsets: bool = False,
+            num_threads: Optional[int] = None,
+    ) -> BatchEncoding:
+        """Tokenizes many texts in parallel and packs the results into flat arrays."""
+        # llama.cpp releases the GIL while tokenizing, so threads run in parallel
+        chunks = [texts[i:i+ENCODE_BATCH_CHUNK_SIZE] for i in range(0, len(texts), ENCODE_BATCH_CHUNK_SIZE)]
+        encode_chunk = partial(self._encode_chunk, add_special_tokens=add_special_tokens)
+        if len(chunks) > 1:
+            with ThreadPoolExecutor(num_threads) as executor:
+                encoded = [ids for chunk in executor.map(encode_chunk, chunks) for ids in chunk]
+        else:
+            encoded = [ids for chunk in map(encode_chunk, chunks) for ids in chunk]
+        char_offsets = None
+        if return_char_offsets:
+            char_offsets = [
+                self.char_offsets(text, ids, add_special_tokens)
+                for text, ids in zip(texts, encoded)
+            ]
+        return BatchEncoding.from_lists(encoded, char_offsets)
+
+    def count_tokens(
+            self,
+            texts: Sequence[str],
+            add_special_tokens: bool = True,
+            *,
+            num_threads: Optional[int] = None,
+    ) -> np.ndarray:
+        """Returns the number of tokens of each text."""
+        return self.encode_batch(texts, add_special_tokens, num_threads=num_threads).lengths
+
+    def within_budget(
+            self,
+            texts: Sequence[str],
+            max_tokens: int,
+            add_special_tokens: bool = True,
+            *,
+            num_threads: Optional[int] = None,
+    ) -> np.ndarray:
+        """Returns a boolean mask of the texts that fit in max_tokens tokens."""
+        return self.count_tokens(texts, add_special_tokens, num_threads=num_threads) <= max_tokens
+
+    def char_offsets(self, text: str, ids: Sequence[int], add_special_tokens: bool = True) -> np.ndarray:
+        """Returns the start and end character positions of each token in text."""
+        ids = np.asarray(ids, dtype=np.int64)
+        lengths = self.token_byte_lengths[ids]
+        # the bos token added by the tokenizer doesn't occur in the text
+        if add_special_tokens and len(ids) > 0 and ids[0] == self.bos_token_id and not text.startswith(self.bos_token):
+            lengths[0] = 0
+        ends = np.cumsum(lengths)
+        starts = ends - lengths
+        text_bytes = np.frombuffer(text.encode(ENCODING), dtype=np.uint8)
+        # any extra bytes are assumed to be the space that sentencepiece prepends to the text
+        if len(ends) > 0 and (extra := ends[-1] - len(text_bytes)) > 0:
+            starts -= extra
+            ends -= extra
+        starts = np.clip(starts, 0, len(text_bytes))
+        ends = np.clip(ends, 0, len(text_bytes))
+        # map byte positions to character positions, expanding tokens that split a character
+        is_char_start = (text_bytes & 0xC0) != 0x80
+        chars_before = np.zeros(len(text_bytes) + 1, dtype=np.int64)
+        np.cumsum(is_char_start, out=chars_before[1:])
+        chars_up_to = np.append(chars_before[1:] - 1, chars_before[-1])
+        char_starts = chars_up_to[starts]
+        char_ends = np.maximum(chars_before[ends], char_starts)
+        return np.stack([char_starts, char_ends], axis=1)
+
     def decode(self, ids: Iterable[int], skip_special_tokens: bool = False) -> str:
-        return ''.join(self._token_to_piece(id, skip_special_tokens) for id in ids)
+        return self._ids_to_bytes(ids, skip_special_tokens).decode(ENCODING, errors='replace')
+
+    def decode_batch(self, batch: Iterable[Iterable[int]], skip_special_tokens: bool = False) -> list[str]:
+        table = self._bytes_table(skip_special_tokens)
+        return [
+            b''.join(map(table.__getitem__, ids)).decode(ENCODING, errors='replace')
+            for ids in batch
+        ]
+
+    def detokenizer(self, skip_special_tokens: bool = False) -> 'Detokenizer':
+        return Detokenizer(self, skip_special_tokens)
 
     @overload
     def convert_ids_to_tokens(self, id: int) -> str:
@@ -102,13 +376,13 @@ class LlamaCppTokenizer:
             return [self._unescape_token(t) for t in x]
 
     def convert_tokens_to_string(self, tokens: Iterable[str], skip_special_tokens: bool = False) -> str:
-        return ''.join(self._token_to_piece(t, skip_special_tokens) for t in tokens)
+        return self.decode(map(self._token_to_id, tokens), skip_special_tokens)
 
     def _id_to_token(self, id: int) -> str:
-        return llama_cpp.llama_token_get_text(self.llama.model, id).decode(ENCODING)
+        return self.token_texts[id]
 
     def _id_to_token_type(self, id: int) -> int:
-        return llama_cpp.llama_token_get_type(self.llama.model, id)
+        return int(self.token_types[id])
 
     def _token_to_id(self, token: str) -> int:
         token = self._escape_token(token)
@@ -130,24 +404,82 @@ class LlamaCppTokenizer:
             return char
         return token
 
+    def _encode_chunk(self, texts: Sequence[str], add_special_tokens: bool) -> list[list[int]]:
+        return [self.encode(text, add_special_tokens) for text in texts]
+
+    def _bytes_table(self, skip_special_tokens: bool) -> list[bytes]:
+        return self.token_bytes_skip_special if skip_special_tokens else self.token_bytes
+
+    def _ids_to_bytes(self, ids: Iterable[int], skip_special_tokens: bool) -> bytes:
+        return b''.join(map(self._bytes_table(skip_special_tokens).__getitem__, ids))
+
     def _token_to_piece(self, token: str | int, skip_special_tokens: bool) -> str:
-        # get token and token id
-        if isinstance(token, str):
-            token_id = self._token_to_id(token)
-        else:
-            token_id = token
-            token = self._id_to_token(token_id)
+        token_id = self._token_to_id(token) if isinstance(token, str) else token
+        if skip_special_tokens and self.special_tokens_mask[token_id]:
+            return ''
+        return self.token_pieces[token_id]
+
+    def _make_piece(self, token: str, token_type: int) -> str:
         # convert token to piece based on its type
-        match self._id_to_token_type(token_id):
+        match token_type:
             case llama_cpp.LLAMA_TOKEN_TYPE_NORMAL:
                 return unescape_whitespace(token) if self.is_sentencepiece else token
             case llama_cpp.LLAMA_TOKEN_TYPE_UNKNOWN:
-                return '' if skip_special_tokens else token
+                return token
             case llama_cpp.LLAMA_TOKEN_TYPE_CONTROL:
-                return '' if skip_special_tokens else token
+                return token
             case llama_cpp.LLAMA_TOKEN_TYPE_USER_DEFINED:
-                return '' if skip_special_tokens else token
+                return token
             case llama_cpp.LLAMA_TOKEN_TYPE_BYTE:
-                return parse_byte_token(token)
+                return parse_byte_token(token) or ''
             case _:
                 return ''
+
+    def _make_bytes(self, token: str, token_type: int) -> bytes:
+        match token_type:
+            case llama_cpp.LLAMA_TOKEN_TYPE_NORMAL:
+                if self.is_sentencepiece:
+                    return unescape_whitespace(token).encode(ENCODING)
+                if self.vocab_type == llama_cpp.LLAMA_VOCAB_TYPE_BPE:
+                    # byte-level bpe represents each byte with a printable character
+                    if all(c in BYTE_DECODER for c in token):
+                        return bytes(BYTE_DECODER[c] for c in token)
+                return token.encode(ENCODING)
+            case llama_cpp.LLAMA_TOKEN_TYPE_BYTE:
+                if m := re.match(r'^<0x([0-9a-f]{2})>$', token, re.IGNORECASE):
+                    return bytes([int(m[1], base=16)])
+                return b''
+            case t if t in SPECIAL_TOKEN_TYPES:
+                return token.encode(ENCODING)
+            case _:
+                return b''
+
+
+class Detokenizer:
+    """Converts a stream of token ids to text, buffering bytes until they form complete characters."""
+
+    def __init__(self, tokenizer: LlamaCppTokenizer, skip_special_tokens: bool = False, errors: str = 'replace'):
+        self.table = tokenizer._bytes_table(skip_special_tokens)
+        self.decoder = codecs.getincrementaldecoder(ENCODING)(errors)
+
+    def feed(self, ids: int | Iterable[int]) -> str:
+        """Consumes one or more token ids and returns the text they complete."""
+        if not isinstance(ids, Iterable):
+            # accepts any integer type, e.g., numpy integers
+            return self.decoder.decode(self.table[operator.index(ids)])
+        return self.decoder.decode(b''.join(map(self.table.__getitem__, ids)))
+
+    def flush(self) -> str:
+        """Returns any buffered text, replacing incomplete characters."""
+        return self.decoder.decode(b'', final=True)
+
+    def reset(self):
+        self.decoder.reset()
+
+    def stream(self, ids: Iterable[int]) -> Iterator[str]:
+        """Yields text chunks as soon as they are complete."""
+        for id in ids:
+            if text := self.feed(id):
+                yield text
+        if text := self.flush():
+            yield text
@@ -0,0 +1,121 @@
+import json
+import inspect
+from typing import Annotated, Any, Literal, Optional, Union
+from collections.abc import Callable, Iterable, Iterator
+
+from pydantic import BaseModel, Field, TypeAdapter, create_model
+
+from ai_den.llama_cpp.data_type import DataType
+from ai_den.utils.json_schema import (
+    create_schema,
+    new_pydantic_model_from_callable,
+    prepare_type_for_pydantic_compatibility,
+)
+
+
+class Tool:
+    """A callable registered as a tool, with everything needed to generate and dispatch calls to it."""
+
+    def __init__(self, function: Callable, name: Optional[str] = None):
+        self.function = function
+        self.name = name or function.__name__
+        self.arguments_model = new_pydantic_model_from_callable(function, self.name)
+        self.schema = create_schema(function, name=self.name)
+        # a call is an object with the tool name and its arguments
+        self.call_model = create_model(
+            f'{self.name}_call',
+            name=(Literal[self.name], ...),
+            arguments=(self.arguments_model, ...),
+        )
+        # arguments whose types were converted for pydantic (e.g., dataclasses) are converted back
+        self.argument_adapters: dict[str, tuple[TypeAdapter, TypeAdapter]] = {}
+        for p in inspect.signature(function).parameters.values():
+            if p.annotation is inspect.Parameter.empty:
+                continue
+            prepared = prepare_type_for_pydantic_compatibility(p.annotation)
+            if prepared is not p.annotation:
+                self.argument_adapters[p.name] = (TypeAdapter(prepared), TypeAdapter(p.annotation))
+
+    def __call__(self, arguments: BaseModel) -> Any:
+        kwargs = {}
+        for name in type(arguments).model_fields:
+            value = getattr(arguments, name)
+            if adapters := self.argument_adapters.get(name):
+                dump, load = adapters
+                value = load.validate_python(dump.dump_python(value))
+            kwargs[name] = value
+        return self.function(**kwargs)
+
+
+class ToolRegistry:
+    """Tools available to a model, with their schemas, grammar and validator built once."""
+
+    def __init__(self, tools: Iterable[Callable] = ()):
+        self.tools: dict[str, Tool] = {}
+        self._data_type: Optional[DataType] = None
+        self._description: Optional[str] = None
+        for f in tools:
+            self.register(f)
+
+    def __len__(self) -> int:
+        return len(self.tools)
+
+    def __iter__(self) -> Iterator[Tool]:
+        return iter(self.tools.values())
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.tools
+
+    def __getitem__(self, name: str) -> Tool:
+        return self.tools[name]
+
+    def register(self, f: Optional[Callable] = None, *, name: Optional[str] = None):
+        """Registers a callable as a tool. Can be used as a decorator, with or without a name."""
+        if f is None:
+            return lambda f: self.register(f, name=name)
+        tool = Tool(f, name)
+        if tool.name in self.tools:
+            raise ValueError(f'tool already registered: {tool.name}')
+        self.tools[tool.name] = tool
+        # the combined grammar and description are rebuilt the next time they are needed
+        self._data_type = None
+        self._description = None
+        return f
+
+    @property
+    def schemas(self) -> list[dict[str, Any]]:
+        """Returns the tool schemas in the format of the OpenAI API."""
+        return [tool.schema for tool in self]
+
+    @property
+    def data_type(self) -> DataType:
+        """Returns the data type of a call to any of the tools."""
+        if not self.tools:
+            raise ValueError('no tools registered')
+        if self._data_type is None:
+            call_models = tuple(tool.call_model for tool in self)
+            if len(call_models) == 1:
+                call_type = call_models[0]
+            else:
+                # the tool name discriminates the union, so calls are validated against a single model
+                call_type = Annotated[Union[call_models], Field(discriminator='name')]
+            self._data_type = DataType(call_type)
+        return self._data_type
+
+    def system_prompt(self, system_prompt: Optional[str] = None) -> str:
+        """Returns a system prompt that describes the available tools."""
+        if self._description is None:
+            self._description = (
+                'You can call one of the following tools:\n'
+                + json.dumps(self.schemas, ensure_ascii=False)
+                + '\nRespond with a json object with the name of the tool and its arguments.'
+            )
+        return self._description if system_prompt is None else f'{system_prompt}\n\n{self._description}'
+
+    def parse(self, text: str, *, strict: bool = False) -> BaseModel:
+        """Parses and validates a generated tool call."""
+        return self.data_type.parse_json(text, strict=strict)
+
+    def dispatch(self, call: BaseModel) -> Any:
+        """Calls the tool with the arguments of a parsed tool call."""
+        return self.tools[call.name](call.arguments)
@@ -0,0 +1,183 @@
+from pathlib import Path
+from typing import Optional
+from weakref import WeakKeyDictionary
+
+import numpy as np
+
+from ai_den.utils.paths import PathLike
+from ai_den.utils.files import atomic_save
+from ai_den.utils.arrays import lengths_to_offsets
+from ai_den.llama_cpp.tokenizer import ENCODING, TOKENIZER_CACHE_DIR, LlamaCppTokenizer
+
+
+class VocabTrie:
+    """Byte-level trie over the decoded pieces of a vocabulary, stored in flat arrays."""
+
+    def __init__(
+            self,
+            edge_offsets: np.ndarray,
+            edge_labels: np.ndarray,
+            edge_targets: np.ndarray,
+            subtree_end: np.ndarray,
+            token_offsets: np.ndarray,
+            token_ids: np.ndarray,
+    ):
+        # nodes are numbered in preorder, so the subtree of node n spans nodes n to subtree_end[n] - 1
+        # and its tokens are contiguous in token_ids; edges of node n are sorted by byte label
+        self.edge_offsets = edge_offsets
+        self.edge_labels = edge_labels
+        self.edge_targets = edge_targets
+        self.subtree_end = subtree_end
+        self.token_offsets = token_offsets
+        self.token_ids = token_ids
+        # python copies of the arrays used while walking the trie
+        self._edge_offsets = edge_offsets.tolist()
+        self._edge_labels = edge_labels.tobytes()
+        self._edge_targets = edge_targets.tolist()
+        self._subtree_end = subtree_end.tolist()
+        self._token_offsets = token_offsets.tolist()
+
+    @classmethod
+    def from_pieces(cls, pieces: list[bytes]) -> 'VocabTrie':
+        """Builds a trie from the pieces of a vocabulary, skipping empty pieces."""
+        order = sorted((piece, token_id) for token_id, piece in enumerate(pieces) if piece)
+        children: list[list[tuple[int, int]]] = [[]]
+        subtree_end = [0]
+        token_counts = [0]
+        # path of nodes from the root to the last inserted piece
+        stack, previous = [0], b''
+        for piece, _ in order:
+            # keep the common prefix with the previous piece and close the rest of its path
+            lcp = 0
+            for a, b in zip(previous, piece):
+                if a != b:
+                    break
+                lcp += 1
+            while len(stack) > lcp + 1:
+                subtree_end[stack.pop()] = len(children)
+            # add nodes for the remaining bytes; since pieces are sorted they get preorder numbers
+            for byte in piece[lcp:]:
+                node = len(children)
+                children[stack[-1]].append((byte, node))
+                children.append([])
+                subtree_end.append(0)
+                token_counts.append(0)
+                stack.append(node)
+            token_counts[stack[-1]] += 1
+            previous = piece
+        while stack:
+            subtree_end[stack.pop()] = len(children)
+        return cls(
+            edge_offsets=lengths_to_offsets(map(len, children)),
+            edge_labels=np.array([byte for c in children for byte, _ in c], dtype=np.uint8),
+            edge_targets=np.array([node for c in children for _, node in c], dtype=np.int64),
+            subtree_end=np.array(subtree_end, dtype=np.int64),
+            token_offsets=lengths_to_offsets(token_counts),
+            token_ids=np.array([token_id for _, token_id in order], dtype=np.intc),
+        )
+
+    @classmethod
+    def from_tokenizer(
+            cls,
+            tokenizer: LlamaCppTokenizer,
+            cache_dir: Optional[PathLike] = TOKENIZER_CACHE_DIR,
+    ) -> 'VocabTrie':
+        if cache_dir is None:
+            return cls.from_pieces(tokenizer.token_bytes_skip_special)
+        path = Path(cache_dir) / f'{tokenizer.vocab_fingerprint()}.trie.npz'
+        if path.exists():
+            return cls.load(path)
+        trie = cls.from_pieces(tokenizer.token_bytes_skip_special)
+        trie.save(path)
+        return trie
+
+    @classmethod
+    def load(cls, path: PathLike) -> 'VocabTrie':
+        with np.load(path) as data:
+            return cls(**{name: data[name] for name in data.files})
+
+    def save(self, path: PathLike):
+        atomic_save(path, lambda tmp_path: np.savez(
+            tmp_path,
+            edge_offsets=self.edge_offsets,
+            edge_labels=self.edge_labels,
+            edge_targets=self.edge_targets,
+            subtree_end=self.subtree_end,
+            token_offsets=self.token_offsets,
+            token_ids=self.token_ids,
+        ))
+
+    def __len__(self) -> int:
+        return len(self.subtree_end)
+
+    def child(self, node: int, byte: int) -> int:
+        """Returns the child of node along the given byte, or -1."""
+        lo, hi = self._edge_offsets[node], self._edge_offsets[node + 1]
+        i = self._edge_labels.find(byte, lo, hi)
+        return -1 if i < 0 else self._edge_targets[i]
+
+    def find(self, s: str | bytes) -> int:
+        """Returns the node reached by s, or -1 if no token starts with s."""
+        node = 0
+        for byte in to_bytes(s):
+            node = self.child(node, byte)
+            if node < 0:
+                break
+        return node
+
+    def exact(self, s: str | bytes) -> np.ndarray:
+        """Returns the ids of the tokens that decode exactly to s."""
+        node = self.find(s)
+        if node < 0:
+            return self.token_ids[:0]
+        return self.token_ids[self._token_offsets[node]:self._token_offsets[node + 1]]
+
+    def with_prefix(self, s: str | bytes) -> np.ndarray:
+        """Returns the ids of the tokens that start with s."""
+        node = self.find(s)
+        if node < 0:
+            return self.token_ids[:0]
+        return self.token_ids[self._token_offsets[node]:self._token_offsets[self._subtree_end[node]]]
+
+    def prefixes_of(self, s: str | bytes, *, proper: bool = False) -> np.ndarray:
+        """Returns the ids of the tokens that are prefixes of s."""
+        s = to_bytes(s)
+        ranges = self._prefix_ranges(s, 0, len(s) - 1 if proper else len(s))
+        return np.concatenate(ranges) if ranges else self.token_ids[:0]
+
+    def _prefix_ranges(self, s: bytes, start: int, stop: int) -> list[np.ndarray]:
+        # walk s[start:stop] from the root, collecting the tokens of every node on the way
+        ranges = []
+        node = 0
+        for i in range(start, stop):
+            node = self.child(node, s[i])
+            if node < 0:
+                break
+            lo, hi = self._token_offsets[node], self._token_offsets[node + 1]
+            if lo < hi:
+                ranges.append(self.token_ids[lo:hi])
+        return ranges
+
+    def continuations(self, s: str | bytes) -> np.ndarray:
+        """Returns the ids of the tokens that are a prefix of s, or that start with s."""
+        return np.concatenate([self.prefixes_of(s, proper=True), self.with_prefix(s)])
+
+    def substrings_of(self, s: str | bytes) -> np.ndarray:
+        """Returns the ids of the tokens that occur somewhere in s."""
+        s = to_bytes(s)
+        ranges = [r for i in range(len(s)) for r in self._prefix_ranges(s, i, len(s))]
+        return np.unique(np.concatenate(ranges)) if ranges else self.token_ids[:0]
+
+
+_vocab_tries: WeakKeyDictionary[LlamaCppTokenizer, VocabTrie] = WeakKeyDictionary()
+
+
+def get_vocab_trie(tokenizer: LlamaCppTokenizer) -> VocabTrie:
+    if (trie := _vocab_tries.get(tokenizer)) is None:
+        trie = VocabTrie.from_tokenizer(tokenizer)
+        _vocab_tries[tokenizer] = trie
+    return trie
+
+
+def to_bytes(s: str | bytes) -> bytes:
+    return s.encode(ENCODING) if isinstance(s, str) else s
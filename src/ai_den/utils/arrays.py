@@ -0,0 +1,12 @@
+from collections.abc import Iterable
+
+import numpy as np
+import numpy.typing as npt
+
+
+def lengths_to_offsets(lengths: Iterable[int] | npt.NDArray[np.integer]) -> np.ndarray:
+    """Returns the offsets of items packed one after the other, with offsets[i]:offsets[i+1] spanning item i."""
+    lengths = np.fromiter(lengths, dtype=np.int64) if not isinstance(lengths, np.ndarray) else lengths
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return offsets
@@ -1,9 +1,22 @@
+import re
 import json
+import types
+import typing
+import operator
+import itertools
 import dataclasses
-from typing import Any, Optional, TypeVar, overload
-from collections.abc import Sequence, Mapping
+from concurrent.futures import ProcessPoolExecutor
+from json.encoder import encode_basestring, encode_basestring_ascii
+from functools import cache, partial
+from typing import Any, Optional, TextIO, TypeVar, get_args, get_origin, get_type_hints, overload
+from collections.abc import Callable, Collection, Iterable, Iterator, Sequence, Mapping
 
 import dacite
+from dacite.types import is_instance
+from pydantic import BaseModel
+
+from ai_den.utils.paths import PathLike
+from ai_den.utils.files import open_text
 
 
 T = TypeVar('T')
@@ -42,11 +55,203 @@ def from_data(data_class, data, *, check_types: bool = False):
         return [
             obj
             for datum in data
-            if (obj := from_data(data_class, datum))
+            if (obj := from_data(data_class, datum, check_types=check_types))
         ]
 
     if data:
-        return dacite.from_dict(data_class, data, dacite.Config(check_types=check_types))
+        return get_converter(data_class, check_types)(data)
+
+
+Converter = Callable[[Any], Any]
+
+
+@cache
+def get_converter(data_class: type[T], check_types: bool = False) -> Callable[[Mapping[str, Any]], T]:
+    """Returns a function that builds data_class from a mapping, like dacite.from_dict, with the type hints inspected once."""
+    try:
+        hints = get_type_hints(data_class)
+    except NameError as error:
+        raise dacite.ForwardReferenceError(str(error)) from None
+    fields = []
+    for field in dataclasses.fields(data_class):
+        field_type = hints[field.name]
+        default = field.default
+        if default is dataclasses.MISSING and field.default_factory is dataclasses.MISSING and is_optional(field_type):
+            # like dacite, optional fields default to None
+            default = None
+        fields.append((
+            field.name,
+            field_type,
+            field.init,
+            make_converter(field_type, check_types),
+            make_type_check(field_type) if check_types else None,
+            default,
+            field.default_factory,
+        ))
+    frozen = data_class.__dataclass_params__.frozen
+
+    def convert(data: Mapping[str, Any]) -> T:
+        init_values = {}
+        post_init_values = {}
+        for name, field_type, init, converter, type_check, default, default_factory in fields:
+            if name in data:
+                value = data[name]
+                if converter is not None:
+                    try:
+                        value = converter(value)
+                    except dacite.DaciteFieldError as error:
+                        error.update_path(name)
+                        raise
+                if type_check is not None and not type_check(value):
+                    raise dacite.WrongTypeError(field_path=name, field_type=field_type, value=value)
+            elif default is not dataclasses.MISSING:
+                value = default
+            elif default_factory is not dataclasses.MISSING:
+                value = default_factory()
+            elif not init:
+                continue
+            else:
+                raise dacite.MissingValueError(name)
+            if init:
+                init_values[name] = value
+            elif not frozen:
+                post_init_values[name] = value
+        obj = data_class(**init_values)
+        for name, value in post_init_values.items():
+            setattr(obj, name, value)
+        return obj
+
+    return convert
+
+
+def make_converter(type_: Any, check_types: bool) -> Optional[Converter]:
+    """Returns a function that builds values of the given type, or None if values are used as they are."""
+    origin = get_origin(type_)
+    args = get_args(type_)
+    if is_dataclass_type(type_):
+        # nested converters are looked up when called, so recursive dataclasses are supported
+        return partial(convert_dataclass, type_, check_types)
+    if origin is typing.Union or origin is types.UnionType:
+        non_none = [t for t in args if t is not type(None)]
+        if len(non_none) == 1:
+            if (converter := make_converter(non_none[0], check_types)) is None:
+                return None
+            return partial(convert_optional, converter)
+        converters = [(make_converter(t, check_types), make_type_check(t)) for t in args]
+        if not check_types and all(converter is None for converter, _ in converters):
+            # every outcome of matching the union would return the data unchanged
+            return None
+        return partial(convert_union, type_, converters, check_types)
+    if not isinstance(origin, type) or not args:
+        return None
+    if issubclass(origin, Mapping):
+        if (converter := make_converter(args[-1], check_types)) is None:
+            return None
+        return partial(convert_mapping, converter)
+    if issubclass(origin, tuple):
+        if len(args) == 2 and args[1] is Ellipsis:
+            if (converter := make_converter(args[0], check_types)) is None:
+                return partial(convert_tuple, None)
+            return partial(convert_collection, converter, tuple)
+        # json has no tuples, so fixed-length tuples are always built
+        return partial(convert_tuple, [make_converter(t, check_types) for t in args])
+    if issubclass(origin, Collection) and not issubclass(origin, str):
+        if (converter := make_converter(args[0], check_types)) is None:
+            return None
+        return partial(convert_collection, converter, None)
+    return None
+
+
+def make_type_check(type_: Any) -> Optional[Callable[[Any], bool]]:
+    """Returns a function that checks values of the given type like dacite, or None if any value is valid."""
+    origin = get_origin(type_)
+    args = get_args(type_)
+    if type_ is Any:
+        return None
+    if type_ in (float, complex):
+        # numeric tower from PEP 484
+        return lambda value: isinstance(value, (int, float, type_))
+    if origin is None and isinstance(type_, type):
+        # nested dataclasses were already checked when they were built
+        return lambda value: isinstance(value, type_)
+    if origin is typing.Union or origin is types.UnionType:
+        checks = [make_type_check(t) for t in args]
+        if any(check is None for check in checks):
+            return None
+        return lambda value: any(check(value) for check in checks)
+    if origin is typing.Literal:
+        return lambda value: value in args
+    if isinstance(origin, type) and issubclass(origin, Mapping) and len(args) == 2:
+        key_check = make_type_check(args[0]) or (lambda key: True)
+        value_check = make_type_check(args[1]) or (lambda value: True)
+        return lambda value: isinstance(value, origin) and all(key_check(k) and value_check(v) for k, v in value.items())
+    if isinstance(origin, type) and issubclass(origin, Collection) and not issubclass(origin, tuple) and len(args) == 1:
+        if (item_check := make_type_check(args[0])) is None:
+            return lambda value: isinstance(value, origin)
+        return lambda value: isinstance(value, origin) and all(map(item_check, value))
+    return partial(is_instance, type_=type_)
+
+
+def convert_dataclass(data_class: type, check_types: bool, data: Any) -> Any:
+    if isinstance(data, Mapping):
+        return get_converter(data_class, check_types)(data)
+    return data
+
+
+def convert_optional(converter: Converter, data: Any) -> Any:
+    return None if data is None else converter(data)
+
+
+def convert_union(
+        union: Any,
+        converters: list[tuple[Optional[Converter], Optional[Callable[[Any], bool]]]],
+        check_types: bool,
+        data: Any,
+) -> Any:
+    if data is None and type(None) in get_args(union):
+        return None
+    # like dacite, use the first member type that builds a value of that type
+    for converter, type_check in converters:
+        try:
+            value = data if converter is None else converter(data)
+        except Exception:
+            continue
+        if type_check is None or type_check(value):
+            return value
+    if not check_types:
+        return data
+    raise dacite.UnionMatchError(field_type=union, value=data)
+
+
+def convert_mapping(converter: Converter, data: Any) -> Any:
+    if not isinstance(data, Mapping):
+        return data
+    return type(data)((key, converter(value)) for key, value in data.items())
+
+
+def convert_collection(converter: Converter, collection_type: Optional[type], data: Any) -> Any:
+    if isinstance(data, Mapping) or isinstance(data, str) or not isinstance(data, Collection):
+        return data
+    if collection_type is None:
+        collection_type = type(data)
+    if collection_type is list:
+        return [converter(item) for item in data]
+    return collection_type(converter(item) for item in data)
+
+
+def convert_tuple(converters: Optional[list[Optional[Converter]]], data: Any) -> Any:
+    if isinstance(data, Mapping) or isinstance(data, str) or not isinstance(data, Collection):
+        return data
+    if converters is None:
+        return tuple(data)
+    return tuple(
+        item if converter is None else converter(item)
+        for item, converter in zip(data, converters)
+    ) + tuple(data)[len(converters):]
+
+
+def is_optional(type_: Any) -> bool:
+    return get_origin(type_) in (typing.Union, types.UnionType) and type(None) in get_args(type_)
 
 
 def from_json(
@@ -58,6 +263,126 @@ def from_json(
     return from_data(data_class, json.loads(s), check_types=check_types)
 
 
+# number of characters read at a time by read_json
+READ_CHUNK_SIZE = 1 << 20
+
+# characters that can continue a number up to the end of the buffer
+NUMBER_TAIL = re.compile(r'[0-9.eE+-]+\Z')
+
+
+def read_json(
+        data_class: type[T],
+        f: PathLike | TextIO,
+        *,
+        lines: Optional[bool] = None,
+        check_types: bool = False,
+        num_proc: Optional[int] = None,
+        batch_size: int = 1024,
+        chunk_size: int = READ_CHUNK_SIZE,
+) -> Iterator[T]:
+    """Lazily reads objects from a file of JSON lines or with a top-level JSON array."""
+    if not hasattr(f, 'read'):
+        with open_text(f, encoding='utf-8', errors='strict') as f:
+            yield from read_json(
+                data_class, f,
+                lines=lines,
+                check_types=check_types,
+                num_proc=num_proc,
+                batch_size=batch_size,
+                chunk_size=chunk_size,
+            )
+        return
+    head = f.read(chunk_size)
+    if lines is None:
+        lines = not head.lstrip().startswith('[')
+    if not lines:
+        records = iter_json_array(f, head, chunk_size)
+        convert = get_converter(data_class, check_types)
+        yield from (convert(record) for record in records if record)
+        return
+    # complete the first line and read the rest of the file line by line; like file iteration,
+    # split on \n only, since str.splitlines also splits on characters that json strings may hold
+    head_lines = (head + f.readline()).split('\n')
+    all_lines = itertools.chain(head_lines, f)
+    if num_proc is None:
+        yield from parse_json_lines(data_class, check_types, all_lines)
+        return
+    batches = iter(lambda: list(itertools.islice(all_lines, batch_size)), [])
+    with ProcessPoolExecutor(num_proc) as executor:
+        futures = []
+        for batch in batches:
+            futures.append(executor.submit(parse_json_lines_batch, data_class, check_types, batch))
+            # bound the number of pending batches so that memory stays flat
+            if len(futures) >= 2 * num_proc:
+                yield from futures.pop(0).result()
+        for future in futures:
+            yield from future.result()
+
+
+def parse_json_lines(data_class: type[T], check_types: bool, lines: Iterable[str]) -> Iterator[T]:
+    convert = get_converter(data_class, check_types)
+    for line in lines:
+        if line.strip() and (record := json.loads(line)):
+            yield convert(record)
+
+
+def parse_json_lines_batch(data_class: type[T], check_types: bool, lines: list[str]) -> list[T]:
+    return list(parse_json_lines(data_class, check_types, lines))
+
+
+def iter_json_array(f: TextIO, head: str = '', chunk_size: int = READ_CHUNK_SIZE) -> Iterator[Any]:
+    """Yields the elements of the JSON array at the start of a file, decoding one element at a time."""
+    decoder = json.JSONDecoder()
+    buffer, pos, eof = head, 0, False
+    whitespace = ' \t\n\r'
+
+    def skip(chars: str) -> bool:
+        # advances over the given characters, reading more text as needed; false at the end of the file
+        nonlocal buffer, pos, eof
+        while True:
+            while pos < len(buffer) and buffer[pos] in chars:
+                pos += 1
+            if pos < len(buffer) or eof:
+                return pos < len(buffer)
+            buffer, pos = f.read(chunk_size), 0
+            eof = not buffer
+
+    if not skip(whitespace) or buffer[pos] != '[':
+        raise json.JSONDecodeError('Expecting a JSON array', buffer, pos)
+    pos += 1
+    first = True
+    while True:
+        if not skip(whitespace):
+            raise json.JSONDecodeError('Unterminated array', buffer, pos)
+        if buffer[pos] == ']':
+            return
+        if not first:
+            if buffer[pos] != ',':
+                raise json.JSONDecodeError("Expecting ',' delimiter", buffer, pos)
+            pos += 1
+            if not skip(whitespace):
+                raise json.JSONDecodeError('Unterminated array', buffer, pos)
+        first = False
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                end = None
+            # a value that reaches the end of the buffer may continue in the next chunk, and a number
+            # may also be followed by a truncated fraction or exponent (e.g., 1. or 1e)
+            if end is not None and (eof or end < len(buffer) and not (
+                    isinstance(value, (int, float)) and NUMBER_TAIL.match(buffer, end))):
+                break
+            # read at least as much as is buffered, so that large values are retried a few times only
+            more = f.read(max(chunk_size, len(buffer) - pos))
+            eof = not more
+            buffer, pos = buffer[pos:] + more, 0
+        pos = end
+        yield value
+
+
 def to_json(
         obj: Any,
         *,
@@ -67,6 +392,10 @@ def to_json(
         separators: Optional[tuple[str, str]] = None,
         sort_keys: bool = False,
 ) -> str:
+    if indent is None:
+        # serialize directly from the objects, without copying them into dicts first
+        encoder = get_json_encoder(ensure_ascii, allow_nan, separators, sort_keys)
+        return encoder.encode(list(obj) if isinstance(obj, Sequence) else obj)
     if isinstance(obj, Sequence):
         obj = [dataclasses.asdict(x) for x in obj]
     else:
@@ -79,3 +408,188 @@ def to_json(
         separators=separators,
         sort_keys=sort_keys,
     )
+
+
+# number of characters buffered by the streaming writers before writing them out
+WRITE_CHUNK_SIZE = 1 << 16
+
+
+def write_json(
+        objs: Iterable[Any],
+        f: PathLike | TextIO,
+        *,
+        lines: bool = True,
+        ensure_ascii: bool = False,
+        allow_nan: bool = True,
+        separators: Optional[tuple[str, str]] = None,
+        sort_keys: bool = False,
+        chunk_size: int = WRITE_CHUNK_SIZE,
+):
+    """Writes objects to a file as JSON lines, or as a JSON array if lines is false."""
+    if not hasattr(f, 'write'):
+        with open(f, 'w', encoding='utf-8') as f:
+            return write_json(
+                objs, f,
+                lines=lines,
+                ensure_ascii=ensure_ascii,
+                allow_nan=allow_nan,
+                separators=separators,
+                sort_keys=sort_keys,
+                chunk_size=chunk_size,
+            )
+    for chunk in encode_json(
+        objs,
+        lines=lines,
+        ensure_ascii=ensure_ascii,
+        allow_nan=allow_nan,
+        separators=separators,
+        sort_keys=sort_keys,
+        chunk_size=chunk_size,
+    ):
+        f.write(chunk)
+
+
+def encode_json(
+        objs: Iterable[Any],
+        *,
+        lines: bool = True,
+        ensure_ascii: bool = False,
+        allow_nan: bool = True,
+        separators: Optional[tuple[str, str]] = None,
+        sort_keys: bool = False,
+        chunk_size: int = WRITE_CHUNK_SIZE,
+) -> Iterator[str]:
+    """Yields the JSON lines, or JSON array, of the objects in chunks of about chunk_size characters."""
+    encoder = get_json_encoder(ensure_ascii, allow_nan, separators, sort_keys)
+    buffer, size = [], 0
+    if lines:
+        prefix, separator, suffix = '', '\n', '\n'
+    else:
+        prefix, separator, suffix = '[', encoder.item_separator, ']'
+    empty = True
+    for obj in objs:
+        s = encoder.encode(obj)
+        buffer.append(prefix if empty else separator)
+        buffer.append(s)
+        size += len(s)
+        empty = False
+        if size >= chunk_size:
+            yield ''.join(buffer)
+            buffer, size = [], 0
+    if empty and lines:
+        return
+    buffer.append(prefix + suffix if empty else suffix)
+    yield ''.join(buffer)
+
+
+@cache
+def get_json_encoder(
+        ensure_ascii: bool = False,
+        allow_nan: bool = True,
+        separators: Optional[tuple[str, str]] = None,
+        sort_keys: bool = False,
+) -> 'JsonEncoder':
+    return JsonEncoder(ensure_ascii, allow_nan, separators, sort_keys)
+
+
+class JsonEncoder:
+    """Serializes dataclasses, pydantic models and JSON values to the same text as json.dumps(asdict(obj))."""
+
+    def __init__(
+            self,
+            ensure_ascii: bool = False,
+            allow_nan: bool = True,
+            separators: Optional[tuple[str, str]] = None,
+            sort_keys: bool = False,
+    ):
+        self.item_separator, self.key_separator = separators or (', ', ': ')
+        self.allow_nan = allow_nan
+        self.sort_keys = sort_keys
+        self.encode_string = encode_basestring_ascii if ensure_ascii else encode_basestring
+        self.encoders: dict[type, Callable[[Any], str]] = {
+            str: self.encode_string,
+            int: int.__repr__,
+            float: self.encode_float,
+            bool: lambda value: 'true' if value else 'false',
+            type(None): lambda value: 'null',
+            list: self.encode_list,
+            tuple: self.encode_list,
+            dict: self.encode_dict,
+        }
+
+    def encode(self, obj: Any) -> str:
+        encoder = self.encoders.get(type(obj)) or self.add_encoder(type(obj))
+        return encoder(obj)
+
+    def add_encoder(self, cls: type) -> Callable[[Any], str]:
+        if is_dataclass_type(cls):
+            names = [field.name for field in dataclasses.fields(cls)]
+        elif issubclass(cls, BaseModel):
+            names = list(cls.model_fields)
+        else:
+            # subclasses of json types are serialized like json.dumps does
+            for base in (str, bool, int, float, list, tuple, dict):
+                if issubclass(cls, base):
+                    encoder = self.encoders[base]
+                    break
+            else:
+                raise TypeError(f'Object of type {cls.__name__} is not JSON serializable')
+            self.encoders[cls] = encoder
+            return encoder
+        if self.sort_keys:
+            names.sort()
+        prefixes = [
+            ('{' if i == 0 else self.item_separator) + self.encode_string(name) + self.key_separator
+            for i, name in enumerate(names)
+        ]
+        getter = operator.attrgetter(*names) if len(names) > 1 else None
+        encoders = self.encoders
+        encode = self.encode
+
+        def encode_object(obj: Any) -> str:
+            if getter is None:
+                if not names:
+                    return '{}'
+                values = (getattr(obj, names[0]),)
+            else:
+                values = getter(obj)
+            parts = []
+            for prefix, value in zip(prefixes, values):
+                parts.append(prefix)
+                encoder = encoders.get(type(value))
+                parts.append(encoder(value) if encoder is not None else encode(value))
+            parts.append('}')
+            return ''.join(parts)
+
+        self.encoders[cls] = encode_object
+        return encode_object
+
+    def encode_float(self, value: float) -> str:
+        if value != value or value in (float('inf'), float('-inf')):
+            if not self.allow_nan:
+                raise ValueError(f'Out of range float values are not JSON compliant: {value!r}')
+            return 'NaN' if value != value else 'Infinity' if value > 0 else '-Infinity'
+        return float.__repr__(value)
+
+    def encode_list(self, values: Sequence[Any]) -> str:
+        if not values:
+            return '[]'
+        return '[' + self.item_separator.join(map(self.encode, values)) + ']'
+
+    def encode_dict(self, d: Mapping[Any, Any]) -> str:
+        if not d:
+            return '{}'
+        items = sorted(d.items()) if self.sort_keys else d.items()
+        return '{' + self.item_separator.join(
+            self.encode_key(key) + self.key_separator + self.encode(value)
+            for key, value in items
+        ) + '}'
+
+    def encode_key(self, key: Any) -> str:
+        if isinstance(key, str):
+            return self.encode_string(key)
+        if isinstance(key, bool) or key is None:
+            return '"' + json.dumps(key) + '"'
+        if isinstance(key, (int, float)):
+            return '"' + self.encode(key) + '"'
+        raise TypeError(f'keys must be str, int, float, bool or None, not {type(key).__name__}')
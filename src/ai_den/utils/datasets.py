@@ -1,14 +1,33 @@
 import re
+import json
+import types
+import hashlib
+import warnings
+import functools
 from pathlib import Path
-from typing import Optional
-from collections.abc import Callable
-from natsort import natsorted
+from typing import Any, Optional, TextIO
+from collections.abc import Callable, Iterable, Iterator
 from datasets import Dataset
+from datasets.fingerprint import Hasher, generate_random_fingerprint
 from ai_den.utils.paths import PathLike
+from ai_den.utils.files import ArchiveMember, OpenArchives, Source, list_sources, open_binary, open_text, source_name
+
+
+# approximate number of characters read at a time by the streaming readers
+CHUNK_SIZE = 1 << 20
+
+# characters that make a separator a regular expression instead of a plain string
+REGEX_METACHARACTERS = '.^$*+?{}[]\\|()'
+
+# bump when a change to the parser changes its output, to invalidate cached datasets
+CONLL_PARSER_VERSION = 1
+
+# unbound methods of builtin types, e.g., str.lower, identified by their qualified name
+DESCRIPTOR_TYPES = (types.MethodDescriptorType, types.WrapperDescriptorType, types.ClassMethodDescriptorType)
 
 
 def read_conll_file(
-        path: PathLike,
+        path: Source,
         columns: dict[str, int],
         comment_symbol: Optional[str] = '#',
         field_separator: str = '\t',
@@ -19,22 +38,26 @@ def read_conll_file(
         preprocess_text: Optional[Callable[[str], str]] = None,
         encoding: Optional[str] = 'utf-8',
         errors: Optional[str] = 'replace',
+        content_hash: bool = False,
+        cache_key: Optional[str] = None,
 ):
+    gen_kwargs = dict(
+        path=path,
+        columns=columns,
+        comment_symbol=comment_symbol,
+        field_separator=field_separator,
+        sequence_separator=sequence_separator,
+        document_separator=document_separator,
+        document_separator_field=document_separator_field,
+        filename_field=filename_field,
+        preprocess_text=preprocess_text,
+        encoding=encoding,
+        errors=errors,
+    )
     return Dataset.from_generator(
         generator=gen_conll_file,
-        gen_kwargs=dict(
-            path=path,
-            columns=columns,
-            comment_symbol=comment_symbol,
-            field_separator=field_separator,
-            sequence_separator=sequence_separator,
-            document_separator=document_separator,
-            document_separator_field=document_separator_field,
-            filename_field=filename_field,
-            preprocess_text=preprocess_text,
-            encoding=encoding,
-            errors=errors,
-        ),
+        gen_kwargs=gen_kwargs,
+        fingerprint=fingerprint_conll_files([path], gen_kwargs, content_hash, cache_key),
     )
 
 
@@ -51,23 +74,29 @@ def read_conll_directory(
         preprocess_text: Optional[Callable[[str], str]] = None,
         encoding: Optional[str] = 'utf-8',
         errors: Optional[str] = 'replace',
+        num_proc: Optional[int] = None,
+        content_hash: bool = False,
+        cache_key: Optional[str] = None,
 ):
+    gen_kwargs = dict(
+        paths=list_sources(path, glob),
+        columns=columns,
+        comment_symbol=comment_symbol,
+        field_separator=field_separator,
+        sequence_separator=sequence_separator,
+        document_separator=document_separator,
+        document_separator_field=document_separator_field,
+        filename_field=filename_field,
+        preprocess_text=preprocess_text,
+        encoding=encoding,
+        errors=errors,
+    )
+    # the file list is sharded across processes, and the shards are concatenated in order
     return Dataset.from_generator(
-        generator=gen_conll_directory,
-        gen_kwargs=dict(
-            path=path,
-            columns=columns,
-            glob=glob,
-            comment_symbol=comment_symbol,
-            field_separator=field_separator,
-            sequence_separator=sequence_separator,
-            document_separator=document_separator,
-            document_separator_field=document_separator_field,
-            filename_field=filename_field,
-            preprocess_text=preprocess_text,
-            encoding=encoding,
-            errors=errors,
-        ),
+        generator=gen_conll_files,
+        gen_kwargs=gen_kwargs,
+        num_proc=num_proc,
+        fingerprint=fingerprint_conll_files(gen_kwargs['paths'], gen_kwargs, content_hash, cache_key),
     )
 
 
@@ -85,11 +114,39 @@ def gen_conll_directory(
         encoding: Optional[str] = 'utf-8',
         errors: Optional[str] = 'replace',
 ):
-    path = Path(path)
-    for f in natsorted(path.glob(glob)):
-        if f.is_file():
+    yield from gen_conll_files(
+        paths=list_sources(path, glob),
+        columns=columns,
+        comment_symbol=comment_symbol,
+        field_separator=field_separator,
+        sequence_separator=sequence_separator,
+        document_separator=document_separator,
+        document_separator_field=document_separator_field,
+        filename_field=filename_field,
+        preprocess_text=preprocess_text,
+        encoding=encoding,
+        errors=errors,
+    )
+
+
+def gen_conll_files(
+        paths: list[Source],
+        columns: dict[str, int],
+        comment_symbol: Optional[str] = '#',
+        field_separator: str = '\t',
+        sequence_separator: str = '\n\\s*\n',
+        document_separator: Optional[str] = None,
+        document_separator_field: str = 'text',
+        filename_field: Optional[str] = None,
+        preprocess_text: Optional[Callable[[str], str]] = None,
+        encoding: Optional[str] = 'utf-8',
+        errors: Optional[str] = 'replace',
+):
+    # archives stay open while their members are read, and are closed when the pass ends
+    with OpenArchives() as archives:
+        for path in paths:
             yield from gen_conll_file(
-                path=f,
+                path=path,
                 columns=columns,
                 comment_symbol=comment_symbol,
                 field_separator=field_separator,
@@ -100,11 +157,12 @@ def gen_conll_directory(
                 preprocess_text=preprocess_text,
                 encoding=encoding,
                 errors=errors,
+                archives=archives,
             )
 
 
 def gen_conll_file(
-        path: PathLike,
+        path: Source,
         columns: dict[str, int],
         comment_symbol: Optional[str] = '#',
         field_separator: str = '\t',
@@ -115,24 +173,194 @@ def gen_conll_file(
         preprocess_text: Optional[Callable[[str], str]] = None,
         encoding: Optional[str] = 'utf-8',
         errors: Optional[str] = 'replace',
+        archives: Optional[OpenArchives] = None,
 ):
-    path = Path(path)
-    text = path.read_text(encoding, errors)
-    if preprocess_text is not None:
-        text = preprocess_text(text)
-    text = text.strip()
-    for entry in re.split(sequence_separator, text):
-        fields = dict()
-        if filename_field is not None:
-            fields[filename_field] = path.name
-        for line in entry.splitlines():
-            if comment_symbol is not None and line.startswith(comment_symbol):
+    split_line = make_splitter(field_separator)
+    # compressed files and archive members are decompressed while they are parsed
+    with open_text(path, encoding=encoding, errors=errors, archives=archives) as f:
+        chunks = read_chunks(f)
+        if preprocess_text is not None:
+            # preprocessing is applied to blocks of complete lines
+            chunks = map(preprocess_text, chunks)
+        for entry in split_stream(chunks, sequence_separator):
+            rows = [
+                split_line(line)
+                for line in entry.splitlines()
+                if comment_symbol is None or not line.startswith(comment_symbol)
+            ]
+            # skip entries made only of comments
+            if not rows:
                 continue
-            line_entries = re.split(field_separator, line)
+            fields = dict()
+            if filename_field is not None:
+                fields[filename_field] = source_name(path)
+            # accumulate each column with a single pass over the rows
             for name, i in columns.items():
-                if name not in fields:
-                    fields[name] = []
-                fields[name].append(line_entries[i])
-        if any(entry == document_separator for entry in fields[document_separator_field]):
+                fields[name] = [row[i] for row in rows]
+            if document_separator is not None and document_separator in fields[document_separator_field]:
+                continue
+            yield fields
+
+
+def make_splitter(separator: str) -> Callable[[str], list[str]]:
+    """Returns a function that splits a line on the separator regular expression."""
+    # plain strings are split with str.split, which is much faster than re.split
+    if not any(c in separator for c in REGEX_METACHARACTERS):
+        return lambda line: line.split(separator)
+    return re.compile(separator).split
+
+
+def fingerprint_conll_files(
+        paths: list[Source],
+        params: dict[str, Any],
+        content_hash: bool = False,
+        cache_key: Optional[str] = None,
+) -> str:
+    """Returns a cache fingerprint for parsing the given files with the given parameters."""
+    h = hashlib.sha256()
+    h.update(f'conll-v{CONLL_PARSER_VERSION}'.encode())
+    for name, value in sorted(params.items()):
+        if name in ('path', 'paths'):
             continue
-        yield fields
+        if callable(value):
+            # callables that can't be fingerprinted are identified by the caller's key
+            value = cache_key if cache_key is not None else fingerprint_callable(value)
+        h.update(json.dumps([name, value]).encode())
+    with OpenArchives() as archives:
+        for path in paths:
+            if content_hash:
+                h.update(hash_file(path, archives=archives).encode())
+            elif isinstance(path, ArchiveMember):
+                stat = Path(path.archive).stat()
+                h.update(f'{Path(path.archive).resolve()}:{stat.st_size}:{stat.st_mtime_ns}:{path.member}'.encode())
+            else:
+                stat = Path(path).stat()
+                h.update(f'{Path(path).resolve()}:{stat.st_size}:{stat.st_mtime_ns}'.encode())
+    return h.hexdigest()
+
+
+def fingerprint_callable(f: Callable) -> str:
+    """Returns a fingerprint of a callable that is stable across sessions if the callable can be pickled."""
+    return fingerprint_value(f, set())
+
+
+def update_fingerprint(h, value: Any, seen: set[int]):
+    # every value is tagged with its type, so that e.g. 1 and '1' or (1,) and [1] differ
+    h.update(f'<{type(value).__module__}.{type(value).__qualname__}>'.encode())
+    if value is None or value is Ellipsis or isinstance(value, (bool, int, float, complex, str, bytes)):
+        h.update(repr(value).encode())
+        return
+    # references back to a value being hashed, e.g., a recursive closure
+    if id(value) in seen:
+        h.update(b'<cycle>')
+        return
+    seen.add(id(value))
+    try:
+        if isinstance(value, (tuple, list)):
+            h.update(str(len(value)).encode())
+            for item in value:
+                update_fingerprint(h, item, seen)
+        elif isinstance(value, (set, frozenset)):
+            h.update(''.join(sorted(fingerprint_value(item, seen) for item in value)).encode())
+        elif isinstance(value, dict):
+            items = sorted((fingerprint_value(k, seen), fingerprint_value(v, seen)) for k, v in value.items())
+            h.update(repr(items).encode())
+        elif isinstance(value, re.Pattern):
+            update_fingerprint(h, (value.pattern, value.flags), seen)
+        elif isinstance(value, functools.partial):
+            update_fingerprint(h, (value.func, value.args, value.keywords), seen)
+        elif isinstance(value, types.FunctionType):
+            h.update(f'{value.__module__}.{value.__qualname__}'.encode())
+            cells = tuple(cell_contents(cell) for cell in value.__closure__ or ())
+            update_fingerprint(h, (value.__code__, value.__defaults__, value.__kwdefaults__, cells), seen)
+        elif isinstance(value, types.CodeType):
+            # names cover the globals and attributes used; nested functions are code objects in co_consts
+            h.update(value.co_code)
+            update_fingerprint(h, (value.co_consts, value.co_names, value.co_varnames, value.co_freevars), seen)
+        elif isinstance(value, types.MethodType):
+            update_fingerprint(h, (value.__func__, value.__self__), seen)
+        elif isinstance(value, types.BuiltinFunctionType):
+            h.update(f'{value.__module__}.{value.__qualname__}'.encode())
+            # builtin methods are bound to their object, e.g., the pattern of re.compile(...).sub
+            if not isinstance(value.__self__, types.ModuleType) and value.__self__ is not None:
+                update_fingerprint(h, value.__self__, seen)
+        elif isinstance(value, type):
+            h.update(f'{value.__module__}.{value.__qualname__}'.encode())
+        elif isinstance(value, DESCRIPTOR_TYPES):
+            h.update(f'{value.__objclass__.__module__}.{value.__qualname__}'.encode())
+        elif isinstance(value, types.ModuleType):
+            h.update(value.__name__.encode())
+        else:
+            # other objects, e.g., callable instances, are hashed by pickling them as datasets does
+            h.update(hash_object(value).encode())
+    finally:
+        seen.discard(id(value))
+
+
+def hash_object(value: Any) -> str:
+    try:
+        return Hasher.hash(value)
+    except Exception as e:
+        warnings.warn(
+            f'cannot fingerprint {value!r} of type {type(value).__name__} ({e}), so it gets a random fingerprint '
+            f'and its results are never reused; pass an explicit cache_key instead'
+        )
+        return generate_random_fingerprint()
+
+
+def fingerprint_value(value: Any, seen: set[int]) -> str:
+    h = hashlib.sha256()
+    update_fingerprint(h, value, seen)
+    return h.hexdigest()
+
+
+def cell_contents(cell: types.CellType) -> Any:
+    try:
+        return cell.cell_contents
+    except ValueError:
+        # the variable isn't assigned yet
+        return Ellipsis
+
+
+def hash_file(path: Source, chunk_size: int = CHUNK_SIZE, archives: Optional[OpenArchives] = None) -> str:
+    h = hashlib.sha256()
+    with open_binary(path, archives) if isinstance(path, ArchiveMember) else open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def read_chunks(f: TextIO, chunk_size: int = CHUNK_SIZE) -> Iterator[str]:
+    """Reads a text file in blocks of complete lines of about chunk_size characters."""
+    while chunk := f.read(chunk_size):
+        if not chunk.endswith('\n'):
+            chunk += f.readline()
+        yield chunk
+
+
+def split_stream(chunks: Iterable[str], separator: str) -> Iterator[str]:
+    """Splits a stream of text like re.split(separator, text.strip()), buffering only the current entry."""
+    pattern = re.compile(separator)
+    non_space = re.compile(r'\S')
+    buffer = ''
+    started = False
+    for chunk in chunks:
+        buffer += chunk
+        # drop leading whitespace of the stream
+        if not started:
+            buffer = buffer.lstrip()
+            if not buffer:
+                continue
+            started = True
+        start = 0
+        for m in pattern.finditer(buffer):
+            # a match followed only by whitespace could continue in the next chunk,
+            # or be trailing whitespace of the stream
+            if not non_space.search(buffer, m.end()):
+                break
+            yield buffer[start:m.start()]
+            start = m.end()
+        buffer = buffer[start:]
+    # drop trailing whitespace of the stream
+    if buffer := buffer.rstrip():
+        yield from pattern.split(buffer)
@@ -0,0 +1,183 @@
+from typing import Any, Optional
+from collections.abc import Iterable, Mapping
+
+import numpy as np
+
+from ai_den.utils.ner import LabelVocabulary, Spans
+from ai_den.utils.arrays import lengths_to_offsets
+
+
+# an entity is a (text, label) pair, a mapping, or an object with text and label attributes
+Entity = tuple[str, str] | Mapping[str, Any] | Any
+
+
+class SpanEvaluator:
+    """Accumulates span-level precision, recall and F1 with exact and partial matching."""
+
+    def __init__(self, entity_types: Iterable[str] = ()):
+        self.entity_types: list[str] = []
+        self.entity_type_to_id: dict[str, int] = {}
+        for entity_type in entity_types:
+            self.add_type(entity_type)
+        self.reset()
+
+    @classmethod
+    def from_vocabulary(cls, vocab: LabelVocabulary) -> 'SpanEvaluator':
+        """Returns an evaluator whose type ids agree with the spans extracted by vocab."""
+        return cls(vocab.entity_types)
+
+    def add_type(self, entity_type: str) -> int:
+        if (type_id := self.entity_type_to_id.get(entity_type)) is None:
+            type_id = len(self.entity_types)
+            self.entity_types.append(entity_type)
+            self.entity_type_to_id[entity_type] = type_id
+        return type_id
+
+    def reset(self):
+        self.counts: dict[str, np.ndarray] = {
+            name: np.zeros(0, dtype=np.int64)
+            for name in ('gold', 'pred', 'exact', 'partial_gold', 'partial_pred')
+        }
+
+    def update(self, gold: Spans, pred: Spans):
+        """Adds a batch of gold and predicted spans for the same sequences."""
+        if len(gold) != len(pred):
+            raise ValueError(f'got gold spans for {len(gold)} sequences and predictions for {len(pred)}')
+        num_types = int(max(gold.types.max(initial=-1), pred.types.max(initial=-1))) + 1
+        if num_types > len(self.entity_types):
+            raise ValueError(
+                f'span type id {num_types - 1} is out of range for {len(self.entity_types)} entity types; '
+                f'create the evaluator with SpanEvaluator.from_vocabulary'
+            )
+        scale = int(max(gold.ends.max(initial=0), pred.ends.max(initial=0))) + 1
+        # sorted unique keys, so repeated predictions of the same span are counted once
+        gold_keys = sorted_unique(span_keys(gold, num_types, scale))
+        pred_keys = sorted_unique(span_keys(pred, num_types, scale))
+        exact = np.intersect1d(gold_keys, pred_keys, assume_unique=True)
+        self.add_counts('gold', gold_keys // (scale * scale) % num_types)
+        self.add_counts('pred', pred_keys // (scale * scale) % num_types)
+        self.add_counts('exact', exact // (scale * scale) % num_types)
+        partial_gold = gold_keys[overlaps_any(gold_keys, pred_keys, scale)]
+        partial_pred = pred_keys[overlaps_any(pred_keys, gold_keys, scale)]
+        self.add_counts('partial_gold', partial_gold // (scale * scale) % num_types)
+        self.add_counts('partial_pred', partial_pred // (scale * scale) % num_types)
+
+    def update_from_entities(
+            self,
+            gold: Spans,
+            words: list[list[str]],
+            entities: list[Iterable[Entity]],
+    ):
+        """Adds a batch of predicted entities, located in the words of each sequence."""
+        self.update(gold, locate_entities(words, entities, self))
+
+    def add_counts(self, name: str, types: np.ndarray):
+        counts = np.bincount(types, minlength=len(self.entity_types))
+        total = self.counts[name]
+        if len(total) < len(counts):
+            total = np.pad(total, (0, len(counts) - len(total)))
+        total[:len(counts)] += counts
+        self.counts[name] = total
+
+    def compute(self) -> dict[str, dict[str, dict[str, float]]]:
+        """Returns the precision, recall, F1 and support of each type and overall, for each matching mode."""
+        counts = {
+            name: np.pad(c, (0, len(self.entity_types) - len(c)))
+            for name, c in self.counts.items()
+        }
+        results = dict()
+        for mode, gold_matched, pred_matched in (
+            ('exact', counts['exact'], counts['exact']),
+            ('partial', counts['partial_gold'], counts['partial_pred']),
+        ):
+            scores = {
+                entity_type: prf(gold_matched[i], pred_matched[i], counts['gold'][i], counts['pred'][i])
+                for i, entity_type in enumerate(self.entity_types)
+            }
+            scores['micro'] = prf(gold_matched.sum(), pred_matched.sum(), counts['gold'].sum(), counts['pred'].sum())
+            results[mode] = scores
+        return results
+
+
+def prf(gold_matched: int, pred_matched: int, n_gold: int, n_pred: int) -> dict[str, float]:
+    precision = pred_matched / n_pred if n_pred else 0.0
+    recall = gold_matched / n_gold if n_gold else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return dict(precision=float(precision), recall=float(recall), f1=float(f1), support=int(n_gold))
+
+
+def span_keys(spans: Spans, num_types: int, scale: int) -> np.ndarray:
+    """Packs the sequence, type, start and end of each span into a single integer."""
+    sequences = np.repeat(np.arange(len(spans), dtype=np.int64), np.diff(spans.offsets))
+    groups = sequences * num_types + spans.types
+    return (groups * scale + spans.starts) * scale + spans.ends
+
+
+def sorted_unique(keys: np.ndarray) -> np.ndarray:
+    # sorting and dropping repeats is faster than np.unique for integer keys
+    keys = np.sort(keys)
+    return keys[np.concatenate([[True], keys[1:] != keys[:-1]])] if len(keys) else keys
+
+
+def overlaps_any(queries: np.ndarray, spans: np.ndarray, scale: int) -> np.ndarray:
+    """Marks the queries that overlap some span of the same group, given sorted span keys."""
+    if not len(queries) or not len(spans):
+        return np.zeros(len(queries), dtype=bool)
+    query_groups, query_starts, query_ends = queries // (scale * scale), queries // scale % scale, queries % scale
+    span_groups, span_ends = spans // (scale * scale), spans % scale
+    # running maximum of the span ends within each group; offsetting by group makes one pass enough
+    group_offsets = span_groups * scale
+    max_ends = np.maximum.accumulate(group_offsets + span_ends) - group_offsets
+    # last span of the query's group that starts before the query ends
+    i = np.searchsorted(spans // scale, query_groups * scale + query_ends, side='left') - 1
+    valid = i >= 0
+    i = np.maximum(i, 0)
+    valid &= span_groups[i] == query_groups
+    return valid & (max_ends[i] > query_starts)
+
+
+def locate_entities(
+        words: list[list[str]],
+        entities: list[Iterable[Entity]],
+        evaluator: Optional[SpanEvaluator] = None,
+) -> Spans:
+    """Finds the word spans of predicted entities, e.g., the output of a DataType for NER."""
+    evaluator = evaluator if evaluator is not None else SpanEvaluator()
+    counts, starts, ends, types = [], [], [], []
+    for sequence_words, sequence_entities in zip(words, entities, strict=True):
+        positions: dict[str, list[int]] = {}
+        for i, word in enumerate(sequence_words):
+            positions.setdefault(word, []).append(i)
+        # each entity takes the first occurrence whose words no earlier entity took
+        taken = [False] * len(sequence_words)
+        n = 0
+        for entity in sequence_entities:
+            text, label = entity_text_and_label(entity)
+            entity_words = text.split()
+            if not entity_words:
+                continue
+            type_id = evaluator.add_type(label)
+            for start in positions.get(entity_words[0], ()):
+                end = start + len(entity_words)
+                if sequence_words[start:end] == entity_words and not any(taken[start:end]):
+                    taken[start:end] = [True] * len(entity_words)
+                    starts.append(start)
+                    ends.append(end)
+                    types.append(type_id)
+                    n += 1
+                    break
+        counts.append(n)
+    return Spans(
+        offsets=lengths_to_offsets(counts),
+        starts=np.array(starts, dtype=np.int64),
+        ends=np.array(ends, dtype=np.int64),
+        types=np.array(types, dtype=np.int32),
+    )
+
+
+def entity_text_and_label(entity: Entity) -> tuple[str, str]:
+    if isinstance(entity, tuple):
+        return entity
+    if isinstance(entity, Mapping):
+        return entity['text'], entity['label']
+    return entity.text, entity.label
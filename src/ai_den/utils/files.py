@@ -0,0 +1,192 @@
+import io
+import os
+import re
+import tempfile
+import bz2
+import gzip
+import lzma
+import tarfile
+import zipfile
+from pathlib import Path, PurePosixPath
+from contextlib import ExitStack, contextmanager
+from typing import Any, BinaryIO, NamedTuple, Optional, TextIO
+from collections.abc import Callable, Iterator
+from natsort import natsorted
+from ai_den.utils.paths import PathLike
+
+
+COMPRESSION_OPENERS = {
+    '.gz': gzip.open,
+    '.bz2': bz2.open,
+    '.xz': lzma.open,
+    '.lzma': lzma.open,
+}
+
+TAR_SUFFIXES = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+ZIP_SUFFIXES = ('.zip',)
+
+
+class ArchiveMember(NamedTuple):
+    """A file stored inside of a zip or tar archive."""
+
+    archive: str
+    member: str
+
+    @property
+    def name(self) -> str:
+        return PurePosixPath(self.member).name
+
+
+Source = PathLike | ArchiveMember
+
+
+def is_archive(path: PathLike) -> bool:
+    return is_zip_archive(path) or is_tar_archive(path)
+
+
+def is_zip_archive(path: PathLike) -> bool:
+    return str(path).lower().endswith(ZIP_SUFFIXES)
+
+
+def is_tar_archive(path: PathLike) -> bool:
+    return str(path).lower().endswith(TAR_SUFFIXES)
+
+
+def source_name(source: Source) -> str:
+    return source.name if isinstance(source, ArchiveMember) else Path(source).name
+
+
+class OpenArchives:
+    """Keeps the archives read during one pass over their members open, and closes them at the end of the pass."""
+
+    def __init__(self):
+        self.archives: dict[str, zipfile.ZipFile | tarfile.TarFile] = {}
+
+    def get(self, path: str) -> zipfile.ZipFile | tarfile.TarFile:
+        # reading many members doesn't parse the archive index each time
+        if (archive := self.archives.get(path)) is None:
+            archive = self.archives[path] = open_archive(path)
+        return archive
+
+    def close(self):
+        for archive in self.archives.values():
+            archive.close()
+        self.archives.clear()
+
+    def __enter__(self) -> 'OpenArchives':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+@contextmanager
+def open_text(
+        source: Source,
+        encoding: Optional[str] = 'utf-8',
+        errors: Optional[str] = 'replace',
+        archives: Optional[OpenArchives] = None,
+) -> Iterator[TextIO]:
+    """Opens a file for reading text, transparently decompressing it and reading it from an archive."""
+    if not isinstance(source, ArchiveMember) and Path(source).suffix.lower() not in COMPRESSION_OPENERS:
+        with open(source, encoding=encoding, errors=errors) as f:
+            yield f
+        return
+    with open_binary(source, archives) as f, io.TextIOWrapper(f, encoding=encoding, errors=errors) as text:
+        yield text
+
+
+@contextmanager
+def open_binary(source: Source, archives: Optional[OpenArchives] = None) -> Iterator[BinaryIO]:
+    if not isinstance(source, ArchiveMember):
+        opener = COMPRESSION_OPENERS.get(Path(source).suffix.lower(), open)
+        with opener(source, 'rb') as f:
+            yield f
+        return
+    with ExitStack() as stack:
+        if archives is None:
+            # a single member keeps its archive open only while it is read
+            archives = stack.enter_context(OpenArchives())
+        archive = archives.get(source.archive)
+        if isinstance(archive, zipfile.ZipFile):
+            f = stack.enter_context(archive.open(source.member))
+        else:
+            f = stack.enter_context(archive.extractfile(source.member))
+        # decompress individually compressed members
+        if opener := COMPRESSION_OPENERS.get(PurePosixPath(source.member).suffix.lower()):
+            f = stack.enter_context(opener(f))
+        yield f
+
+
+def open_archive(path: str) -> zipfile.ZipFile | tarfile.TarFile:
+    if is_zip_archive(path):
+        return zipfile.ZipFile(path)
+    return tarfile.open(path)
+
+
+def list_sources(path: PathLike, glob: str = '*') -> list[Source]:
+    """Returns the files under a directory, or the members of an archive, that match glob."""
+    if is_archive(path) and Path(path).is_file():
+        return list_archive_members(path, glob)
+    return [str(f) for f in natsorted(Path(path).glob(glob)) if f.is_file()]
+
+
+def list_archive_members(path: PathLike, glob: str = '*') -> list[ArchiveMember]:
+    """Returns the files in the archive whose path matches glob, naturally sorted for zip and in stored order for tar."""
+    path = str(path)
+    pattern = re.compile(glob_to_regex(glob))
+    if is_zip_archive(path):
+        with zipfile.ZipFile(path) as archive:
+            names = natsorted(info.filename for info in archive.infolist() if not info.is_dir())
+    else:
+        # compressed tar archives can't seek backwards without decompressing again from the start,
+        # so their members are read in the order they are stored
+        with tarfile.open(path) as archive:
+            names = [info.name for info in archive.getmembers() if info.isfile()]
+    return [ArchiveMember(path, name) for name in names if pattern.fullmatch(name)]
+
+
+def glob_to_regex(glob: str) -> str:
+    """Translates a pathlib-style glob, where ** matches any number of directories, to a regex."""
+    parts = []
+    segments = glob.strip('/').split('/')
+    for i, segment in enumerate(segments):
+        last = i == len(segments) - 1
+        if segment == '**':
+            parts.append('.*' if last else '(?:[^/]+/)*')
+            continue
+        regex = ''
+        j = 0
+        while j < len(segment):
+            c = segment[j]
+            if c == '*':
+                regex += '[^/]*'
+            elif c == '?':
+                regex += '[^/]'
+            elif c == '[' and (k := segment.find(']', j + 2)) > 0:
+                chars = segment[j+1:k]
+                if chars.startswith('!'):
+                    chars = '^' + chars[1:]
+                regex += f'[{chars}]'
+                j = k
+            else:
+                regex += re.escape(c)
+            j += 1
+        parts.append(regex if last else regex + '/')
+    return ''.join(parts)
+
+
+def atomic_save(path: PathLike, writer: Callable[[Path], Any]):
+    """Calls writer with a temporary path next to path, and moves the written file to path."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # keep the suffix, since some writers (e.g., np.savez) add it otherwise
+    with tempfile.NamedTemporaryFile(dir=path.parent, prefix=f'.{path.stem}.', suffix=f'.tmp{path.suffix}', delete=False) as f:
+        tmp_path = Path(f.name)
+    try:
+        writer(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
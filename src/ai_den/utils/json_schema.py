@@ -1,12 +1,13 @@
 import re
+import copy
 import json
 import inspect
+import functools
 import dataclasses
 from types import GenericAlias
 from typing import Any, Literal, Optional, assert_never, get_args, get_origin
 from collections.abc import Callable, Sequence
 
-import jsonref
 import docstring_parser
 from pydantic import BaseModel, TypeAdapter, create_model
 from pydantic.fields import Field
@@ -14,6 +15,27 @@ from pydantic.fields import Field
 from ai_den.utils.dataclasses import is_dataclass_type
 
 
+# maximum number of generated models and schemas kept by each cache
+SCHEMA_CACHE_SIZE = 1024
+
+
+def memoize(f: Callable) -> Callable:
+    """Caches the results of f by its arguments, calling f directly for unhashable arguments."""
+    cached = functools.lru_cache(maxsize=SCHEMA_CACHE_SIZE)(f)
+
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        try:
+            hash((args, tuple(kwargs.items())))
+        except TypeError:
+            return f(*args, **kwargs)
+        return cached(*args, **kwargs)
+
+    wrapper.cache_info = cached.cache_info
+    wrapper.cache_clear = cached.cache_clear
+    return wrapper
+
+
 def json_schema(
         obj: Any,
         *,
@@ -27,13 +49,17 @@ def json_schema(
         separators: Optional[tuple[str, str]] = None,
         sort_keys: bool = False,
 ) -> str:
-    schema = create_schema(
-        obj,
-        name=name,
-        replace_refs=replace_refs,
-        keep_titles=keep_titles,
-        flatten=flatten,
-    )
+    if isinstance(obj, Sequence) and not isinstance(obj, (type, GenericAlias)) and not callable(obj):
+        schema = create_schema(
+            obj,
+            name=name,
+            replace_refs=replace_refs,
+            keep_titles=keep_titles,
+            flatten=flatten,
+        )
+    else:
+        # the schema is only read, so there is no need to copy the cached one
+        schema = cached_schema(obj, name, replace_refs, keep_titles, flatten)
     return json.dumps(
         schema,
         ensure_ascii=ensure_ascii,
@@ -52,22 +78,9 @@ def create_schema(
         keep_titles: bool = False,
         flatten: bool = True,
 ) -> dict[str, Any]:
-    if isinstance(obj, type) or isinstance(obj, GenericAlias):
-        return create_schema_for_type(
-            obj,
-            replace_refs=replace_refs,
-            keep_titles=keep_titles,
-            flatten=flatten,
-        )
-
-    if callable(obj):
-        return create_schema_for_callable(
-            obj,
-            name=name,
-            replace_refs=replace_refs,
-            keep_titles=keep_titles,
-            flatten=flatten,
-        )
+    if isinstance(obj, type) or isinstance(obj, GenericAlias) or callable(obj):
+        # schemas are cached, so callers get their own copy to modify
+        return copy.deepcopy(cached_schema(obj, name, replace_refs, keep_titles, flatten))
 
     if isinstance(obj, Sequence):
         return [
@@ -84,6 +97,47 @@ def create_schema(
     raise ValueError(f'Unsupported: {obj!r}')
 
 
+@memoize
+def cached_schema(
+        obj: Any,
+        name: Optional[str],
+        replace_refs: bool,
+        keep_titles: bool,
+        flatten: bool,
+) -> dict[str, Any]:
+    if isinstance(obj, type) or isinstance(obj, GenericAlias):
+        return create_schema_for_type(
+            obj,
+            replace_refs=replace_refs,
+            keep_titles=keep_titles,
+            flatten=flatten,
+        )
+
+    return create_schema_for_callable(
+        obj,
+        name=name,
+        replace_refs=replace_refs,
+        keep_titles=keep_titles,
+        flatten=flatten,
+    )
+
+
+def schema_cache_info() -> dict[str, Any]:
+    """Returns the hits, misses and sizes of the schema and model caches."""
+    return {
+        'schemas': cached_schema.cache_info(),
+        'dataclass_models': new_pydantic_model_from_dataclass.cache_info(),
+        'callable_models': new_pydantic_model_from_callable.cache_info(),
+    }
+
+
+def clear_schema_cache():
+    """Forgets all generated schemas and models, e.g., after redefining a type in a notebook."""
+    cached_schema.cache_clear()
+    new_pydantic_model_from_dataclass.cache_clear()
+    new_pydantic_model_from_callable.cache_clear()
+
+
 def create_schema_for_type(
         t: type[Any],
         replace_refs: bool = True,
@@ -138,7 +192,9 @@ def process_schema(
         replace_refs: bool = True,
         keep_titles: bool = False,
         flatten: bool = True,
+        inline_shared: bool = True,
 ) -> dict[str, Any]:
+    """Resolves references, removes titles and flattens single-clause allOf in a single traversal."""
     # ensure schema dictionary
     if isinstance(schema, TypeAdapter):
         schema = schema.json_schema()
@@ -147,20 +203,94 @@ def process_schema(
     elif not isinstance(schema, dict):
         raise TypeError('Invalid schema')
 
-    # resolve JSON references
-    if replace_refs:
-        schema = jsonref.replace_refs(schema, proxies=False)
-        delete_entry(schema, '$defs')
-
-    # remove title entries
-    if not keep_titles:
-        delete_entry(schema, 'title')
-
-    # flatten allOf when possible
-    if flatten:
-        flatten_entry(schema, 'allOf')
-
-    return schema
+    # references that are kept as they are, instead of being inlined
+    shared = {ref for ref, n in count_refs(schema).items() if n > 1} if replace_refs and not inline_shared else set()
+    resolved: dict[str, Any] = {}
+    resolving: set[str] = set()
+    kept: set[str] = set()
+
+    def resolve(ref: str) -> Optional[Any]:
+        # returns the processed target of ref, or None if it is being processed (a cycle)
+        if ref in resolved:
+            return resolved[ref]
+        if ref in resolving:
+            return None
+        resolving.add(ref)
+        resolved[ref] = visit(resolve_pointer(schema, ref))
+        resolving.remove(ref)
+        return resolved[ref]
+
+    def visit(obj: Any) -> Any:
+        if isinstance(obj, list):
+            return [visit(x) for x in obj]
+        if not isinstance(obj, dict):
+            return obj
+        ref = obj.get('$ref')
+        if replace_refs and isinstance(ref, str) and ref.startswith('#'):
+            siblings = {k: v for k, v in obj.items() if k != '$ref'}
+            target = None if ref in shared else resolve(ref)
+            if target is None:
+                # keep the reference, and the definition it points to
+                if ref in shared:
+                    resolve(ref)
+                kept.add(ref)
+                target = {'$ref': ref}
+            return {**target, **visit_keys(siblings)} if siblings else target
+        return visit_keys(obj)
+
+    def visit_keys(obj: dict[str, Any]) -> dict[str, Any]:
+        processed = {}
+        for k, v in obj.items():
+            if k == '$defs' and replace_refs:
+                continue
+            if k == 'title' and not keep_titles:
+                continue
+            if k == 'properties' and isinstance(v, dict):
+                # property names are kept, even if they are called title
+                processed[k] = {name: visit(x) for name, x in v.items()}
+            else:
+                processed[k] = visit(v)
+        # flatten allOf when possible
+        if flatten and isinstance(clauses := processed.get('allOf'), list) and len(clauses) == 1:
+            processed.pop('allOf')
+            processed.update(clauses[0])
+        return processed
+
+    processed = visit(schema)
+    if not replace_refs:
+        return processed
+    # definitions needed by the references that were kept, including those only referenced by other definitions
+    defs = {}
+    while pending := [ref for ref in kept if ref not in defs]:
+        for ref in pending:
+            defs[ref] = resolve(ref)
+    defs = {ref.removeprefix('#/$defs/'): d for ref, d in defs.items() if ref.startswith('#/$defs/')}
+    if defs:
+        processed = {**processed, '$defs': dict(sorted(defs.items()))}
+    return processed
+
+
+def resolve_pointer(schema: dict[str, Any], ref: str) -> Any:
+    """Returns the part of the schema that a local JSON reference, like #/$defs/Model, points to."""
+    obj = schema
+    for part in ref.removeprefix('#').split('/')[1:]:
+        part = part.replace('~1', '/').replace('~0', '~')
+        obj = obj[int(part)] if isinstance(obj, list) else obj[part]
+    return obj
+
+
+def count_refs(obj: Any) -> dict[str, int]:
+    counts = {}
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if isinstance(obj, dict):
+            if isinstance(ref := obj.get('$ref'), str):
+                counts[ref] = counts.get(ref, 0) + 1
+            stack.extend(obj.values())
+        elif isinstance(obj, list):
+            stack.extend(obj)
+    return counts
 
 
 def delete_entry(obj: Any, name: str) -> None:
@@ -192,6 +322,7 @@ def flatten_entry(obj: Any, name: str):
             flatten_entry(x, name)
 
 
+@memoize
 def new_pydantic_model_from_dataclass(
         t: type[Any],
         name: Optional[str] = None,
@@ -220,6 +351,7 @@ def new_pydantic_model_from_dataclass(
     )
 
 
+@memoize
 def new_pydantic_model_from_callable(
         f: Callable,
         name: Optional[str] = None,
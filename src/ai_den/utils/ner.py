@@ -0,0 +1,172 @@
+from itertools import chain
+from typing import Any, Optional
+from collections.abc import Iterable
+
+import numpy as np
+
+from ai_den.utils.arrays import lengths_to_offsets
+
+
+OUTSIDE_TAG = 'O'
+
+# codes of the tag prefixes, in the order they are assigned
+PREFIX_CODES = {'O': 0, 'B': 1, 'I': 2, 'E': 3, 'S': 4}
+B, I, E, S = PREFIX_CODES['B'], PREFIX_CODES['I'], PREFIX_CODES['E'], PREFIX_CODES['S']
+
+SCHEMES = ('BIO', 'BIOES')
+
+
+class LabelVocabulary:
+    """Maps BIO/BIOES tags to integer ids, with the outside tag as 0."""
+
+    def __init__(self, tags: Iterable[str] = (), *, scheme: str = 'BIO', separator: str = '-'):
+        if scheme not in SCHEMES:
+            raise ValueError(f'unsupported tagging scheme: {scheme}')
+        self.scheme = scheme
+        self.separator = separator
+        self.tags: list[str] = []
+        self.tag_to_id: dict[str, int] = {}
+        self.entity_types: list[str] = []
+        self.entity_type_to_id: dict[str, int] = {}
+        self._prefixes: list[int] = []
+        self._types: list[int] = []
+        self.add(OUTSIDE_TAG)
+        for tag in tags:
+            self.add(tag)
+
+    @classmethod
+    def from_tags(cls, tags: Iterable[Iterable[str]], **kwargs) -> 'LabelVocabulary':
+        """Builds a vocabulary from sequences of tags, e.g., the ner column of a dataset."""
+        # sort so that the ids don't depend on the order of the examples
+        return cls(sorted(set(chain.from_iterable(tags))), **kwargs)
+
+    def __len__(self) -> int:
+        return len(self.tags)
+
+    def __contains__(self, tag: str) -> bool:
+        return tag in self.tag_to_id
+
+    def add(self, tag: str) -> int:
+        if (tag_id := self.tag_to_id.get(tag)) is not None:
+            return tag_id
+        if tag == OUTSIDE_TAG:
+            prefix, entity_type = PREFIX_CODES['O'], -1
+        else:
+            prefix, _, name = tag.partition(self.separator)
+            if prefix not in PREFIX_CODES or prefix == 'O' or not name:
+                raise ValueError(f'invalid tag: {tag}')
+            if self.scheme == 'BIO' and prefix not in 'BI':
+                raise ValueError(f'invalid tag for the BIO scheme: {tag}')
+            prefix = PREFIX_CODES[prefix]
+            if (entity_type := self.entity_type_to_id.get(name)) is None:
+                entity_type = len(self.entity_types)
+                self.entity_types.append(name)
+                self.entity_type_to_id[name] = entity_type
+        tag_id = len(self.tags)
+        self.tags.append(tag)
+        self.tag_to_id[tag] = tag_id
+        self._prefixes.append(prefix)
+        self._types.append(entity_type)
+        return tag_id
+
+    @property
+    def prefixes(self) -> np.ndarray:
+        return np.array(self._prefixes, dtype=np.int8)
+
+    @property
+    def types(self) -> np.ndarray:
+        return np.array(self._types, dtype=np.int32)
+
+    def encode(self, tags: list[list[str]], *, extend: bool = False) -> tuple[np.ndarray, np.ndarray]:
+        """Encodes a batch of tag sequences into flat ids and the offsets of each sequence."""
+        offsets = lengths_to_offsets(map(len, tags))
+        lookup = self.add if extend else self.tag_to_id.__getitem__
+        ids = np.fromiter(map(lookup, chain.from_iterable(tags)), dtype=np.int32, count=offsets[-1])
+        return ids, offsets
+
+    def decode(self, ids: np.ndarray, offsets: np.ndarray) -> list[list[str]]:
+        tags = np.array(self.tags, dtype=object)[ids]
+        return [t.tolist() for t in np.split(tags, offsets[1:-1])]
+
+    def extract_spans(self, ids: np.ndarray, offsets: np.ndarray) -> 'Spans':
+        """Extracts the entity spans of a batch of encoded sequences, reading tags leniently like conlleval."""
+        prefixes = self.prefixes[ids]
+        types = self.types[ids]
+        is_entity = types >= 0
+        # mark the first token of every sequence, so that entities never cross sequences
+        first = np.zeros(len(ids), dtype=bool)
+        first[offsets[:-1][offsets[:-1] < len(ids)]] = True
+        prev_types = np.roll(types, 1)
+        prev_types[first] = -1
+        starts = is_entity & ((prefixes == B) | (types != prev_types))
+        if self.scheme == 'BIOES':
+            prev_prefixes = np.roll(prefixes, 1)
+            starts |= is_entity & ((prefixes == S) | (prev_prefixes == E) | (prev_prefixes == S))
+        # an entity ends where the next token doesn't continue it
+        continues = is_entity & ~starts
+        next_continues = np.roll(continues, -1)
+        next_continues[np.roll(first, -1)] = False
+        ends = is_entity & ~next_continues
+        start_positions = np.flatnonzero(starts)
+        end_positions = np.flatnonzero(ends) + 1
+        sequences = np.searchsorted(offsets, start_positions, side='right') - 1
+        return Spans(
+            offsets=np.searchsorted(sequences, np.arange(len(offsets)), side='left'),
+            starts=start_positions - offsets[sequences],
+            ends=end_positions - offsets[sequences],
+            types=types[start_positions],
+        )
+
+    def labels(self, spans: 'Spans') -> np.ndarray:
+        return np.array(self.entity_types, dtype=object)[spans.types]
+
+
+class Spans:
+    """Entity spans of a batch of sequences, with the spans of sequence i at offsets[i]:offsets[i+1]."""
+
+    def __init__(self, offsets: np.ndarray, starts: np.ndarray, ends: np.ndarray, types: np.ndarray):
+        self.offsets = offsets
+        self.starts = starts
+        self.ends = ends
+        self.types = types
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        lo, hi = self.offsets[i], self.offsets[i+1]
+        return self.starts[lo:hi], self.ends[lo:hi], self.types[lo:hi]
+
+    def split(self, values: np.ndarray) -> list[np.ndarray]:
+        """Splits an array with one value per span into one array per sequence."""
+        return np.split(values, self.offsets[1:-1])
+
+
+class TagEncoder:
+    """Batched transform for Dataset.map that encodes tags and extracts entity spans."""
+
+    def __init__(
+            self,
+            vocab: LabelVocabulary,
+            tags_field: str = 'ner',
+            ids_field: Optional[str] = 'ner_ids',
+            entities_field: Optional[str] = 'entities',
+    ):
+        self.vocab = vocab
+        self.tags_field = tags_field
+        self.ids_field = ids_field
+        self.entities_field = entities_field
+
+    def __call__(self, batch: dict[str, list[Any]]) -> dict[str, list[Any]]:
+        ids, offsets = self.vocab.encode(batch[self.tags_field])
+        outputs = dict()
+        if self.ids_field is not None:
+            outputs[self.ids_field] = np.split(ids, offsets[1:-1])
+        if self.entities_field is not None:
+            spans = self.vocab.extract_spans(ids, offsets)
+            labels = self.vocab.labels(spans)
+            outputs[self.entities_field] = [
+                dict(start=starts, end=ends, label=label.tolist())
+                for starts, ends, label in zip(spans.split(spans.starts), spans.split(spans.ends), spans.split(labels))
+            ]
+        return outputs
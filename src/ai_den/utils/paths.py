@@ -5,6 +5,9 @@ from pathlib import Path
 PathLike = str | os.PathLike[str]
 
 
+CACHE_DIR = Path(os.environ.get('AI_DEN_CACHE', Path.home() / '.cache' / 'ai_den'))
+
+
 def replace_subpath(path: PathLike, old: PathLike, new: PathLike) -> Path:
     path, old, new = Path(path), Path(old), Path(new)
     return new / path.relative_to(old if old != path else old.parent)
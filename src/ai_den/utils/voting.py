@@ -0,0 +1,94 @@
+import dataclasses
+from collections import Counter
+from typing import Any, Literal, Optional, TypeVar
+from collections.abc import Callable, Sequence
+
+from pydantic import BaseModel
+
+from ai_den.utils.dataclasses import get_json_encoder, is_dataclass_instance
+
+
+T = TypeVar('T')
+
+VotingMethod = Literal['exact', 'field', 'union', 'intersection', 'majority']
+
+Voting = VotingMethod | Callable[[Sequence[Any]], Any]
+
+
+def vote(results: Sequence[T], method: Voting = 'exact', *, field: Optional[str] = None) -> T:
+    """Aggregates several sampled results into one, by exact, field, union, intersection or majority."""
+    if not results:
+        raise ValueError('no results to vote on')
+    match method:
+        case 'exact':
+            return exact_vote(results)
+        case 'field':
+            return field_vote(results)
+        case 'union':
+            return item_vote(results, 1, field=field)
+        case 'intersection':
+            return item_vote(results, len(results), field=field)
+        case 'majority':
+            return item_vote(results, len(results) // 2 + 1, field=field)
+        case _ if callable(method):
+            return method(results)
+        case _:
+            raise ValueError(f'unknown voting method: {method}')
+
+
+def vote_key(obj: Any) -> str:
+    """Returns a canonical json representation of obj, so that equal values get equal keys."""
+    return get_json_encoder(sort_keys=True).encode(obj)
+
+
+def most_common(values: Sequence[T]) -> T:
+    # ties are broken in favor of the value seen first
+    counts = Counter(map(vote_key, values))
+    best = max(counts.values())
+    return next(value for value in values if counts[vote_key(value)] == best)
+
+
+def exact_vote(results: Sequence[T]) -> T:
+    return most_common(results)
+
+
+def field_vote(results: Sequence[T]) -> T:
+    first = results[0]
+    names = list(get_fields(first))
+    voted = {name: most_common([get_fields(r)[name] for r in results]) for name in names}
+    return replace_fields(first, voted)
+
+
+def item_vote(results: Sequence[T], min_votes: int, *, field: Optional[str] = None) -> T:
+    """Keeps the list items that occur in at least min_votes results, in order of first occurrence."""
+    lists = [r if field is None else get_fields(r)[field] for r in results]
+    counts = Counter()
+    items = {}
+    for items_list in lists:
+        # an item counts once per result
+        keys = {}
+        for item in items_list:
+            keys.setdefault(vote_key(item), item)
+        counts.update(keys.keys())
+        for key, item in keys.items():
+            items.setdefault(key, item)
+    voted = [item for key, item in items.items() if counts[key] >= min_votes]
+    return voted if field is None else replace_fields(results[0], {field: voted})
+
+
+def get_fields(obj: Any) -> dict[str, Any]:
+    if is_dataclass_instance(obj):
+        return {f.name: getattr(obj, f.name) for f in dataclasses.fields(obj)}
+    if isinstance(obj, BaseModel):
+        return {name: getattr(obj, name) for name in type(obj).model_fields}
+    if isinstance(obj, dict):
+        return obj
+    raise TypeError(f'cannot vote on the fields of {type(obj).__name__}')
+
+
+def replace_fields(obj: T, values: dict[str, Any]) -> T:
+    if is_dataclass_instance(obj):
+        return dataclasses.replace(obj, **values)
+    if isinstance(obj, BaseModel):
+        return obj.model_copy(update=values)
+    return {**obj, **values}
@@ -0,0 +1,23 @@
+import pytest
+
+
+class FakeLlama:
+    model = object()
+
+
+@pytest.fixture
+def make_tokenizer(monkeypatch):
+    """Returns a factory of tokenizers over a fake vocabulary of (text, type) pairs."""
+    llama_cpp = pytest.importorskip('llama_cpp')
+    from ai_den.llama_cpp.tokenizer import LlamaCppTokenizer
+
+    def make(vocab, cache_dir=None, llama=None):
+        monkeypatch.setattr(llama_cpp, 'llama_vocab_type', lambda model: llama_cpp.LLAMA_VOCAB_TYPE_SPM, raising=False)
+        monkeypatch.setattr(llama_cpp, 'llama_n_vocab', lambda model: len(vocab), raising=False)
+        monkeypatch.setattr(llama_cpp, 'llama_token_bos', lambda model: 1, raising=False)
+        monkeypatch.setattr(llama_cpp, 'llama_token_eos', lambda model: 2, raising=False)
+        monkeypatch.setattr(llama_cpp, 'llama_token_get_text', lambda model, i: vocab[i][0].encode(), raising=False)
+        monkeypatch.setattr(llama_cpp, 'llama_token_get_type', lambda model, i: vocab[i][1], raising=False)
+        return LlamaCppTokenizer(llama or FakeLlama(), cache_dir=cache_dir)
+
+    return make
@@ -0,0 +1,44 @@
+import pytest
+
+pytest.importorskip('llama_cpp')
+
+from ai_den.llama_cpp.data_type import MAX_FRACTION_DIGITS, DataType, make_repetition
+
+
+@pytest.mark.parametrize('multiple_of,decimals', [(0.01, 2), (0.5, 1), (2.5, 1), (1e-7, 7), (1.25e-10, 12), (5, 0), (100.0, 0)])
+def test_multiple_of_bounds_fraction_digits(multiple_of, decimals):
+    gbnf = DataType.from_schema({'type': 'number', 'multipleOf': multiple_of}).gbnf()
+    if decimals:
+        assert f'("." {make_repetition("[0-9]", 1, decimals)})?' in gbnf
+        assert f'("." {make_repetition("[0-9]", 1, decimals + 1)})?' not in gbnf
+    else:
+        assert '"."' not in gbnf
+
+
+def number_rule(schema):
+    return DataType.from_schema(schema).gbnf().splitlines()[1].split(' ::= ')[1]
+
+
+def test_bounded_numbers_without_multiple_of_have_bounded_fractions():
+    rule = number_rule({'type': 'number', 'minimum': 0, 'maximum': 1})
+    assert rule == f'[0-9] ("." {make_repetition("[0-9]", 1, MAX_FRACTION_DIGITS)})?'
+    # unbounded numbers keep the general form
+    assert number_rule({'type': 'number', 'multipleOf': 0.5}) == '"-"? ([0-9] | [1-9] [0-9]*) ("." [0-9])? ([eE] [-+]? [0-9]+)?'
+
+
+@pytest.mark.parametrize('schema,rule', [
+    ({'type': 'integer', 'maximum': 100}, '"-" ([0-9] | [1-9] [0-9]*) | ([0-9] | [1-9] ([0-9] ([0-9])?)?)'),
+    ({'type': 'integer', 'minimum': -5}, '"-" [0-9] | ([0-9] | [1-9] [0-9]*)'),
+    ({'type': 'integer', 'minimum': 0}, '([0-9] | [1-9] [0-9]*)'),
+    ({'type': 'integer', 'maximum': -10}, '"-" ([0-9] | [1-9] [0-9]*)'),
+    ({'type': 'integer', 'minimum': -50, 'maximum': 50}, '"-"? ([0-9] | [1-9] ([0-9])?)'),
+])
+def test_one_sided_bounds_bound_the_digits_on_their_side(schema, rule):
+    assert number_rule(schema) == rule
+
+
+def test_bounded_side_has_no_exponent():
+    negative, positive = number_rule({'type': 'number', 'maximum': 100}).split(')? | ')
+    assert '[eE]' in negative
+    assert '[eE]' not in positive
+    assert positive.startswith('([0-9] | [1-9] ([0-9] ([0-9])?)?)')
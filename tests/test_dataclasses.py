@@ -0,0 +1,99 @@
+import io
+import json
+from enum import Enum, IntEnum
+from typing import Optional
+from dataclasses import asdict, dataclass
+
+import pytest
+
+from ai_den.utils.dataclasses import JsonEncoder, iter_json_array, read_json, write_json
+
+
+@dataclass
+class Record:
+    text: str
+    score: float
+
+
+# characters that str.splitlines treats as line boundaries, besides \n and \r
+LINE_BREAKS = '\u2028\u2029\x85\x1c\x1d\x1e\v\f'
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 1 << 20])
+def test_json_lines_round_trip_with_line_breaks_in_strings(tmp_path, chunk_size):
+    records = [Record(f'a{c}b', i / 3) for i, c in enumerate(LINE_BREAKS)]
+    path = tmp_path / 'records.jsonl'
+    write_json(records, path)
+    assert list(read_json(Record, path, chunk_size=chunk_size)) == records
+
+
+NUMBERS = [0, -1500, 1.5, -0.25, 1e10, 2.5e-3, -7e+21, 123456789, 1.0]
+
+
+@pytest.mark.parametrize('separators', [(',', ':'), (', ', ': ')])
+def test_json_array_numbers_at_every_chunk_boundary(separators):
+    text = json.dumps(NUMBERS, separators=separators)
+    for chunk_size in range(1, len(text) + 2):
+        f = io.StringIO(text)
+        head = f.read(chunk_size)
+        assert list(iter_json_array(f, head, chunk_size)) == NUMBERS, chunk_size
+
+
+class Label(str, Enum):
+    PER = 'PER'
+    LOC = 'LOC'
+
+
+class Level(IntEnum):
+    LOW = 1
+    HIGH = 2
+
+
+@dataclass
+class Entity:
+    text: str
+    label: Label
+    span: tuple[int, int]
+
+
+@dataclass
+class Annotation:
+    entities: list[Entity]
+    scores: dict[str, float]
+    level: Level
+    best: Optional[Entity] = None
+    pairs: tuple[Entity, ...] = ()
+
+
+ANNOTATION = Annotation(
+    entities=[Entity('Zoë', Label.PER, (0, 1)), Entity('"Paris"\n', Label.LOC, (3, 4))],
+    scores={'f1': 0.5, 'nan': float('nan'), 'inf': float('-inf'), 'big': 1e300},
+    level=Level.HIGH,
+    pairs=(Entity('a', Label.LOC, (0, 0)),),
+)
+
+
+@pytest.mark.parametrize('kwargs', [
+    {},
+    {'ensure_ascii': True},
+    {'sort_keys': True},
+    {'separators': (',', ':')},
+])
+def test_json_encoder_matches_json_dumps_of_asdict(kwargs):
+    encoder = JsonEncoder(**kwargs)
+    # unlike json.dumps, the encoder doesn't escape non-ascii characters by default
+    dumps_kwargs = {'ensure_ascii': False, **kwargs}
+    assert encoder.encode(ANNOTATION) == json.dumps(asdict(ANNOTATION), **dumps_kwargs)
+    assert encoder.encode([ANNOTATION, None]) == json.dumps([asdict(ANNOTATION), None], **dumps_kwargs)
+
+
+def test_json_encoder_rejects_what_json_dumps_rejects():
+    class Color(Enum):
+        RED = 'red'
+
+    with pytest.raises(TypeError):
+        json.dumps(Color.RED)
+    with pytest.raises(TypeError, match='Color'):
+        JsonEncoder().encode({'color': Color.RED})
+    with pytest.raises(ValueError):
+        JsonEncoder(allow_nan=False).encode(ANNOTATION)
@@ -0,0 +1,127 @@
+import io
+import os
+import re
+import sys
+import tarfile
+import subprocess
+from pathlib import Path
+from functools import partial
+
+import pytest
+
+from ai_den.utils import files
+from ai_den.utils.files import open_archive
+from ai_den.utils.datasets import fingerprint_callable, fingerprint_conll_files, gen_conll_directory
+
+
+def make_replacer(replacement):
+    return lambda text: text.replace('x', replacement)
+
+
+def pad(text, width=10, *, fill=' '):
+    return text.ljust(width, fill)
+
+
+class Preprocessor:
+    def __call__(self, text):
+        return text
+
+
+class StreamingPreprocessor(Preprocessor):
+    def __init__(self):
+        # generators can't be pickled
+        self.replacements = (r for r in ('a', 'b'))
+
+
+@pytest.mark.parametrize('a,b', [
+    (partial(re.sub, 'x', 'AAA'), partial(re.sub, 'x', 'BBB')),
+    (partial(re.sub, 'x', repl='AAA'), partial(re.sub, 'x', repl='BBB')),
+    (make_replacer('AAA'), make_replacer('BBB')),
+    (lambda text: text.lower(), lambda text: text.upper()),
+    (re.compile('a').sub, re.compile('b').sub),
+    (str.lower, str.upper),
+])
+def test_different_callables_get_different_fingerprints(a, b):
+    assert fingerprint_callable(a) != fingerprint_callable(b)
+
+
+def test_defaults_are_fingerprinted():
+    before = fingerprint_callable(pad)
+    pad.__defaults__ = (20,)
+    try:
+        assert fingerprint_callable(pad) != before
+        pad.__defaults__ = (10,)
+        pad.__kwdefaults__ = {'fill': '.'}
+        assert fingerprint_callable(pad) != before
+    finally:
+        pad.__defaults__, pad.__kwdefaults__ = (10,), {'fill': ' '}
+    assert fingerprint_callable(pad) == before
+
+
+def test_fingerprints_are_stable_across_sessions():
+    code = (
+        'import re\n'
+        'from functools import partial\n'
+        'from ai_den.utils.datasets import fingerprint_callable\n'
+        'def outer(n):\n'
+        '    inner = lambda s: s * n\n'
+        '    return lambda s: inner(s).strip()\n'
+        "print(fingerprint_callable(partial(re.sub, re.compile('x'), lambda m: m.group(0) * 2)))\n"
+        'print(fingerprint_callable(outer(3)))\n'
+    )
+    outputs = {
+        subprocess.run(
+            [sys.executable, '-c', code],
+            env={**os.environ, 'PYTHONPATH': str(Path(__file__).parents[1] / 'src'), 'PYTHONHASHSEED': seed},
+            capture_output=True, text=True, check=True,
+        ).stdout
+        for seed in ('1', '2')
+    }
+    assert len(outputs) == 1
+
+
+def test_callable_instances_are_hashed_by_pickling(tmp_path):
+    path = tmp_path / 'train.conll'
+    path.write_text('a\tO\n')
+    a = fingerprint_conll_files([path], {'preprocess_text': Preprocessor()})
+    assert a == fingerprint_conll_files([path], {'preprocess_text': Preprocessor()})
+    b = fingerprint_conll_files([path], {'preprocess_text': Preprocessor()}, cache_key='identity-v1')
+    c = fingerprint_conll_files([path], {'preprocess_text': Preprocessor()}, cache_key='identity-v2')
+    assert len({a, b, c}) == 3
+
+
+def test_unpicklable_callable_gets_random_fingerprint(tmp_path):
+    path = tmp_path / 'train.conll'
+    path.write_text('a\tO\n')
+    preprocessor = StreamingPreprocessor()
+    with pytest.warns(UserWarning, match='cache_key'):
+        a = fingerprint_conll_files([path], {'preprocess_text': preprocessor})
+    with pytest.warns(UserWarning, match='cache_key'):
+        b = fingerprint_conll_files([path], {'preprocess_text': preprocessor})
+    assert a != b
+
+
+def write_tar(path, members):
+    with tarfile.open(path, 'w:gz') as archive:
+        for name, text in members:
+            data = text.encode()
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+
+
+def test_tar_members_are_read_in_stored_order_and_closed(tmp_path, monkeypatch):
+    path = tmp_path / 'corpus.tar.gz'
+    write_tar(path, [('train/b.conll', 'b\tO\n'), ('train/a.conll', 'a\tO\n'), ('README', 'x')])
+    opened = []
+
+    def record(path):
+        opened.append(open_archive(path))
+        return opened[-1]
+
+    monkeypatch.setattr(files, 'open_archive', record)
+    sequences = list(gen_conll_directory(path, {'text': 0}, glob='train/*.conll', filename_field='file'))
+    assert sequences == [{'file': 'b.conll', 'text': ['b']}, {'file': 'a.conll', 'text': ['a']}]
+    # a single archive for the whole pass, closed at its end
+    assert len(opened) == 1
+    assert opened[0].closed
@@ -0,0 +1,36 @@
+import pytest
+
+from ai_den.utils.ner import LabelVocabulary
+from ai_den.utils.evaluation import SpanEvaluator, locate_entities
+
+
+WORDS = 'Paris Hilton flew from Paris to New York'.split()
+
+
+def spans_of(spans, i=0):
+    lo, hi = spans.offsets[i], spans.offsets[i + 1]
+    return list(zip(spans.starts[lo:hi].tolist(), spans.ends[lo:hi].tolist(), spans.types[lo:hi].tolist()))
+
+
+def test_each_entity_is_located_once():
+    evaluator = SpanEvaluator(['PER', 'LOC'])
+    spans = locate_entities([WORDS], [[('Paris', 'LOC')]], evaluator)
+    assert spans_of(spans) == [(0, 1, 1)]
+
+
+def test_repeated_entities_take_successive_occurrences():
+    evaluator = SpanEvaluator(['PER', 'LOC'])
+    entities = [('Paris Hilton', 'PER'), ('Paris', 'LOC'), ('New York', 'LOC'), ('Paris', 'LOC')]
+    spans = locate_entities([WORDS], [entities], evaluator)
+    # the second Paris has no occurrence left
+    assert spans_of(spans) == [(0, 2, 0), (4, 5, 1), (6, 8, 1)]
+
+
+def test_type_ids_must_be_known():
+    vocab = LabelVocabulary.from_tags([['B-PER', 'O', 'B-LOC']])
+    spans = vocab.extract_spans(*vocab.encode([['B-PER', 'O', 'B-LOC']]))
+    with pytest.raises(ValueError, match='out of range'):
+        SpanEvaluator().update(spans, spans)
+    evaluator = SpanEvaluator.from_vocabulary(vocab)
+    evaluator.update(spans, spans)
+    assert evaluator.compute()['exact']['micro']['f1'] == 1.0
@@ -0,0 +1,39 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+from datasets import Dataset
+
+pytest.importorskip('llama_cpp')
+
+from ai_den.llama_cpp.few_shot import FewShotSelector
+
+
+class FakeLlm:
+    """Embeds texts as fixed random vectors, so that results can be checked against brute force."""
+
+    def __init__(self, model_path: Path, dim: int = 8):
+        self.model_path = model_path
+        self.dim = dim
+
+    def embed(self, texts, normalize=True):
+        rows = [np.random.default_rng(abs(hash(t)) % 2**32).standard_normal(self.dim) for t in texts]
+        e = np.array(rows, dtype=np.float32)
+        return e / np.linalg.norm(e, axis=1, keepdims=True)
+
+
+@pytest.mark.parametrize('num_rows,k,chunk_size', [(10, 4, 3), (10, 4, 1), (3, 5, 2), (7, 7, 7), (1, 3, 1)])
+def test_search_matches_brute_force(tmp_path, num_rows, k, chunk_size):
+    model_path = tmp_path / 'model.gguf'
+    model_path.write_bytes(b'weights')
+    llm = FakeLlm(model_path)
+    dataset = Dataset.from_dict({'text': [f'example {i}' for i in range(num_rows)]})
+    selector = FewShotSelector(
+        llm, dataset, 'text', 'text', k=k, chunk_size=chunk_size, cache_dir=tmp_path / 'cache',
+    )
+    indices, scores = selector.search(['query a', 'query b'])
+    expected_scores = llm.embed(['query a', 'query b']) @ llm.embed(dataset['text']).T
+    expected = np.argsort(-expected_scores, axis=1, kind='stable')[:, :min(k, num_rows)]
+    assert indices.shape == expected.shape
+    np.testing.assert_allclose(scores, np.take_along_axis(expected_scores, expected, axis=1), rtol=1e-5)
+    np.testing.assert_array_equal(np.sort(indices, axis=1), np.sort(expected, axis=1))
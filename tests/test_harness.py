@@ -0,0 +1,92 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from datasets import Dataset
+
+pytest.importorskip('llama_cpp')
+
+from ai_den.llama_cpp import harness as harness_module
+from ai_den.llama_cpp.harness import ExecutorBackend, InferenceHarness, ProcessBackend, SequentialBackend
+
+
+class FakeLlm:
+    system_prompt = 'Extract the entities.'
+
+    def __init__(self, model_path):
+        self.model_path = model_path
+
+    def __call__(self, prompt, **kwargs):
+        return prompt.upper()
+
+
+def shout(prompt):
+    if prompt == 'b':
+        raise RuntimeError('worker failed')
+    return prompt.upper()
+
+
+class RecordingExecutor:
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+
+
+@pytest.fixture
+def dataset():
+    return Dataset.from_dict({'text': ['a', 'b', 'c']})
+
+
+def test_executor_backend_records_errors_per_row(tmp_path, dataset):
+    with ThreadPoolExecutor(2) as executor:
+        harness = InferenceHarness(ExecutorBackend(executor, shout), 'text', tmp_path, shard_size=2)
+        outputs = harness.run(dataset)
+    assert outputs['output'] == ['"A"', None, '"C"']
+    assert outputs['error'] == [None, 'RuntimeError: worker failed', None]
+
+
+def test_resume_requires_same_model_and_prompt(tmp_path, dataset):
+    model_path = tmp_path / 'model.gguf'
+    model_path.write_bytes(b'weights')
+    llm = FakeLlm(model_path)
+    examples = [('Ada lives in Paris', '["Ada", "Paris"]')]
+    InferenceHarness(SequentialBackend(llm, examples=examples), 'text', tmp_path / 'out').run(dataset)
+    # the same run resumes
+    InferenceHarness(SequentialBackend(llm, examples=examples), 'text', tmp_path / 'out').run(dataset)
+    with pytest.raises(ValueError, match='prompt'):
+        InferenceHarness(SequentialBackend(llm, examples=examples[:0]), 'text', tmp_path / 'out').run(dataset)
+    with pytest.raises(ValueError, match='prompt'):
+        InferenceHarness(SequentialBackend(llm, system_prompt='Be brief.'), 'text', tmp_path / 'out').run(dataset)
+    model_path.write_bytes(b'other weights')
+    with pytest.raises(ValueError, match='model'):
+        InferenceHarness(SequentialBackend(llm, examples=examples), 'text', tmp_path / 'out').run(dataset)
+
+
+def test_resume_requires_same_schema_and_generation_kwargs(tmp_path, dataset):
+    model_path = tmp_path / 'model.gguf'
+    model_path.write_bytes(b'weights')
+    llm = FakeLlm(model_path)
+    InferenceHarness(SequentialBackend(llm, temperature=0.0), 'text', tmp_path / 'out').run(dataset)
+    with pytest.raises(ValueError, match='generation'):
+        InferenceHarness(SequentialBackend(llm, temperature=0.8), 'text', tmp_path / 'out').run(dataset)
+    with pytest.raises(ValueError, match='schema'):
+        InferenceHarness(SequentialBackend(llm, list[str], temperature=0.0), 'text', tmp_path / 'out').run(dataset)
+
+
+def test_empty_dataset(tmp_path):
+    dataset = Dataset.from_dict({'text': []})
+    with ThreadPoolExecutor(1) as executor:
+        harness = InferenceHarness(ExecutorBackend(executor, shout), 'text', tmp_path, keep_columns=['text'])
+        outputs = harness.run(dataset)
+    assert len(outputs) == 0
+    assert outputs.column_names == ['index', 'text', 'output', 'error']
+
+
+def test_process_backend_without_model_kwargs(tmp_path, monkeypatch):
+    model_path = tmp_path / 'model.gguf'
+    model_path.write_bytes(b'weights')
+    monkeypatch.setattr(harness_module, 'ProcessPoolExecutor', RecordingExecutor)
+    monkeypatch.setattr(harness_module, 'LlamaCpp', FakeLlm)
+    backend = ProcessBackend(model_path, 2)
+    # what each worker process would run on startup
+    harness_module.init_worker(*backend.executor.kwargs['initargs'])
+    assert harness_module.generate_in_worker('a') == '"A"'
+    assert backend.manifest()['model'] == harness_module.model_id(model_path)
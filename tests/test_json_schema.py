@@ -0,0 +1,102 @@
+from dataclasses import dataclass
+from typing import Optional
+
+from pydantic import BaseModel
+
+from ai_den.utils.json_schema import cached_schema, clear_schema_cache, create_schema, json_schema, process_schema
+
+
+@dataclass
+class Point:
+    """A point.
+
+    Args:
+        x: The x coordinate.
+    """
+
+    x: int
+
+
+def move(point: Point, dx: int = 1):
+    """Moves a point."""
+
+
+def test_create_schema_returns_a_copy_of_the_cached_schema():
+    clear_schema_cache()
+    schema = create_schema(Point)
+    assert schema == {
+        'description': 'A point.',
+        'properties': {'x': {'description': 'The x coordinate.', 'type': 'integer'}},
+        'required': ['x'],
+        'type': 'object',
+    }
+    schema['properties'].clear()
+    schema['required'].append('y')
+    assert create_schema(Point)['properties'] == {'x': {'description': 'The x coordinate.', 'type': 'integer'}}
+    assert create_schema(Point)['required'] == ['x']
+    assert cached_schema.cache_info().misses == 1
+
+
+def test_callable_schemas_are_cached_by_name():
+    clear_schema_cache()
+    assert create_schema(move)['function']['name'] == 'move'
+    assert create_schema(move, name='shift')['function']['name'] == 'shift'
+    assert '"name": "move"' in json_schema(move)
+    assert cached_schema.cache_info().hits == 1
+
+
+class Address(BaseModel):
+    title: str
+
+
+class Node(BaseModel):
+    value: int
+    children: list['Node'] = []
+
+
+class Document(BaseModel):
+    """A document."""
+
+    home: Address
+    work: Optional[Address] = None
+    tree: Node
+
+
+ADDRESS = {'properties': {'title': {'type': 'string'}}, 'required': ['title'], 'type': 'object'}
+
+
+def test_refs_are_resolved_and_titles_removed():
+    schema = process_schema(Document)
+    # the property called title is kept
+    assert schema['properties']['home'] == ADDRESS
+    assert schema['properties']['work']['anyOf'] == [ADDRESS, {'type': 'null'}]
+    assert 'title' not in schema
+    assert schema['description'] == 'A document.'
+
+
+def test_cycles_keep_their_refs():
+    schema = process_schema(Document)
+    node = schema['properties']['tree']
+    assert node['properties']['children']['items'] == {'$ref': '#/$defs/Node'}
+    assert schema['$defs'] == {'Node': node}
+
+
+def test_shared_refs_can_be_kept():
+    schema = process_schema(Document, inline_shared=False)
+    assert schema['properties']['home'] == {'$ref': '#/$defs/Address'}
+    # referenced once from the document, but also from itself
+    assert schema['properties']['tree'] == {'$ref': '#/$defs/Node'}
+    assert schema['$defs']['Address'] == ADDRESS
+    assert sorted(schema['$defs']) == ['Address', 'Node']
+
+
+def test_single_clause_all_of_is_flattened():
+    schema = {
+        'properties': {'a': {'allOf': [{'$ref': '#/$defs/A'}], 'description': 'An a.'}},
+        '$defs': {'A': {'type': 'integer', 'title': 'A'}},
+    }
+    assert process_schema(schema) == {'properties': {'a': {'type': 'integer', 'description': 'An a.'}}}
+    assert process_schema(schema, flatten=False, keep_titles=True)['properties']['a'] == {
+        'allOf': [{'type': 'integer', 'title': 'A'}],
+        'description': 'An a.',
+    }
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('llama_cpp')
+
+from ai_den.llama_cpp import logits_processors
+from ai_den.llama_cpp.trie import VocabTrie
+from ai_den.llama_cpp.logits_processors import allowed_tokens, banned_tokens, substring_tokens, token_biases
+
+from test_tokenizer import VOCAB
+
+
+@pytest.fixture
+def tokenizer(make_tokenizer, monkeypatch):
+    # build the trie in memory instead of in the user's cache
+    monkeypatch.setattr(logits_processors, 'get_vocab_trie', lambda t: VocabTrie.from_tokenizer(t, cache_dir=None))
+    return make_tokenizer(VOCAB)
+
+
+def unmasked(processor) -> list[int]:
+    scores = np.zeros(len(VOCAB), dtype=np.single)
+    return np.flatnonzero(np.isfinite(processor(np.array([1], dtype=np.intc), scores))).tolist()
+
+
+def test_allowed_tokens(tokenizer):
+    assert unmasked(allowed_tokens(tokenizer, [5])) == [2, 5]
+    assert unmasked(allowed_tokens(tokenizer, [' the', '▁caf'], allow_eos=False)) == [5, 6]
+
+
+def test_banned_tokens(tokenizer):
+    # most tokens are allowed, so only the banned ones are reset
+    assert unmasked(banned_tokens(tokenizer, [6, '<unk>'])) == [1, 2, 3, 4, 5]
+
+
+def test_substring_tokens(tokenizer):
+    # the two bytes of é are substrings, as is the piece with the space that sentencepiece prepends
+    assert unmasked(substring_tokens(tokenizer, 'café')) == [2, 3, 4, 5]
+    assert unmasked(substring_tokens(tokenizer, 'the', allow_eos=False)) == [6]
+
+
+def test_token_biases(tokenizer):
+    scores = np.zeros(len(VOCAB), dtype=np.single)
+    token_biases(tokenizer, {' the': 1.5, '<0xC3>': -2.0})(np.array([1], dtype=np.intc), scores)
+    assert scores.tolist() == [0.0, 0.0, 0.0, -2.0, 0.0, 0.0, 1.5]
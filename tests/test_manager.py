@@ -0,0 +1,70 @@
+import struct
+
+import pytest
+
+pytest.importorskip('llama_cpp')
+
+from ai_den.llama_cpp.manager import ModelManager, gguf_block_count, model_footprint
+
+
+def gguf_string(s):
+    data = s.encode()
+    return struct.pack('<Q', len(data)) + data
+
+
+def write_gguf(path, num_layers, padding=0):
+    kv = [
+        gguf_string('general.architecture') + struct.pack('<I', 8) + gguf_string('llama'),
+        gguf_string('general.tags') + struct.pack('<IIQ', 9, 8, 2) + gguf_string('a') + gguf_string('bc'),
+        gguf_string('llama.context_length') + struct.pack('<IQ', 10, 4096),
+        gguf_string('llama.block_count') + struct.pack('<II', 4, num_layers),
+    ]
+    path.write_bytes(struct.pack('<4sIQQ', b'GGUF', 3, 0, len(kv)) + b''.join(kv) + bytes(padding))
+
+
+def test_footprint_splits_offloaded_layers(tmp_path):
+    path = tmp_path / 'model.gguf'
+    write_gguf(path, 32, padding=10_000)
+    size = path.stat().st_size
+    assert gguf_block_count(path) == 32
+    assert model_footprint(path, 0) == (size, 0)
+    assert model_footprint(path, -1) == (0, size)
+    assert model_footprint(path, 100) == (0, size)
+    host, device = model_footprint(path, 8)
+    assert host + device == size and device == size // 4
+
+
+def test_gpu_budget_evicts_offloaded_models_only(tmp_path):
+    footprints = {'cpu.gguf': (60, 0), 'gpu-a.gguf': (0, 60), 'gpu-b.gguf': (0, 60)}
+    for name in footprints:
+        (tmp_path / name).touch()
+    models = ModelManager(
+        100,
+        gpu_memory_budget=100,
+        loader=lambda path, **kwargs: path.name,
+        footprint=lambda path, n_gpu_layers: footprints[path.name],
+    )
+    for name in footprints:
+        models.get(tmp_path / name)
+    # gpu-b only displaces gpu-a, and the model on the host stays loaded
+    assert tmp_path / 'cpu.gguf' in models and tmp_path / 'gpu-b.gguf' in models
+    assert tmp_path / 'gpu-a.gguf' not in models
+    assert (models.memory_used, models.gpu_memory_used) == (60, 60)
+    models.close()
+
+
+def test_single_budget_counts_host_and_device_memory(tmp_path):
+    for name in 'a.gguf', 'b.gguf':
+        (tmp_path / name).touch()
+    models = ModelManager(100, loader=lambda path, **kwargs: path.name, footprint=lambda path, n_gpu_layers: (0, 60))
+    models.get(tmp_path / 'a.gguf')
+    models.get(tmp_path / 'b.gguf')
+    assert tmp_path / 'a.gguf' not in models and models.memory_used == 60
+    models.close()
+
+
+def test_block_count_of_other_files(tmp_path):
+    path = tmp_path / 'model.bin'
+    path.write_bytes(b'GGUF\x03\x00')
+    assert gguf_block_count(path) is None
+    assert model_footprint(path, 8) == (0, 6)
@@ -0,0 +1,97 @@
+import json
+import random
+
+import pytest
+
+llama_cpp = pytest.importorskip('llama_cpp')
+
+from ai_den.llama_cpp.model import LlamaCpp
+
+from test_tokenizer import VOCAB
+
+
+class FakeLlama:
+    model = object()
+
+    def __init__(self, generated):
+        self.generated = generated
+
+    def tokenize(self, text, add_bos=True, special=True):
+        return [1] if add_bos else []
+
+    def generate(self, tokens, **kwargs):
+        yield from self.generated
+
+
+def test_stream_yields_complete_characters(make_tokenizer):
+    llama = FakeLlama([5, 3, 4, 6, 2, 6])
+    llm = LlamaCpp.__new__(LlamaCpp)
+    llm.llm = llama
+    llm.tokenizer = make_tokenizer(VOCAB, llama=llama)
+    chunks = list(llm.stream('prompt', chat_mode=False))
+    # the two bytes of é are yielded together, and generation stops at eos
+    assert chunks == [' caf', 'é', ' the']
+
+
+class StreamingLlama:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.kwargs = None
+
+    def create_chat_completion(self, **kwargs):
+        self.kwargs = kwargs
+        for content in self.chunks:
+            yield {'choices': [{'delta': {'content': content}}]}
+
+
+def test_verbose_call_accepts_generation_kwargs(capsys):
+    llm = LlamaCpp.__new__(LlamaCpp)
+    llm.llm = StreamingLlama(['{"a": ', '1}'])
+    llm.system_prompt = 'Answer in json.'
+    output = llm('prompt', verbose=True, json_mode=True, grammar=None, logprobs=2, top_p=0.5, stop=['\n'])
+    assert output == {'a': 1}
+    assert capsys.readouterr().out == '{"a": 1}\n'
+    assert llm.llm.kwargs['stream']
+    assert llm.llm.kwargs['top_p'] == 0.5
+    assert llm.llm.kwargs['stop'] == ['\n']
+    assert llm.llm.kwargs['top_logprobs'] == 2
+    assert llm.llm.kwargs['messages'][0] == {'role': 'system', 'content': 'Answer in json.'}
+
+
+class ScriptedLlamaCpp(LlamaCpp):
+    def __init__(self, outcomes):
+        self.outcomes = iter(outcomes)
+
+    def __call__(self, prompt, **kwargs):
+        outcome = next(self.outcomes)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+def test_sample_skips_only_unparsable_samples():
+    truncated = json.JSONDecodeError('Unterminated string', '{"a": "', 6)
+    llm = ScriptedLlamaCpp([{'a': 1}, truncated, {'a': 2}])
+    assert llm.sample('prompt', 3, seed=0) == [{'a': 1}, {'a': 2}]
+    llm = ScriptedLlamaCpp([{'a': 1}, ValueError('few-shot examples require chat_mode')])
+    with pytest.raises(ValueError, match='chat_mode'):
+        llm.sample('prompt', 2, seed=0)
+
+
+class SeededLlamaCpp(LlamaCpp):
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, prompt, *, seed, **kwargs):
+        self.calls.append(seed)
+        # each sample depends only on its own seed, as with a reseeded sampler
+        return random.Random(seed).random()
+
+
+def test_sample_runs_one_completion_per_seed():
+    llm = SeededLlamaCpp()
+    samples = llm.sample('prompt', 4, seed=10)
+    assert llm.calls == [10, 11, 12, 13]
+    assert len(set(samples)) == 4
+    # a sample doesn't depend on the samples before it
+    assert SeededLlamaCpp().sample('prompt', 2, seed=12) == samples[2:]
@@ -0,0 +1,63 @@
+import pytest
+
+from ai_den.utils.ner import LabelVocabulary, TagEncoder
+
+
+def spans_of(vocab, tags):
+    spans = vocab.extract_spans(*vocab.encode(tags))
+    labels = vocab.labels(spans)
+    return [
+        list(zip(starts.tolist(), ends.tolist(), label.tolist()))
+        for starts, ends, label in zip(spans.split(spans.starts), spans.split(spans.ends), spans.split(labels))
+    ]
+
+
+def test_bio_spans():
+    vocab = LabelVocabulary(['B-PER', 'I-PER', 'B-LOC', 'I-LOC'])
+    tags = [
+        # an I- tag without a preceding B- starts an entity, and entities may reach the end of the sequence
+        ['I-PER', 'I-PER', 'O', 'B-LOC', 'I-LOC'],
+        # a change of type or a B- tag starts a new entity
+        ['B-PER', 'I-LOC', 'B-LOC', 'B-LOC'],
+        [],
+        # entities don't continue from the previous sequence
+        ['I-LOC'],
+    ]
+    assert spans_of(vocab, tags) == [
+        [(0, 2, 'PER'), (3, 5, 'LOC')],
+        [(0, 1, 'PER'), (1, 2, 'LOC'), (2, 3, 'LOC'), (3, 4, 'LOC')],
+        [],
+        [(0, 1, 'LOC')],
+    ]
+
+
+def test_bioes_spans():
+    vocab = LabelVocabulary(['B-ORG', 'I-ORG', 'E-ORG', 'S-ORG', 'S-PER', 'E-PER', 'I-PER'], scheme='BIOES')
+    tags = [
+        ['S-PER', 'B-ORG', 'I-ORG', 'E-ORG', 'S-ORG', 'E-ORG'],
+        # an entity ends after E- and S- even if the next tag continues the same type
+        ['E-PER', 'I-PER', 'O', 'I-ORG', 'I-ORG'],
+    ]
+    assert spans_of(vocab, tags) == [
+        [(0, 1, 'PER'), (1, 4, 'ORG'), (4, 5, 'ORG'), (5, 6, 'ORG')],
+        [(0, 1, 'PER'), (1, 2, 'PER'), (3, 5, 'ORG')],
+    ]
+
+
+def test_invalid_tags():
+    with pytest.raises(ValueError, match='BIO scheme'):
+        LabelVocabulary(['S-PER'])
+    with pytest.raises(ValueError, match='invalid tag'):
+        LabelVocabulary(['X-PER'])
+    with pytest.raises(KeyError):
+        LabelVocabulary(['B-PER']).encode([['B-LOC']])
+
+
+def test_tag_encoder():
+    vocab = LabelVocabulary.from_tags([['B-PER', 'I-PER', 'O']])
+    outputs = TagEncoder(vocab)({'ner': [['B-PER', 'I-PER', 'O'], ['O']]})
+    assert [ids.tolist() for ids in outputs['ner_ids']] == [[1, 2, 0], [0]]
+    assert [{k: list(v) for k, v in e.items()} for e in outputs['entities']] == [
+        {'start': [0], 'end': [2], 'label': ['PER']},
+        {'start': [], 'end': [], 'label': []},
+    ]
@@ -0,0 +1,56 @@
+import json
+import urllib.error
+import urllib.request
+
+import pytest
+
+pytest.importorskip('llama_cpp')
+
+from ai_den.llama_cpp.server import LlamaCppServer
+
+
+class FakeModel:
+    def __init__(self):
+        self.calls = []
+
+    def create_completion(self, prompt, stream=False, **kwargs):
+        self.calls.append(kwargs)
+        return {'object': 'text_completion', 'model': 'fake.gguf', 'choices': [{'index': 0, 'text': 'ok'}]}
+
+
+@pytest.fixture
+def server():
+    model = FakeModel()
+    with LlamaCppServer({'fake': model}, port=0) as server:
+        server.model = model
+        yield server
+
+
+def post(server, body):
+    request = urllib.request.Request(
+        f'{server.base_url}/completions', json.dumps(body).encode(), {'Content-Type': 'application/json'},
+    )
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def test_sampling_params_are_passed_through(server):
+    status, body = post(server, {'prompt': 'hi', 'top_p': 0.5, 'stop': ['\n'], 'n': 1, 'max_tokens': 4})
+    assert status == 200 and body['model'] == 'fake'
+    assert server.model.calls == [{'top_p': 0.5, 'stop': ['\n'], 'max_tokens': 4}]
+
+
+@pytest.mark.parametrize('body,param', [
+    ({'prompt': 'hi', 'n': 2}, 'n'),
+    ({'prompt': 'hi', 'temperature': 'hot'}, 'temperature'),
+    ({'prompt': 'hi', 'stop': [1]}, 'stop'),
+    ({'prompt': 'hi', 'response_format': {'type': 'json_schema', 'json_schema': {'schema': {'type': 'tuple'}}}}, 'response_format'),
+])
+def test_invalid_requests_are_rejected(server, body, param):
+    status, body = post(server, body)
+    assert status == 400
+    assert body['error']['param'] == param
+    assert server.model.calls == []
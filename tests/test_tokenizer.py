@@ -0,0 +1,126 @@
+import numpy as np
+import pytest
+
+llama_cpp = pytest.importorskip('llama_cpp')
+
+
+VOCAB = [
+    ('<unk>', llama_cpp.LLAMA_TOKEN_TYPE_UNKNOWN),
+    ('<s>', llama_cpp.LLAMA_TOKEN_TYPE_CONTROL),
+    ('</s>', llama_cpp.LLAMA_TOKEN_TYPE_CONTROL),
+    ('<0xC3>', llama_cpp.LLAMA_TOKEN_TYPE_BYTE),
+    ('<0xA9>', llama_cpp.LLAMA_TOKEN_TYPE_BYTE),
+    ('▁caf', llama_cpp.LLAMA_TOKEN_TYPE_NORMAL),
+    ('▁the', llama_cpp.LLAMA_TOKEN_TYPE_NORMAL),
+]
+
+
+def test_fingerprint_covers_every_token(make_tokenizer, tmp_path):
+    a = make_tokenizer(VOCAB, tmp_path)
+    renamed = VOCAB[:-1] + [('▁then', llama_cpp.LLAMA_TOKEN_TYPE_NORMAL)]
+    b = make_tokenizer(renamed, tmp_path)
+    assert a.vocab_fingerprint() != b.vocab_fingerprint()
+    assert b.token_pieces[-1] == ' then'
+
+
+def test_cached_tables_match_built_tables(make_tokenizer, tmp_path):
+    built = make_tokenizer(VOCAB)
+    make_tokenizer(VOCAB, tmp_path)
+    cached = make_tokenizer(VOCAB, tmp_path)
+    assert list(tmp_path.glob('*.npz'))
+    assert cached.token_pieces == built.token_pieces
+    assert cached.token_bytes == built.token_bytes
+    assert cached.token_texts == built.token_texts
+
+
+def test_cache_hit_skips_reading_the_vocabulary(make_tokenizer, tmp_path, monkeypatch):
+    from ai_den.llama_cpp.tokenizer import LlamaCppTokenizer
+
+    model_path = tmp_path / 'model.gguf'
+    model_path.write_bytes(b'weights')
+    llama = type('Llama', (), {'model': object(), 'model_path': str(model_path)})()
+    built = make_tokenizer(VOCAB, tmp_path / 'cache', llama)
+
+    def fail(model, i):
+        raise AssertionError('vocabulary read token by token')
+
+    monkeypatch.setattr(llama_cpp, 'llama_token_get_text', fail)
+    monkeypatch.setattr(llama_cpp, 'llama_token_get_type', fail)
+    cached = LlamaCppTokenizer(llama, cache_dir=tmp_path / 'cache')
+    assert cached.token_texts == built.token_texts
+    assert cached.token_types.tolist() == built.token_types.tolist()
+    assert cached.token_pieces == built.token_pieces
+    assert cached.token_bytes == built.token_bytes
+    assert cached.vocab_fingerprint() == built.vocab_fingerprint()
+    # computed from the tables when they weren't cached
+    assert make_tokenizer(VOCAB).vocab_fingerprint() == built.vocab_fingerprint()
+
+
+def test_detokenizer_joins_split_characters(make_tokenizer):
+    detokenizer = make_tokenizer(VOCAB).detokenizer(skip_special_tokens=True)
+    ids = np.array([1, 5, 3, 4, 6, 2], dtype=np.int64)
+    chunks = list(detokenizer.stream(ids))
+    assert ''.join(chunks) == ' café the'
+    # the first byte of é alone doesn't produce any text
+    assert detokenizer.feed(np.int64(3)) == ''
+    assert detokenizer.feed(np.int32(4)) == 'é'
+
+
+class ScriptedLlama:
+    model = object()
+
+    # 'café the' splits é into its two bytes
+    TOKENS = {'café the': [5, 3, 4, 6], 'the': [6], 'café': [5, 3, 4], '': []}
+
+    def tokenize(self, text, add_bos=True, special=True):
+        ids = self.TOKENS[text.decode()]
+        return [1] + ids if add_bos else ids
+
+
+def test_char_offsets_cover_split_characters(make_tokenizer):
+    tokenizer = make_tokenizer(VOCAB, llama=ScriptedLlama())
+    ids, offsets = tokenizer.encode_with_offsets('café the')
+    assert ids == [1, 5, 3, 4, 6]
+    # the bos token is empty, and both bytes of é map to the whole character
+    assert offsets.tolist() == [[0, 0], [0, 3], [3, 4], [3, 4], [4, 8]]
+
+
+def test_encode_batch_packs_ids_and_offsets(make_tokenizer, monkeypatch):
+    from ai_den.llama_cpp import tokenizer as tokenizer_module
+
+    # several chunks, so that they are tokenized by the thread pool
+    monkeypatch.setattr(tokenizer_module, 'ENCODE_BATCH_CHUNK_SIZE', 2)
+    tokenizer = make_tokenizer(VOCAB, llama=ScriptedLlama())
+    texts = ['café the', 'the', '', 'café', 'the']
+    encoding = tokenizer.encode_batch(texts, return_char_offsets=True, num_threads=2)
+    assert encoding.offsets.tolist() == [0, 5, 7, 8, 12, 14]
+    assert [encoding[i].tolist() for i in range(len(encoding))] == [tokenizer.encode(text) for text in texts]
+    for i, text in enumerate(texts):
+        assert encoding.get_char_offsets(i).tolist() == tokenizer.char_offsets(text, encoding[i]).tolist()
+    assert tokenizer.count_tokens(texts, add_special_tokens=False).tolist() == [4, 1, 0, 3, 1]
+    assert tokenizer.within_budget(texts, 2).tolist() == [False, True, True, False, True]
+    padded, lengths = encoding.to_padded(pad_id=-1, max_length=3, left=True)
+    assert padded.tolist() == [[1, 5, 3], [-1, 1, 6], [-1, -1, 1], [1, 5, 3], [-1, 1, 6]]
+    assert lengths.tolist() == [3, 2, 1, 3, 2]
+
+
+def test_align_words(make_tokenizer):
+    alignment = make_tokenizer(VOCAB, llama=ScriptedLlama()).align_words(['café', 'the'])
+    assert alignment.word_to_tokens.tolist() == [[1, 4], [4, 5]]
+    # the bos token is outside of every word
+    assert alignment.token_to_word.tolist() == [-1, 0, 0, 0, 1]
+    assert alignment.word_span_to_tokens(0, 2) == (1, 5)
+    # a span inside é covers both of its byte tokens
+    assert alignment.char_span_to_tokens(3, 4) == (2, 4)
+
+
+def test_detokenizer_buffers_across_feeds(make_tokenizer):
+    detokenizer = make_tokenizer(VOCAB).detokenizer()
+    assert detokenizer.feed([1, 5, 3]) == '<s> caf'
+    assert detokenizer.feed([4]) == 'é'
+    # an incomplete character is replaced when flushed, and dropped by reset
+    assert detokenizer.feed(3) == ''
+    assert detokenizer.flush() == '\ufffd'
+    detokenizer.feed(3)
+    detokenizer.reset()
+    assert detokenizer.feed(4) == '\ufffd'
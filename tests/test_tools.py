@@ -0,0 +1,72 @@
+from dataclasses import dataclass
+
+import pytest
+from pydantic import ValidationError
+
+pytest.importorskip('llama_cpp')
+
+from ai_den.llama_cpp.data_type import DataType
+from ai_den.llama_cpp.tools import ToolRegistry
+
+
+@dataclass
+class Point:
+    x: int
+    y: int
+
+
+def move(point: Point, dx: int = 1) -> Point:
+    """Moves a point."""
+    return Point(point.x + dx, point.y)
+
+
+def halt(reason: str) -> str:
+    return reason
+
+
+@pytest.fixture
+def tools():
+    tools = ToolRegistry([move])
+    tools.register(name='stop')(halt)
+    return tools
+
+
+def test_call_grammar_is_a_union_of_named_calls(tools):
+    gbnf = tools.data_type.gbnf()
+    assert 'union-1 ::= move_call | stop_call' in gbnf
+    assert r'"\"move\""' in gbnf
+    assert r'"\"stop\""' in gbnf
+    # the optional argument may be left out
+    assert 'move ::= "{" move-point ("," move-dx)? "}"' in gbnf
+    # a single tool needs no union
+    assert 'union' not in ToolRegistry([halt]).data_type.gbnf()
+
+
+def test_parse_and_dispatch_converts_dataclass_arguments(tools):
+    call = tools.parse('{"name": "move", "arguments": {"point": {"x": 1, "y": 2}}}')
+    assert call.name == 'move'
+    assert tools.dispatch(call) == Point(2, 2)
+    assert tools.dispatch(tools.parse('{"name": "stop", "arguments": {"reason": "done"}}')) == 'done'
+    # the name selects the arguments that are validated
+    with pytest.raises(ValidationError):
+        tools.parse('{"name": "stop", "arguments": {"point": {"x": 1, "y": 2}}}')
+
+
+def test_registry(tools):
+    assert len(tools) == 2
+    assert 'stop' in tools
+    assert [schema['function']['name'] for schema in tools.schemas] == ['move', 'stop']
+    assert tools.system_prompt('Be brief.').startswith('Be brief.\n\nYou can call one of the following tools:\n')
+    with pytest.raises(ValueError, match='already registered'):
+        tools.register(move)
+    with pytest.raises(ValueError, match='no tools'):
+        ToolRegistry().data_type
+
+
+@pytest.mark.parametrize('schema,rule', [
+    ({'const': 'x'}, r'"\"x\""'),
+    ({'oneOf': [{'type': 'integer'}, {'type': 'null'}]}, 'integer | null'),
+    ({'type': ['integer', 'null']}, 'integer | null'),
+])
+def test_const_one_of_and_type_lists(schema, rule):
+    assert DataType.from_schema(schema).gbnf().splitlines()[1].split(' ::= ')[1] == rule
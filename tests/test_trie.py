@@ -0,0 +1,53 @@
+import pytest
+
+pytest.importorskip('llama_cpp')
+
+from ai_den.llama_cpp.trie import VocabTrie
+
+from test_tokenizer import VOCAB
+
+
+PIECES = [b'ab', b'a', b'', b'b', b'abc']
+
+
+def test_build_flat_arrays():
+    trie = VocabTrie.from_pieces(PIECES)
+    # preorder nodes: root, a, ab, abc, b
+    assert len(trie) == 5
+    assert trie.edge_offsets.tolist() == [0, 2, 3, 4, 4, 4]
+    assert trie.edge_labels.tobytes() == b'abbc'
+    assert trie.edge_targets.tolist() == [1, 4, 2, 3]
+    assert trie.subtree_end.tolist() == [5, 4, 4, 4, 5]
+    # tokens in piece order, without the empty piece
+    assert trie.token_offsets.tolist() == [0, 0, 1, 2, 3, 4]
+    assert trie.token_ids.tolist() == [1, 0, 4, 3]
+
+
+def test_prefix_lookups():
+    trie = VocabTrie.from_pieces(PIECES)
+    assert trie.find('x') == -1
+    assert trie.exact('ab').tolist() == [0]
+    assert trie.with_prefix('ab').tolist() == [0, 4]
+    assert trie.with_prefix('').tolist() == [1, 0, 4, 3]
+    assert trie.prefixes_of('abcd').tolist() == [1, 0, 4]
+    assert trie.prefixes_of('abc', proper=True).tolist() == [1, 0]
+    assert trie.continuations('ab').tolist() == [1, 0, 4]
+    assert trie.substrings_of('xab').tolist() == [0, 1, 3]
+
+
+def test_cache_reuse_by_vocab_fingerprint(make_tokenizer, tmp_path, monkeypatch):
+    tokenizer = make_tokenizer(VOCAB)
+    built = VocabTrie.from_tokenizer(tokenizer, tmp_path)
+    assert [p.name for p in tmp_path.iterdir()] == [f'{tokenizer.vocab_fingerprint()}.trie.npz']
+
+    def fail(pieces):
+        raise AssertionError('trie rebuilt')
+
+    with monkeypatch.context() as m:
+        m.setattr(VocabTrie, 'from_pieces', fail)
+        cached = VocabTrie.from_tokenizer(make_tokenizer(VOCAB), tmp_path)
+    assert cached.token_ids.tolist() == built.token_ids.tolist()
+    assert cached.with_prefix(' ca').tolist() == [5]
+    # a different vocabulary gets its own trie
+    VocabTrie.from_tokenizer(make_tokenizer(VOCAB[:-1]), tmp_path)
+    assert len(list(tmp_path.iterdir())) == 2